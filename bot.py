@@ -7,11 +7,20 @@ Transforms voice, text, and photos into Google Calendar events
 import os
 import sqlite3
 import json
-import tempfile
+import io
+import logging
+import logging.handlers
+import queue
 import time as time_module
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+import signal
+import secrets
+from datetime import datetime, timedelta, date as date_type
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Dict, List, NamedTuple
 import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse, urlunparse
 import re
 from aiohttp import web
 
@@ -31,6 +40,7 @@ from telegram.ext import (
     filters,
 )
 from telegram.error import Conflict
+from google.auth.transport.requests import Request
 
 # Импорты сервисов
 from services.ai_service import parse_with_ai, transcribe_voice, extract_events_from_image
@@ -39,72 +49,299 @@ from services.calendar_service import (
     exchange_code_for_tokens,
     get_credentials_from_stored,
     create_event,
+    create_events_batch,
+    reschedule_events_batch,
     mark_event_done,
     reschedule_event,
     check_availability,
     check_slot_availability,
     find_next_free_slot,
-    cancel_event
+    cancel_event,
+    get_calendar_service,
 )
 from services.scheduler_service import get_today_events, get_events_for_date
 from services.analytics_service import track_event
 from services.scheduler_service import start_scheduler
-from services.db_service import get_google_tokens, save_google_tokens, delete_google_tokens
-
-# ---- timezonefinder (pure Python) ----
-try:
-    from timezonefinder import TimezoneFinder
-except Exception:
-    TimezoneFinder = None
+from services.db_service import get_db_connection, get_google_tokens, save_google_tokens, delete_google_tokens
+from services.time_utils import parse_iso_aware, get_tz
+from services.short_ids import mint_short_ids, mint_short_id, resolve_short_id, CALLBACK_MAP_TTL_DAYS
 
 # ----------------- Config -----------------
 
 DB_PATH = os.getenv("DB_PATH", "tasks.db")
 DEFAULT_TZ = os.getenv("DEFAULT_TZ", "UTC")
 MAX_VOICE_DURATION_SECONDS = 20  # Максимальная длительность голосовых сообщений в секундах
+_GCAL_CONCURRENCY = 10  # Максимум параллельных запросов к Google Calendar (квоты на пользователя)
+
+logger = logging.getLogger("bot")
+
+TF = None  # lazy TimezoneFinderL singleton (False — пакет недоступен)
+TF_FULL = None  # lazy полигонный TimezoneFinder, только если TimezoneFinderL не ответил
+_UTC = pytz.utc
+
+
+# Каноничные имена таймзон по lower-case ключу: проверка ручного ввода — поиск в dict
+# вместо pytz.timezone + исключения на каждую опечатку. Сохраняем каноничное имя
+# ("europe/london" -> "Europe/London"), его же принимает Google Calendar.
+_TZ_NAMES = {name.lower(): name for name in pytz.all_timezones}
+
+
+def _canonical_tz_name(text: str) -> Optional[str]:
+    """Каноничное имя таймзоны из ввода пользователя или None, если такой нет"""
+    return _TZ_NAMES.get(text.strip().lower())
+
 
-TF = None  # lazy TimezoneFinder singleton
+_TASK_BUTTON_PREFIXES = (
+    "done_", "resch_", "del_", "label_", "reschedule_", "delete_", "cancel_", "reschedule_manual_",
+)
 
 
 def _remove_task_row(inline_keyboard: list, event_id: str) -> list:
     """
     Removes every row from inline_keyboard that contains any button
     referencing event_id (works for both single-row and old 2-row layouts).
+    Pass the reference exactly as it appears in callback_data (short "~id" or full event_id).
+    Returns inline_keyboard itself (same object) if no row matched.
     """
+    exact = {f"{prefix}{event_id}" for prefix in _TASK_BUTTON_PREFIXES}
+    confirm_prefixes = (f"confirm_move_{event_id}|", f"confirm_move_{event_id}_")
+
     def row_has_event(row):
         for btn in row:
             cd = btn.callback_data or ""
-            if (cd == f"done_{event_id}" or
-                cd == f"resch_{event_id}" or
-                cd == f"del_{event_id}" or
-                cd == f"label_{event_id}" or
-                cd == f"reschedule_{event_id}" or
-                cd == f"delete_{event_id}" or
-                cd == f"cancel_{event_id}" or
-                cd == f"reschedule_manual_{event_id}" or
-                cd.startswith(f"confirm_move_{event_id}|") or
-                cd.startswith(f"confirm_move_{event_id}_")):
+            if cd in exact or cd.startswith(confirm_prefixes):
                 return True
         return False
 
-    return [row for row in inline_keyboard if not row_has_event(row)]
+    new_keyboard = [row for row in inline_keyboard if not row_has_event(row)]
+    return inline_keyboard if len(new_keyboard) == len(inline_keyboard) else new_keyboard
 
 
-def _build_task_row(event_id: str, label_text: str) -> list:
+def _build_task_row(ref: str, label_text: str) -> list:
     """Returns two keyboard rows: full-width label, then [✅, ➡️, ❌].
+    ref — ссылка на событие из mint_short_ids.
     Telegram splits button widths equally within a row, so putting the label
     on its own row is the only reliable way to make it visually wider."""
     label_text = label_text[:55] if len(label_text) > 55 else label_text
     return [
-        [InlineKeyboardButton(label_text, callback_data=f"label_{event_id}")],
+        [InlineKeyboardButton(label_text, callback_data=f"label_{ref}")],
         [
-            InlineKeyboardButton("✅", callback_data=f"done_{event_id}"),
-            InlineKeyboardButton("➡️", callback_data=f"resch_{event_id}"),
-            InlineKeyboardButton("❌", callback_data=f"del_{event_id}"),
+            InlineKeyboardButton("✅", callback_data=f"done_{ref}"),
+            InlineKeyboardButton("➡️", callback_data=f"resch_{ref}"),
+            InlineKeyboardButton("❌", callback_data=f"del_{ref}"),
         ],
     ]
 
 
+def _fmt_event_time(event: Dict, tz) -> str:
+    """Время начала события в таймзоне пользователя ('HH:MM'), '' для событий на весь день"""
+    start_hm = event.get('start_hm')
+    if start_hm is not None:
+        return start_hm  # уже посчитано в таймзоне пользователя при загрузке списка
+    start_time = event.get('start_time', '')
+    # Google отдаёт RFC3339; дешёвая проверка формата вместо try/except на каждое событие
+    if len(start_time) < 19 or start_time[4] != '-' or start_time[10] != 'T':
+        return ""
+    return parse_iso_aware(start_time).astimezone(tz).strftime('%H:%M')
+
+
+# Telegram ограничивает размер inline-клавиатуры; у задачи 4 кнопки в двух строках
+MAX_INLINE_TASKS = 20
+
+
+def _render_task_list(events: List[Dict], tz, intro: str, chat_id: int,
+                      leftovers_label: str = "📋 Tasks to complete:\n",
+                      all_done_text: str = "🎉 All tasks completed! Great job!") -> tuple:
+    """
+    Рендерит список задач за один проход по событиям: выполненные (✅) — в текст,
+    невыполненные — кнопками, отменённые (❌) скрываются.
+    Returns (message_text, keyboard_rows).
+    """
+    completed_lines = []
+    task_rows = []  # (event_id, label) — кнопки строим после пакетной выдачи short id
+    has_incomplete = False
+    shown = hidden = 0
+    for event in events:
+        summary = event.get('summary', 'Task')
+        mark = summary[:2]  # один срез вместо двух startswith на событие
+        if mark == '❌ ':
+            continue
+        if mark == '✅ ':
+            time_str = _fmt_event_time(event, tz)
+            summary = summary[2:]
+            completed_lines.append(f"  • {time_str} {summary}\n" if time_str else f"  • {summary}\n")
+            continue
+        has_incomplete = True
+        event_id = event.get('id', '')
+        if not event_id:
+            continue
+        if shown >= MAX_INLINE_TASKS:
+            hidden += 1
+            continue
+        shown += 1
+        time_str = _fmt_event_time(event, tz)
+        task_rows.append((event_id, f"{time_str} {summary}" if time_str else summary))
+
+    keyboard = []
+    if task_rows:
+        refs = mint_short_ids([event_id for event_id, _ in task_rows], chat_id)
+        for event_id, label in task_rows:
+            keyboard.extend(_build_task_row(refs[event_id], label))
+
+    parts = [intro]
+    if completed_lines:
+        parts.append("✅ Completed:\n")
+        parts.extend(completed_lines)
+        parts.append("\n")
+    parts.append(leftovers_label if has_incomplete else all_done_text)
+    if hidden:
+        parts.append(f"\n… and {hidden} more — mark some as done to see the rest")
+    return "".join(parts), keyboard
+
+
+# Последний отрисованный список задач на сегодня (user_data), чтобы после ✅
+# перерисовать его локально, без повторного events().list
+_TODAY_EVENTS_KEY = '_last_today_events'
+_TODAY_EVENTS_TTL = 120
+
+
+def _remember_today_events(context: ContextTypes.DEFAULT_TYPE, events: List[Dict]):
+    context.user_data[_TODAY_EVENTS_KEY] = (events, time_module.monotonic() + _TODAY_EVENTS_TTL)
+
+
+def _invalidate_today_events(context: ContextTypes.DEFAULT_TYPE):
+    """Сбрасывает кэш списка — вызывать при любом изменении событий в календаре"""
+    context.user_data.pop(_TODAY_EVENTS_KEY, None)
+
+
+def _today_events_after_done(context: ContextTypes.DEFAULT_TYPE, event_id: str) -> Optional[List[Dict]]:
+    """Кэшированный список с отмеченной задачей event_id или None, если кэш устарел/не подходит"""
+    cached = context.user_data.get(_TODAY_EVENTS_KEY)
+    if not cached or cached[1] <= time_module.monotonic():
+        return None
+    events = cached[0]
+    for event in events:
+        if event.get('id') == event_id:
+            summary = event.get('summary', 'Task')
+            if not summary.startswith('✅ '):
+                event['summary'] = f"✅ {summary}"
+            return events
+    return None
+
+
+_CONFIRM_MOVE_RE = re.compile(r"^([^|]+)\|(.+)$")  # payload confirm_move_: {event_id}|{timestamp}
+_CYRILLIC_RE = re.compile(r"[\u0400-\u04FF]")
+_CLOCK_TIME_RE = re.compile(r"(\d{1,2}):(\d{2})")
+_CLOCK_TIME_WORD_RE = re.compile(r"\b(\d{1,2}):(\d{2})\b")
+_NON_WORD_RE = re.compile(r"\W+")
+_DURATION_HOURS_RE = re.compile(r"(\d+(\.\d+)?)\s*(h|hr|hour|hours)\b")
+_DURATION_MINUTES_RE = re.compile(r"(\d+)\s*(m|min|mins|minute|minutes)\b")
+
+
+# Время и числовые даты разбираем split/isdecimal, без regex: форма входа фиксированная
+# (пара групп по 1-2 цифры), а _parse_hhmm вызывается на каждый токен ввода.
+# isdecimal — ровно то, что матчил \d, и всё, что принимает int().
+
+def _parse_hhmm(text: str) -> Optional[str]:
+    """Нормализует ввод вида H:MM / HH:MM в 'HH:MM', иначе None"""
+    hh, sep, mm = text.partition(":")
+    if not sep:
+        return None
+    hh = hh.strip()
+    mm = mm.strip()
+    if not (0 < len(hh) <= 2 and 0 < len(mm) <= 2 and hh.isdecimal() and mm.isdecimal()):
+        return None
+    hour, minute = int(hh), int(mm)
+    return f"{hour:02d}:{minute:02d}" if hour <= 23 and minute <= 59 else None
+
+
+_RESCHEDULE_DAY_OFFSETS = {
+    "today": 0, "сегодня": 0,
+    "tomorrow": 1, "завтра": 1,
+}
+_RESCHEDULE_WEEKDAYS = {
+    "mon": 0, "monday": 0, "пн": 0, "понедельник": 0,
+    "tue": 1, "tuesday": 1, "вт": 1, "вторник": 1,
+    "wed": 2, "wednesday": 2, "ср": 2, "среда": 2, "среду": 2,
+    "thu": 3, "thursday": 3, "чт": 3, "четверг": 3,
+    "fri": 4, "friday": 4, "пт": 4, "пятница": 4, "пятницу": 4,
+    "sat": 5, "saturday": 5, "сб": 5, "суббота": 5, "субботу": 5,
+    "sun": 6, "sunday": 6, "вс": 6, "воскресенье": 6,
+}
+
+
+
+
+def _parse_numeric_date(text: str, today) -> Optional[date_type]:
+    """Дата вида YYYY-MM-DD, DD.MM, DD.MM.YY(YY) или DD/MM[/YYYY]; без года — текущий год"""
+    try:
+        parts = text.split("-")
+        if len(parts) == 3:
+            y, mo, d = parts
+            if (len(y) == 4 and 0 < len(mo) <= 2 and 0 < len(d) <= 2
+                    and y.isdecimal() and mo.isdecimal() and d.isdecimal()):
+                return date_type(int(y), int(mo), int(d))
+            return None
+        parts = text.replace("/", ".").split(".")
+        if len(parts) in (2, 3) and all(p.isdecimal() for p in parts):
+            if len(parts[0]) > 2 or len(parts[1]) > 2:
+                return None
+            if len(parts) == 2:
+                year = today.year
+            elif len(parts[2]) in (2, 4):
+                year = int(parts[2])
+                if year < 100:
+                    year += 2000
+            else:
+                return None
+            return date_type(year, int(parts[1]), int(parts[0]))
+    except ValueError:
+        pass  # 31.02 и т.п. — пусть разбирает AI
+    return None
+
+
+def _fast_parse_reschedule(text: str, tz, now_local: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Локальный разбор самых частых форматов переноса без обращения к AI:
+    "HH:MM", "today/tomorrow HH:MM", "<weekday> HH:MM" (в любом порядке).
+    Возвращает локальный datetime или None, если формат не распознан.
+    """
+    tokens = text.strip().lower().split()
+    if not tokens or len(tokens) > 2:
+        return None
+    time_str = None
+    day_word = None
+    for token in tokens:
+        parsed = _parse_hhmm(token)
+        if parsed and time_str is None:
+            time_str = parsed
+        else:
+            day_word = token
+    if not time_str:
+        return None
+
+    if now_local is None:
+        now_local = datetime.now(tz)
+    today = now_local.date()
+    hour, minute = int(time_str[:2]), int(time_str[3:])
+
+    def _at(day) -> datetime:
+        return tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+
+    if day_word is None:
+        # Сегодня, если время ещё не прошло, иначе завтра
+        candidate = _at(today)
+        return candidate if candidate > now_local else _at(today + timedelta(days=1))
+    if day_word in _RESCHEDULE_DAY_OFFSETS:
+        return _at(today + timedelta(days=_RESCHEDULE_DAY_OFFSETS[day_word]))
+    weekday = _RESCHEDULE_WEEKDAYS.get(day_word)
+    if weekday is None:
+        return None
+    days_ahead = (weekday - today.weekday()) % 7
+    candidate = _at(today + timedelta(days=days_ahead))
+    return candidate if candidate > now_local else _at(today + timedelta(days=days_ahead or 7))
+
+
 def _parse_duration_to_minutes(text: str) -> int:
     """
     Parses task duration from text and returns the number of minutes.
@@ -137,7 +374,7 @@ def _parse_duration_to_minutes(text: str) -> int:
                 pass
 
     # Hour formats, e.g., "1.5h", "2 hours"
-    hour_match = re.search(r"(\d+(\.\d+)?)\s*(h|hr|hour|hours)\b", s)
+    hour_match = _DURATION_HOURS_RE.search(s)
     if hour_match:
         hours = float(hour_match.group(1))
         total = int(hours * 60)
@@ -147,7 +384,7 @@ def _parse_duration_to_minutes(text: str) -> int:
             raise ValueError(f"Duration cannot exceed {MAX_DURATION_MINUTES} minutes (24 hours)")
 
     # Minute formats, e.g., "30m", "45 min"
-    minute_match = re.search(r"(\d+)\s*(m|min|mins|minute|minutes)\b", s)
+    minute_match = _DURATION_MINUTES_RE.search(s)
     if minute_match:
         minutes = int(minute_match.group(1))
         if 0 < minutes <= MAX_DURATION_MINUTES:
@@ -168,12 +405,32 @@ def _parse_duration_to_minutes(text: str) -> int:
     raise ValueError(f"Cannot parse duration from '{text}'")
 
 
+# Ключи user_data ручного переноса. reschedule_prompt_msg_id сюда не входит:
+# его забирает _clear_reschedule_prompt, чтобы убрать кнопку отмены у подсказки
+_RESCHEDULE_STATE_KEYS = ('waiting_for', 'rescheduling_event_id', 'reschedule_conflict_start')
+
+
 def _clear_reschedule_state(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Clear all reschedule-related state variables"""
-    for key in ['waiting_for', 'rescheduling_event_id', 'reschedule_conflict_start', 'reschedule_prompt_msg_id']:
+    for key in _RESCHEDULE_STATE_KEYS + ('reschedule_prompt_msg_id',):
         context.user_data.pop(key, None)
 
 
+@asynccontextmanager
+async def _reschedule_state(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Очищает состояние ручного переноса при выходе из блока.
+    Чтобы сохранить состояние (ждём новое время/длительность), выставьте keep["v"] = True.
+    """
+    keep = {"v": False}
+    try:
+        yield keep
+    finally:
+        if not keep["v"]:
+            for key in _RESCHEDULE_STATE_KEYS:
+                context.user_data.pop(key, None)
+
+
 async def _clear_reschedule_prompt(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
     """Remove the inline cancel button from the reschedule prompt message."""
     msg_id = context.user_data.pop('reschedule_prompt_msg_id', None)
@@ -188,19 +445,31 @@ async def _clear_reschedule_prompt(context: ContextTypes.DEFAULT_TYPE, chat_id:
             pass
 
 
+# Ключи user_data предпросмотра задачи (включая ожидание длительности) и импорта расписания
+_EVENT_PREVIEW_STATE_KEYS = ('pending_event_preview', 'pending_event_source', 'pending_event_data', 'waiting_for')
+_SCHEDULE_IMPORT_STATE_KEYS = ('state', 'pending_schedule', 'waiting_for', 'pending_schedule_preview',
+                               'pending_event_source', 'schedule_weeks_prompt_msg_id')
+
+
 def _clear_event_preview_state(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Clear all event preview state variables"""
-    for key in ['pending_event_preview', 'pending_event_source', 'pending_event_data', 'waiting_for']:
+    for key in _EVENT_PREVIEW_STATE_KEYS:
         context.user_data.pop(key, None)
 
 
 def _clear_schedule_import_state(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Clear all schedule import state variables"""
-    for key in ['state', 'pending_schedule', 'waiting_for', 'pending_schedule_preview', 'pending_event_source',
-                'schedule_weeks_prompt_msg_id']:
+    for key in _SCHEDULE_IMPORT_STATE_KEYS:
         context.user_data.pop(key, None)
 
 
+def _clear_dialog_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сбрасывает все незавершённые диалоги — при /start и переходе в меню"""
+    _clear_reschedule_state(context)
+    _clear_event_preview_state(context)
+    _clear_schedule_import_state(context)
+
+
 async def _clear_schedule_weeks_prompt(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
     """Remove the inline cancel button from the 'for how many weeks?' prompt message."""
     msg_id = context.user_data.pop('schedule_weeks_prompt_msg_id', None)
@@ -260,7 +529,18 @@ async def _get_credentials_or_notify(chat_id: int, stored_tokens: dict, reply_fn
 
 
 # ----------------- Menus -----------------
-
+# Тексты кнопок: одна константа и для клавиатуры, и для сравнения с входящим текстом
+_BTN_ENTER_MANUAL = "✏️ Enter Manually"
+_BTN_ENTER_CITY = "✏️ Enter City Manually"
+_BTN_UTC_LIST = "🌍 Choose from UTC List"
+_BTN_BACK = "⬅️ Back"
+_BTN_CUSTOM = "✏️ Custom"
+
+# Статичные клавиатуры собираем один раз (lru_cache): объекты telegram неизменяемы,
+# поэтому один и тот же экземпляр можно отправлять в любом сообщении.
+_KEYBOARD_REMOVE = ReplyKeyboardRemove()
+
+@lru_cache(maxsize=None)
 def build_main_menu() -> ReplyKeyboardMarkup:
     """Создает главное меню на английском"""
     keyboard = [
@@ -272,16 +552,18 @@ def build_main_menu() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, is_persistent=True)
 
 
+@lru_cache(maxsize=None)
 def build_timezone_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для выбора таймзоны (3 варианта)"""
     keyboard = [
         [KeyboardButton("📍 Share Location", request_location=True)],
-        [KeyboardButton("✏️ Enter City Manually")],
-        [KeyboardButton("🌍 Choose from UTC List")]
+        [KeyboardButton(_BTN_ENTER_CITY)],
+        [KeyboardButton(_BTN_UTC_LIST)]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 
+@lru_cache(maxsize=None)
 def build_utc_list_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру со списком UTC таймзон"""
     timezones = [
@@ -291,7 +573,7 @@ def build_utc_list_keyboard() -> ReplyKeyboardMarkup:
         ["UTC+0", "UTC+1", "UTC+2", "UTC+3"],
         ["UTC+4", "UTC+5", "UTC+6", "UTC+7"],
         ["UTC+8", "UTC+9", "UTC+10", "UTC+11"],
-        ["UTC+12", "⬅️ Back"]
+        ["UTC+12", _BTN_BACK]
     ]
     return ReplyKeyboardMarkup(timezones, resize_keyboard=True, one_time_keyboard=True)
 
@@ -302,7 +584,10 @@ def init_db():
     con = sqlite3.connect(DB_PATH)
     con.execute("PRAGMA journal_mode=WAL")
     con.execute("PRAGMA synchronous=NORMAL")
+    # Вся схема и миграции — одной транзакцией (один fsync на старте)
+    con.isolation_level = None
     cur = con.cursor()
+    cur.execute("BEGIN")
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS settings (
@@ -371,180 +656,259 @@ def init_db():
         )
         """
     )
-    con.commit()
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS callback_map (
+            short_id TEXT PRIMARY KEY,
+            event_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            created_utc TEXT NOT NULL
+        )
+        """
+    )
+    # callback_map растёт на каждую отрисованную кнопку; индекс по created_utc
+    # превращает чистку ниже из полного скана в range scan
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_callback_map_created ON callback_map(created_utc)")
+    # Кнопки старше месяца уже неактуальны — чистим их ссылки
+    cur.execute(
+        "DELETE FROM callback_map WHERE created_utc < ?",
+        ((datetime.now(_UTC) - timedelta(days=CALLBACK_MAP_TTL_DAYS)).isoformat(),)
+    )
+    cur.execute("COMMIT")
+    # Обновляет статистику планировщика только там, где она устарела (дешевле ANALYZE)
+    cur.execute("PRAGMA optimize")
     con.close()
 
 
-def get_con():
-    return sqlite3.connect(DB_PATH, timeout=10.0)
+# ----------------- Helpers -----------------
 
+# Строка settings нужна почти в каждом хендлере, а меняется только через set_* ниже —
+# кэшируем её целиком: chat_id -> (row или None, время истечения по monotonic).
+# Все set_* сбрасывают запись после commit.
+_SETTINGS_CACHE: Dict[int, tuple] = {}
+_SETTINGS_CACHE_TTL = 300
+_SETTINGS_CACHE_MAX = 10000
+
+
+class _Settings(NamedTuple):
+    """Строка settings; порядок полей совпадает с SELECT в _settings_row"""
+    tz: Optional[str]
+    user_name: Optional[str]
+    morning_time: Optional[str]
+    evening_time: Optional[str]
+    use_default_duration: int
+    default_task_duration: int
+    onboard_done: int
+
+
+def _settings_row(chat_id: int) -> Optional[_Settings]:
+    """Настройки пользователя (из кэша) или None, если строки ещё нет"""
+    now = time_module.monotonic()
+    cached = _SETTINGS_CACHE.get(chat_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            SELECT tz, user_name, morning_time, evening_time,
+                   use_default_duration, default_task_duration, onboard_done
+            FROM settings WHERE chat_id=?
+            """,
+            (chat_id,),
+        )
+        row = cur.fetchone()
+    if row is not None:
+        row = _Settings._make(row)
+    if len(_SETTINGS_CACHE) >= _SETTINGS_CACHE_MAX:
+        _SETTINGS_CACHE.clear()
+    _SETTINGS_CACHE[chat_id] = (row, now + _SETTINGS_CACHE_TTL)
+    return row
+
+
+def _invalidate_settings(chat_id: int):
+    _SETTINGS_CACHE.pop(chat_id, None)
 
-# ----------------- Helpers -----------------
 
 def get_user_timezone(chat_id: int) -> Optional[str]:
     """Получает таймзону пользователя"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT tz FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return row[0] if row else None
+    row = _settings_row(chat_id)
+    return row.tz if row else None
+
+
+def _user_tz(chat_id: int) -> str:
+    """Таймзона пользователя или DEFAULT_TZ"""
+    return get_user_timezone(chat_id) or DEFAULT_TZ
 
 
 def get_user_name(chat_id: int) -> Optional[str]:
     """Получает имя пользователя"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT user_name FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return row[0] if row else None
+    row = _settings_row(chat_id)
+    return row.user_name if row else None
 
 
 def get_morning_time(chat_id: int) -> str:
     """Получает время утренней сводки в формате HH:MM"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT morning_time FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return row[0] if row and row[0] else "09:00"
+    row = _settings_row(chat_id)
+    return row.morning_time if row and row.morning_time else "09:00"
 
 
 def get_evening_time(chat_id: int) -> str:
     """Получает время вечерней сводки в формате HH:MM"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT evening_time FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return row[0] if row and row[0] else "21:00"
+    row = _settings_row(chat_id)
+    return row.evening_time if row and row.evening_time else "21:00"
 
 
+# set_*: один UPSERT без подзапросов. Новая строка получает onboard_done из DEFAULT
+# колонки, а ON CONFLICT обновляет только перечисленные поля — остальные не трогаются.
 def set_user_timezone(chat_id: int, tzname: str):
     """Устанавливает таймзону пользователя"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (chat_id, tz, morning_time, evening_time, onboard_done)
-        VALUES (?, ?, ?, ?, COALESCE((SELECT onboard_done FROM settings WHERE chat_id=?), 0))
-        ON CONFLICT(chat_id) DO UPDATE SET tz=excluded.tz
-        """,
-        (chat_id, tzname, "09:00", "21:00", chat_id),
-    )
-    con.commit()
-    con.close()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO settings (chat_id, tz, morning_time, evening_time)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET tz=excluded.tz
+            """,
+            (chat_id, tzname, "09:00", "21:00"),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
 
 
 def set_user_name(chat_id: int, name: str):
     """Устанавливает имя пользователя"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (chat_id, user_name, morning_time, evening_time, onboard_done)
-        VALUES (?, ?, ?, ?, COALESCE((SELECT onboard_done FROM settings WHERE chat_id=?), 0))
-        ON CONFLICT(chat_id) DO UPDATE SET user_name=excluded.user_name
-        """,
-        (chat_id, name, "09:00", "21:00", chat_id),
-    )
-    con.commit()
-    con.close()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO settings (chat_id, user_name, morning_time, evening_time)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET user_name=excluded.user_name
+            """,
+            (chat_id, name, "09:00", "21:00"),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
 
 
 def set_morning_time(chat_id: int, time_str: str):
     """Устанавливает время утренней сводки в формате HH:MM"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (chat_id, morning_time, evening_time, onboard_done)
-        VALUES (?, ?, ?, COALESCE((SELECT onboard_done FROM settings WHERE chat_id=?), 0))
-        ON CONFLICT(chat_id) DO UPDATE SET morning_time=excluded.morning_time
-        """,
-        (chat_id, time_str, "21:00", chat_id),
-    )
-    con.commit()
-    con.close()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO settings (chat_id, morning_time, evening_time)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET morning_time=excluded.morning_time
+            """,
+            (chat_id, time_str, "21:00"),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
 
 
 def set_evening_time(chat_id: int, time_str: str):
     """Устанавливает время вечерней сводки в формате HH:MM"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (chat_id, morning_time, evening_time, onboard_done)
-        VALUES (?, ?, ?, COALESCE((SELECT onboard_done FROM settings WHERE chat_id=?), 0))
-        ON CONFLICT(chat_id) DO UPDATE SET evening_time=excluded.evening_time
-        """,
-        (chat_id, "09:00", time_str, chat_id),
-    )
-    con.commit()
-    con.close()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO settings (chat_id, morning_time, evening_time)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET evening_time=excluded.evening_time
+            """,
+            (chat_id, "09:00", time_str),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
 
 
 def get_use_default_duration(chat_id: int) -> bool:
     """Получает флаг использования дефолтной длительности задач"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT use_default_duration FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return bool(row[0]) if row else False
+    row = _settings_row(chat_id)
+    return bool(row.use_default_duration) if row else False
 
 
 def get_default_task_duration(chat_id: int) -> int:
     """Получает дефолтную длительность задачи в минутах"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT default_task_duration FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return row[0] if row else 30
+    row = _settings_row(chat_id)
+    return row.default_task_duration if row else 30
 
 
 def set_default_duration_settings(chat_id: int, use_default: bool, duration_minutes: int):
     """Устанавливает настройки дефолтной длительности задач"""
-    con = get_con()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (chat_id, use_default_duration, default_task_duration, onboard_done)
-        VALUES (?, ?, ?, COALESCE((SELECT onboard_done FROM settings WHERE chat_id=?), 0))
-        ON CONFLICT(chat_id) DO UPDATE SET 
-            use_default_duration=excluded.use_default_duration,
-            default_task_duration=excluded.default_task_duration
-        """,
-        (chat_id, int(use_default), duration_minutes, chat_id),
-    )
-    con.commit()
-    con.close()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO settings (chat_id, use_default_duration, default_task_duration)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET 
+                use_default_duration=excluded.use_default_duration,
+                default_task_duration=excluded.default_task_duration
+            """,
+            (chat_id, int(use_default), duration_minutes),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
+
+
+_PROFILE_COLUMNS = {
+    "name": "user_name",
+    "tz": "tz",
+    "morning": "morning_time",
+    "evening": "evening_time",
+    "use_default_duration": "use_default_duration",
+    "default_task_duration": "default_task_duration",
+}
+
+
+def set_user_profile(chat_id: int, **fields):
+    """Обновляет несколько полей профиля одним UPSERT (None — не трогать)"""
+    values = {
+        _PROFILE_COLUMNS[key]: (int(value) if isinstance(value, bool) else value)
+        for key, value in fields.items()
+        if value is not None
+    }
+    if not values:
+        return
+    columns = ", ".join(values)
+    placeholders = ", ".join("?" for _ in values)
+    updates = ", ".join(f"{col}=excluded.{col}" for col in values)
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO settings (chat_id, {columns})
+            VALUES (?, {placeholders})
+            ON CONFLICT(chat_id) DO UPDATE SET {updates}
+            """,
+            (chat_id, *values.values()),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
 
 
 def is_onboarded(chat_id: int) -> bool:
-    con = get_con()
-    cur = con.cursor()
-    cur.execute("SELECT onboard_done FROM settings WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    con.close()
-    return bool(row and int(row[0]) == 1)
+    row = _settings_row(chat_id)
+    return bool(row and int(row.onboard_done) == 1)
 
 
 def set_onboarded(chat_id: int, done: bool = True):
-    con = get_con()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO settings (chat_id, tz, onboard_done)
-        VALUES (?, COALESCE((SELECT tz FROM settings WHERE chat_id=?), ?), ?)
-        ON CONFLICT(chat_id) DO UPDATE SET onboard_done=excluded.onboard_done
-        """,
-        (chat_id, chat_id, DEFAULT_TZ, 1 if done else 0),
-    )
-    con.commit()
-    con.close()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO settings (chat_id, tz, onboard_done)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET onboard_done=excluded.onboard_done
+            """,
+            (chat_id, DEFAULT_TZ, 1 if done else 0),
+        )
+        con.commit()
+    _invalidate_settings(chat_id)
 
 
 def has_google_auth(user_id: int) -> bool:
@@ -555,18 +919,31 @@ def has_google_auth(user_id: int) -> bool:
 
 
 def tz_from_location(lat: float, lon: float) -> Optional[str]:
-    """Определяет таймзону по геолокации"""
-    global TF
-    if TF is None and TimezoneFinder is not None:
+    """
+    Определяет таймзону по геолокации.
+    Сначала TimezoneFinderL (сетка без полигонов: быстро и почти без памяти; у границ
+    может ошибиться, но для выбора таймзоны пользователя этого достаточно), и только
+    если он не ответил — полный TimezoneFinder с полигонами.
+    """
+    global TF, TF_FULL
+    if TF is None:
+        # timezonefinder тянет numpy и данные — импортируем только
+        # при первой геолокации, а не на старте бота
         try:
-            TF = TimezoneFinder(in_memory=True)
+            from timezonefinder import TimezoneFinderL
+            TF = TimezoneFinderL(in_memory=True)
         except Exception:
-            TF = None
-    if TF is None:
+            TF = False
+    if not TF:
         return None
     try:
-        tz = TF.timezone_at(lat=lat, lng=lon) or TF.certain_timezone_at(lat=lat, lng=lon)
-        return tz
+        tz = TF.timezone_at(lat=lat, lng=lon)
+        if tz:
+            return tz
+        if TF_FULL is None:
+            from timezonefinder import TimezoneFinder
+            TF_FULL = TimezoneFinder(in_memory=True)
+        return TF_FULL.timezone_at(lat=lat, lng=lon) or TF_FULL.certain_timezone_at(lat=lat, lng=lon)
     except Exception:
         return None
 
@@ -637,10 +1014,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Очищаем любые активные состояния (например, ожидание ответа о неделях)
     # user_data всегда доступен в telegram.ext контекстах
-    context.user_data.pop('state', None)
-    context.user_data.pop('pending_schedule', None)
-    context.user_data.pop('waiting_for', None)
-    context.user_data.pop('rescheduling_event_id', None)
+    _clear_dialog_state(context)
     
     # Проверяем, прошел ли онбординг
     if is_onboarded(chat_id):
@@ -675,14 +1049,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Every evening, I'll send you a <u>brief summary of your day,</u> and we'll reflect on\n"
         "• what can be transferred to the next day\n"
         "• and what can be forgotten.\n\n"
-        "Let's set you up✨",
-        parse_mode='HTML'
-    )
-    
-    # Шаг 2: Вопрос об имени
-    await update.message.reply_text(
+        "Let's set you up✨\n\n"
+        # Шаг 2: вопрос об имени — тем же сообщением, один запрос к Telegram вместо двух
         "1️⃣ How should I address you?",
-        reply_markup=ReplyKeyboardRemove()
+        parse_mode='HTML',
+        reply_markup=_KEYBOARD_REMOVE
     )
     context.chat_data['onboard_stage'] = 'ask_name'
 
@@ -754,20 +1125,22 @@ async def ask_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.chat_data['onboard_stage'] = 'timezone'
 
 
+@lru_cache(maxsize=None)
 def build_morning_time_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для выбора времени утренней сводки"""
     keyboard = [
         [KeyboardButton("08:00"), KeyboardButton("09:00"), KeyboardButton("10:00")],
-        [KeyboardButton("✏️ Enter Manually")]
+        [KeyboardButton(_BTN_ENTER_MANUAL)]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 
+@lru_cache(maxsize=None)
 def build_evening_time_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для выбора времени вечерней сводки"""
     keyboard = [
         [KeyboardButton("18:00"), KeyboardButton("21:00"), KeyboardButton("23:00")],
-        [KeyboardButton("✏️ Enter Manually")]
+        [KeyboardButton(_BTN_ENTER_MANUAL)]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
@@ -790,6 +1163,7 @@ async def ask_evening_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.chat_data['onboard_stage'] = 'ask_evening_time'
 
 
+@lru_cache(maxsize=None)
 def build_default_duration_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для выбора использования дефолтной длительности задач"""
     keyboard = [
@@ -798,11 +1172,12 @@ def build_default_duration_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
 
+@lru_cache(maxsize=None)
 def build_duration_choice_keyboard() -> ReplyKeyboardMarkup:
     """Создает клавиатуру для выбора дефолтной длительности задачи"""
     keyboard = [
         [KeyboardButton("15 min"), KeyboardButton("30 min"), KeyboardButton("1 hour")],
-        [KeyboardButton("1.5 hours"), KeyboardButton("2 hours"), KeyboardButton("✏️ Custom")]
+        [KeyboardButton("1.5 hours"), KeyboardButton("2 hours"), KeyboardButton(_BTN_CUSTOM)]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
 
@@ -826,19 +1201,14 @@ async def ask_default_duration_value(update: Update, context: ContextTypes.DEFAU
     context.chat_data['onboard_stage'] = 'ask_default_duration_value'
 
 
-async def finish_onboarding(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def finish_onboarding(update: Update, context: ContextTypes.DEFAULT_TYPE, **profile):
     """Завершение онбординга - подключение Google Calendar"""
     chat_id = update.effective_chat.id
+    # Последние ответы онбординга сохраняем одной записью
+    set_user_profile(chat_id, **profile)
     
-    # Формируем redirect_uri для callback.
-    # Если задана REDIRECT_URI, используем её (должна в точности совпадать с настройкой в Google Cloud).
-    redirect_uri = os.getenv("REDIRECT_URI")
-    if not redirect_uri:
-        base_url = os.getenv("BASE_URL")
-        if not base_url:
-            port = int(os.getenv("PORT", 8000))
-            base_url = f"http://localhost:{port}"
-        redirect_uri = f"{base_url}/google/callback"
+    # redirect_uri для callback (REDIRECT_URI или BASE_URL/google/callback)
+    redirect_uri = _oauth_redirect_uri()
     
     # Генерируем URL авторизации с chat_id в state
     auth_url = get_authorization_url(chat_id, redirect_uri)
@@ -852,15 +1222,40 @@ async def finish_onboarding(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f'<a href="{auth_url}">🔗 Connect Google Calendar</a>\n\n'
         "Click the link above to authorize. You'll be redirected back automatically.",
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardRemove()
+        reply_markup=_KEYBOARD_REMOVE
     )
 
     # Очищаем стадию онбординга — ждём завершения OAuth через callback
     context.chat_data['onboard_stage'] = 'awaiting_gcal_auth'
 
 
+@lru_cache(maxsize=None)
+def _oauth_redirect_uri() -> str:
+    """
+    redirect_uri для Google OAuth — постоянный на всё время жизни процесса.
+    Если задана REDIRECT_URI, используем её (должна в точности совпадать с настройкой в Google Cloud).
+    """
+    redirect_uri = os.getenv("REDIRECT_URI")
+    if not redirect_uri:
+        base_url = os.getenv("BASE_URL")
+        if not base_url:
+            port = int(os.getenv("PORT", 8000))
+            base_url = f"http://localhost:{port}"
+        redirect_uri = f"{base_url}/google/callback"
+    return redirect_uri
+
+
 # ---- Button Helper Functions ----
 
+def _cancel_reschedule_kb(event_id: str, chat_id: int) -> InlineKeyboardMarkup:
+    """Кнопка отмены ручного переноса для конкретного события"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("❌ Cancel reschedule",
+                              callback_data=f"cancel_reschedule_{mint_short_id(event_id, chat_id)}")]
+    ])
+
+
+@lru_cache(maxsize=None)
 def build_event_preview_buttons() -> InlineKeyboardMarkup:
     """Build standard event preview buttons"""
     return InlineKeyboardMarkup([[
@@ -869,6 +1264,7 @@ def build_event_preview_buttons() -> InlineKeyboardMarkup:
     ]])
 
 
+@lru_cache(maxsize=None)
 def build_schedule_buttons() -> InlineKeyboardMarkup:
     """Build standard schedule import buttons"""
     return InlineKeyboardMarkup([[
@@ -877,6 +1273,7 @@ def build_schedule_buttons() -> InlineKeyboardMarkup:
     ]])
 
 
+@lru_cache(maxsize=None)
 def build_edit_menu_buttons() -> InlineKeyboardMarkup:
     """Build edit menu buttons"""
     return InlineKeyboardMarkup([
@@ -887,97 +1284,407 @@ def build_edit_menu_buttons() -> InlineKeyboardMarkup:
     ])
 
 
-async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик текстовых сообщений"""
-    if not update.message or not update.message.text:
-        return
-    
+
+@lru_cache(maxsize=None)
+def build_schedule_weeks_cancel_button() -> InlineKeyboardMarkup:
+    """Build cancel button for the schedule weeks prompt"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data="schedule_weeks_cancel")]])
+
+
+@lru_cache(maxsize=None)
+def build_schedule_conflict_buttons() -> InlineKeyboardMarkup:
+    """Build schedule import conflict resolution buttons"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🔄 Replace old", callback_data="schedule_weeks_replace"),
+            InlineKeyboardButton("➕ Add both", callback_data="schedule_weeks_force"),
+        ],
+        [
+            InlineKeyboardButton("⏭ Skip conflicts", callback_data="schedule_weeks_skip"),
+            InlineKeyboardButton("❌ Cancel", callback_data="schedule_weeks_cancel"),
+        ],
+    ])
+
+
+@lru_cache(maxsize=None)
+def build_task_duration_cancel_button() -> InlineKeyboardMarkup:
+    """Build cancel button for the task duration prompt"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data="cancel_task_duration")]])
+
+
+@lru_cache(maxsize=None)
+def build_conflict_buttons() -> InlineKeyboardMarkup:
+    """Build single-event conflict resolution buttons"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🔄 Replace old", callback_data="conflict_replace"),
+            InlineKeyboardButton("➕ Add both", callback_data="conflict_proceed"),
+        ],
+        [
+            InlineKeyboardButton("🚫 Keep old", callback_data="conflict_cancel"),
+            InlineKeyboardButton("✏️ Change time", callback_data="conflict_change_time"),
+        ],
+    ])
+
+
+@lru_cache(maxsize=None)
+def build_settings_buttons(has_calendar: bool) -> InlineKeyboardMarkup:
+    """Build the settings menu; the last row depends on whether Google Calendar is connected"""
+    calendar_row = (
+        [InlineKeyboardButton("🔌 Disconnect Google Calendar", callback_data="disconnect_gcal")]
+        if has_calendar else
+        [InlineKeyboardButton("🔗 Connect Google Calendar", callback_data="connect_gcal")]
+    )
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✏️ Change Name", callback_data="set_name")],
+        [InlineKeyboardButton("🌍 Change Timezone", callback_data="set_tz")],
+        [InlineKeyboardButton("🌅 Morning Time", callback_data="set_morning")],
+        [InlineKeyboardButton("🌙 Evening Time", callback_data="set_evening")],
+        [InlineKeyboardButton("⏱ Task Duration", callback_data="set_duration")],
+        calendar_row,
+    ])
+
+
+@lru_cache(maxsize=None)
+def build_open_calendar_button() -> InlineKeyboardMarkup:
+    """Build the link button to Google Calendar"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("📅 Open Google Calendar", url="https://calendar.google.com/calendar")
+    ]])
+
+
+# ---- Onboarding stage handlers ----
+
+async def _onboard_ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Вопрос об имени"""
     chat_id = update.effective_chat.id
-    text = update.message.text.strip()
-    
-    # Обработка команд меню (проверяем ПЕРЕД состоянием, чтобы пользователь мог отменить)
-    if text in ("⚙️ Settings", "📋 Tasks for Today", "📆 Tasks for a Date", "📅 Open Google Calendar"):
-        # Очищаем все активные состояния при переходе в меню
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
-        context.user_data.pop('waiting_for', None)
-        context.user_data.pop('rescheduling_event_id', None)
+    if text.strip():
+        try:
+            validated_name = _validate_user_input(text, "Name", max_length=100)
+            set_user_name(chat_id, validated_name)
+            await ask_timezone(update, context)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}\n\nPlease enter your name:")
+    else:
+        await update.message.reply_text(
+            "Please enter your name:"
+        )
 
-    if text == "⚙️ Settings":
-        
-        tz = get_user_timezone(chat_id) or DEFAULT_TZ
-        morning_time = get_morning_time(chat_id)
-        evening_time = get_evening_time(chat_id)
-        user_name = get_user_name(chat_id)
-        has_calendar = has_google_auth(chat_id)
-        
-        use_default_dur = get_use_default_duration(chat_id)
-        default_dur = get_default_task_duration(chat_id)
-
-        settings_text = f"⚙️ Settings\n\n"
-        if user_name:
-            settings_text += f"Name: {user_name}\n"
-        settings_text += f"Timezone: {tz}\n"
-        settings_text += f"Morning briefing: {morning_time}\n"
-        settings_text += f"Evening recap: {evening_time}\n"
-        if use_default_dur:
-            settings_text += f"Task duration: {default_dur} min (default)\n"
-        else:
-            settings_text += "Task duration: ask each time\n"
-        settings_text += "\nGoogle Calendar: "
-        settings_text += "connected\n\n" if has_calendar else "not connected\n\n"
-        settings_text += "Select what you want to change:"
-
-        keyboard_rows = [
-            [InlineKeyboardButton("✏️ Change Name", callback_data="set_name")],
-            [InlineKeyboardButton("🌍 Change Timezone", callback_data="set_tz")],
-            [InlineKeyboardButton("🌅 Morning Time", callback_data="set_morning")],
-            [InlineKeyboardButton("🌙 Evening Time", callback_data="set_evening")],
-            [InlineKeyboardButton("⏱ Task Duration", callback_data="set_duration")],
-        ]
-        if has_calendar:
-            keyboard_rows.append([InlineKeyboardButton("🔌 Disconnect Google Calendar", callback_data="disconnect_gcal")])
-        else:
-            keyboard_rows.append([InlineKeyboardButton("🔗 Connect Google Calendar", callback_data="connect_gcal")])
 
-        keyboard = keyboard_rows
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
+async def _onboard_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Пользователь выбирает таймзону"""
+    if text == _BTN_ENTER_CITY:
         await update.message.reply_text(
-            settings_text,
-            reply_markup=reply_markup
+            "Please enter your city/timezone manually (e.g., Europe/London, America/New_York, Asia/Tokyo):",
+            reply_markup=_KEYBOARD_REMOVE
         )
+        context.chat_data['onboard_stage'] = 'timezone_manual'
         return
-    
-    if text == "📋 Tasks for Today":
-        await show_daily_tasks(update, context)
-        return
-    
-    if text == "📆 Tasks for a Date":
-        context.user_data['waiting_for'] = 'tasks_date'
+
+    if text == _BTN_UTC_LIST:
         await update.message.reply_text(
-            "📆 Enter a date to view tasks:\n\n"
-            "Examples: <b>tomorrow</b>, <b>Monday</b>, <b>March 5</b>, <b>2026-03-10</b>",
-            parse_mode='HTML'
+            "Choose your UTC offset:",
+            reply_markup=build_utc_list_keyboard()
         )
+        context.chat_data['onboard_stage'] = 'timezone_utc_list'
         return
-    
-    if text == "📅 Open Google Calendar":
-        # Отправляем ссылку на Google Calendar сразу без дополнительного сообщения
-        calendar_url = "https://calendar.google.com/calendar"
-        keyboard = [[InlineKeyboardButton("📅 Open Google Calendar", url=calendar_url)]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+
+    # Если это не кнопка, значит пользователь ввел что-то другое
+    await update.message.reply_text(
+        "Please choose one of the options:",
+        reply_markup=build_timezone_keyboard()
+    )
+
+
+async def _onboard_timezone_manual(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Пользователь вводит таймзону вручную"""
+    chat_id = update.effective_chat.id
+    tz_name = _canonical_tz_name(text)
+    if tz_name is None:
         await update.message.reply_text(
-            "📅",
-            reply_markup=reply_markup
+            "Invalid timezone. Please enter a valid timezone (e.g., Europe/London):"
         )
         return
+    set_user_timezone(chat_id, tz_name)
+    await ask_morning_time(update, context)
+
+
+async def _onboard_timezone_utc_list(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Пользователь выбрал UTC из списка"""
+    chat_id = update.effective_chat.id
+    if text == _BTN_BACK:
+        await ask_timezone(update, context)
+        return
+
+    # Парсим UTC offset
+    tz = parse_utc_offset(text)
+    if tz:
+        set_user_timezone(chat_id, tz)
+        await ask_morning_time(update, context)
+        return
+    else:
+        await update.message.reply_text(
+            "Invalid selection. Please choose from the list:",
+            reply_markup=build_utc_list_keyboard()
+        )
+        return
+
+
+async def _onboard_ask_morning_time(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Вопрос о времени утренней сводки"""
+    chat_id = update.effective_chat.id
+    if text == _BTN_ENTER_MANUAL:
+        await update.message.reply_text(
+            "Please enter time in format HH:MM (e.g., 09:00, 08:30):",
+            reply_markup=_KEYBOARD_REMOVE
+        )
+        context.chat_data['onboard_stage'] = 'ask_morning_time_manual'
+        return
+
+    # Проверяем, является ли это валидным временем
+    time_str = _parse_hhmm(text)
+    if time_str:
+        set_morning_time(chat_id, time_str)
+        await ask_evening_time(update, context)
+        return
+    await update.message.reply_text(
+        "Invalid time format. Please choose from the buttons or enter manually:",
+        reply_markup=build_morning_time_keyboard()
+    )
+
+
+async def _onboard_ask_morning_time_manual(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Пользователь вводит время утренней сводки вручную"""
+    chat_id = update.effective_chat.id
+    time_str = _parse_hhmm(text)
+    if time_str:
+        set_morning_time(chat_id, time_str)
+        await ask_evening_time(update, context)
+        return
+    await update.message.reply_text(
+        "Invalid time format. Please enter time in HH:MM format (e.g., 09:00, 08:30):"
+    )
+
+
+async def _onboard_ask_evening_time(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Вопрос о времени вечерней сводки"""
+    chat_id = update.effective_chat.id
+    if text == _BTN_ENTER_MANUAL:
+        await update.message.reply_text(
+            "Please enter time in format HH:MM (e.g., 21:00, 23:00):",
+            reply_markup=_KEYBOARD_REMOVE
+        )
+        context.chat_data['onboard_stage'] = 'ask_evening_time_manual'
+        return
+
+    # Проверяем, является ли это валидным временем
+    time_str = _parse_hhmm(text)
+    if time_str:
+        set_evening_time(chat_id, time_str)
+        await ask_default_duration_preference(update, context)
+        return
+    await update.message.reply_text(
+        "Invalid time format. Please choose from the buttons or enter manually:",
+        reply_markup=build_evening_time_keyboard()
+    )
+
+
+async def _onboard_ask_evening_time_manual(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Пользователь вводит время вечерней сводки вручную"""
+    chat_id = update.effective_chat.id
+    time_str = _parse_hhmm(text)
+    if time_str:
+        set_evening_time(chat_id, time_str)
+        await ask_default_duration_preference(update, context)
+        return
+    await update.message.reply_text(
+        "Invalid time format. Please enter time in HH:MM format (e.g., 21:00, 23:00):"
+    )
+
+
+async def _onboard_ask_default_duration_preference(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Вопрос о предпочтении использВания дефолтной длительности"""
+    if "Yes" in text or "yes" in text:
+        # Пользователь хочет использовать дефолтную длительность
+        context.chat_data['use_default_duration'] = True
+        await ask_default_duration_value(update, context)
+        return
+    elif "No" in text or "no" in text:
+        # Пользователь хочет, чтобы мы спрашивали длительность каждый раз
+        context.chat_data['use_default_duration'] = False
+        await finish_onboarding(update, context, use_default_duration=False, default_task_duration=30)
+        return
+    else:
+        await update.message.reply_text(
+            "Please choose an option:",
+            reply_markup=build_default_duration_keyboard()
+        )
+        return
+
+
+async def _onboard_ask_default_duration_value(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Выбор дефолтной длительности задачи"""
+    use_default = context.chat_data.get('use_default_duration', True)
+    duration_map = {
+        "15 min": 15,
+        "15": 15,
+        "30 min": 30,
+        "30": 30,
+        "1 hour": 60,
+        "1": 60,
+        "60": 60,
+        "1.5 hours": 90,
+        "1.5": 90,
+        "90": 90,
+        "2 hours": 120,
+        "2": 120,
+        "120": 120,
+    }
+
+    if text in duration_map:
+        duration_minutes = duration_map[text]
+        await finish_onboarding(
+            update, context,
+            use_default_duration=use_default,
+            default_task_duration=duration_minutes,
+        )
+        return
+    elif text == _BTN_CUSTOM:
+        await update.message.reply_text(
+            "Please enter the default duration in minutes (e.g., 30, 45, 60):",
+            reply_markup=_KEYBOARD_REMOVE
+        )
+        context.chat_data['onboard_stage'] = 'ask_default_duration_custom'
+        return
+    else:
+        await update.message.reply_text(
+            "Please choose a duration from the options:",
+            reply_markup=build_duration_choice_keyboard()
+        )
+        return
+
+
+async def _onboard_ask_default_duration_custom(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Пользователь вводит дефолтную длительность вручную"""
+    try:
+        use_default = context.chat_data.get('use_default_duration', True)
+        duration_minutes = int(text.strip())
+        if duration_minutes <= 0 or duration_minutes > 1440:
+            raise ValueError("Duration must be between 1 and 1440 minutes")
+        await finish_onboarding(
+            update, context,
+            use_default_duration=use_default,
+            default_task_duration=duration_minutes,
+        )
+        return
+    except (ValueError, TypeError):
+        await update.message.reply_text(
+            "Invalid duration. Please enter a number between 1 and 1440 (minutes):"
+        )
+        return
+
+
+_ONBOARD_HANDLERS = {
+    'ask_name': _onboard_ask_name,
+    'timezone': _onboard_timezone,
+    'timezone_manual': _onboard_timezone_manual,
+    'timezone_utc_list': _onboard_timezone_utc_list,
+    'ask_morning_time': _onboard_ask_morning_time,
+    'ask_morning_time_manual': _onboard_ask_morning_time_manual,
+    'ask_evening_time': _onboard_ask_evening_time,
+    'ask_evening_time_manual': _onboard_ask_evening_time_manual,
+    'ask_default_duration_preference': _onboard_ask_default_duration_preference,
+    'ask_default_duration_value': _onboard_ask_default_duration_value,
+    'ask_default_duration_custom': _onboard_ask_default_duration_custom,
+}
+
+
+async def _menu_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка меню ⚙️ Settings"""
+    chat_id = update.effective_chat.id
+    tz = _user_tz(chat_id)
+    morning_time = get_morning_time(chat_id)
+    evening_time = get_evening_time(chat_id)
+    user_name = get_user_name(chat_id)
+    has_calendar = has_google_auth(chat_id)
+    
+    use_default_dur = get_use_default_duration(chat_id)
+    default_dur = get_default_task_duration(chat_id)
+
+    settings_text = f"⚙️ Settings\n\n"
+    if user_name:
+        settings_text += f"Name: {user_name}\n"
+    settings_text += f"Timezone: {tz}\n"
+    settings_text += f"Morning briefing: {morning_time}\n"
+    settings_text += f"Evening recap: {evening_time}\n"
+    if use_default_dur:
+        settings_text += f"Task duration: {default_dur} min (default)\n"
+    else:
+        settings_text += "Task duration: ask each time\n"
+    settings_text += "\nGoogle Calendar: "
+    settings_text += "connected\n\n" if has_calendar else "not connected\n\n"
+    settings_text += "Select what you want to change:"
+
+    await update.message.reply_text(
+        settings_text,
+        reply_markup=build_settings_buttons(has_calendar)
+    )
+
+
+async def _menu_tasks_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка меню 📋 Tasks for Today"""
+    await show_daily_tasks(update, context)
+
+
+async def _menu_tasks_for_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка меню 📆 Tasks for a Date"""
+    context.user_data['waiting_for'] = 'tasks_date'
+    await update.message.reply_text(
+        "📆 Enter a date to view tasks:\n\n"
+        "Examples: <b>tomorrow</b>, <b>Monday</b>, <b>March 5</b>, <b>2026-03-10</b>",
+        parse_mode='HTML'
+    )
+
+
+async def _menu_open_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка меню 📅 Open Google Calendar"""
+    # Отправляем ссылку на Google Calendar сразу без дополнительного сообщения
+    await update.message.reply_text(
+        "📅",
+        reply_markup=build_open_calendar_button()
+    )
+
+
+_MENU_HANDLERS = {
+    "⚙️ Settings": _menu_settings,
+    "📋 Tasks for Today": _menu_tasks_today,
+    "📆 Tasks for a Date": _menu_tasks_for_date,
+    "📅 Open Google Calendar": _menu_open_calendar,
+}
+
+
+async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик текстовых сообщений"""
+    if not update.message or not update.message.text:
+        return
+    
+    chat_id = update.effective_chat.id
+    text = update.message.text.strip()
+    
+    # Обработка команд меню (проверяем ПЕРЕД состоянием, чтобы пользователь мог отменить):
+    # один поиск в dict вместо цепочки сравнений на каждое сообщение
+    menu_handler = _MENU_HANDLERS.get(text)
+    if menu_handler is not None:
+        # Очищаем все активные состояния при переходе в меню
+        _clear_dialog_state(context)
+        await menu_handler(update, context)
+        return
+    
+    # Обработка ответа на вопрос о количестве недель для расписания
+    if context.user_data.get('state') == 'WAITING_FOR_WEEKS':
+        await handle_weeks_response(update, context, text)
+        return
     
-    # Обработка ответа на вопрос о количестве недель для расписания
-    if context.user_data.get('state') == 'WAITING_FOR_WEEKS':
-        await handle_weeks_response(update, context, text)
-        return
-    
     # Обработка изменений настроек через callback
     waiting_for = context.user_data.get('waiting_for')
     if waiting_for == 'tasks_date':
@@ -1004,15 +1711,15 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     elif waiting_for == 'timezone':
         # Используем ту же логику, что и в онбординге
-        if text == "✏️ Enter City Manually":
+        if text == _BTN_ENTER_CITY:
             await update.message.reply_text(
                 "Please enter your city/timezone manually (e.g., Europe/London, America/New_York, Asia/Tokyo):",
-                reply_markup=ReplyKeyboardRemove()
+                reply_markup=_KEYBOARD_REMOVE
             )
             context.user_data['waiting_for'] = 'timezone_manual'
             return
         
-        if text == "🌍 Choose from UTC List":
+        if text == _BTN_UTC_LIST:
             await update.message.reply_text(
                 "Choose your UTC offset:",
                 reply_markup=build_utc_list_keyboard()
@@ -1027,18 +1734,18 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     elif waiting_for == 'timezone_manual':
-        try:
-            pytz.timezone(text)
-            set_user_timezone(chat_id, text)
-            await update.message.reply_text(
-                f"✅ Timezone updated to: {text}",
-                reply_markup=build_main_menu()
-            )
-            context.user_data.pop('waiting_for', None)
-        except pytz.exceptions.UnknownTimeZoneError:
+        tz_name = _canonical_tz_name(text)
+        if tz_name is None:
             await update.message.reply_text(
                 "Invalid timezone. Please enter a valid timezone (e.g., Europe/London):"
             )
+            return
+        set_user_timezone(chat_id, tz_name)
+        await update.message.reply_text(
+            f"✅ Timezone updated to: {tz_name}",
+            reply_markup=build_main_menu()
+        )
+        context.user_data.pop('waiting_for', None)
         return
     
     elif waiting_for == 'timezone_utc_list':
@@ -1058,10 +1765,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     elif waiting_for == 'morning_time':
-        if text == "✏️ Enter Manually":
+        if text == _BTN_ENTER_MANUAL:
             await update.message.reply_text(
                 "Enter time in HH:MM format (e.g., 09:00):",
-                reply_markup=ReplyKeyboardRemove()
+                reply_markup=_KEYBOARD_REMOVE
             )
             context.user_data['waiting_for'] = 'morning_time_manual'
             return
@@ -1082,33 +1789,25 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     elif waiting_for == 'morning_time_manual':
-        try:
-            if ':' in text:
-                parts = text.split(':')
-                if len(parts) == 2:
-                    hour = int(parts[0].strip())
-                    minute = int(parts[1].strip())
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        time_str = f"{hour:02d}:{minute:02d}"
-                        set_morning_time(chat_id, time_str)
-                        await update.message.reply_text(
-                            f"✅ Morning briefing time updated to: {time_str}",
-                            reply_markup=build_main_menu()
-                        )
-                        context.user_data.pop('waiting_for', None)
-                        return
-            raise ValueError("Invalid time format")
-        except (ValueError, IndexError):
+        time_str = _parse_hhmm(text)
+        if time_str:
+            set_morning_time(chat_id, time_str)
+            await update.message.reply_text(
+                f"✅ Morning briefing time updated to: {time_str}",
+                reply_markup=build_main_menu()
+            )
+            context.user_data.pop('waiting_for', None)
+        else:
             await update.message.reply_text(
                 "Invalid time format. Please enter time in HH:MM format (e.g., 09:00):"
             )
         return
     
     elif waiting_for == 'evening_time':
-        if text == "✏️ Enter Manually":
+        if text == _BTN_ENTER_MANUAL:
             await update.message.reply_text(
                 "Enter time in HH:MM format (e.g., 21:00):",
-                reply_markup=ReplyKeyboardRemove()
+                reply_markup=_KEYBOARD_REMOVE
             )
             context.user_data['waiting_for'] = 'evening_time_manual'
             return
@@ -1129,357 +1828,318 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     elif waiting_for == 'evening_time_manual':
-        try:
-            if ':' in text:
-                parts = text.split(':')
-                if len(parts) == 2:
-                    hour = int(parts[0].strip())
-                    minute = int(parts[1].strip())
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        time_str = f"{hour:02d}:{minute:02d}"
-                        set_evening_time(chat_id, time_str)
-                        await update.message.reply_text(
-                            f"✅ Evening recap time updated to: {time_str}",
-                            reply_markup=build_main_menu()
-                        )
-                        context.user_data.pop('waiting_for', None)
-                        return
-            raise ValueError("Invalid time format")
-        except (ValueError, IndexError):
+        time_str = _parse_hhmm(text)
+        if time_str:
+            set_evening_time(chat_id, time_str)
+            await update.message.reply_text(
+                f"✅ Evening recap time updated to: {time_str}",
+                reply_markup=build_main_menu()
+            )
+            context.user_data.pop('waiting_for', None)
+        else:
             await update.message.reply_text(
                 "Invalid time format. Please enter time in HH:MM format (e.g., 21:00):"
             )
         return
     
     elif waiting_for == 'reschedule_time':
-        # Обработка ручного ввода времени (и при необходимости длительности) для переноса задачи
-        event_id = context.user_data.get('rescheduling_event_id')
-        if not event_id:
-            await update.message.reply_text(
-                "Error: Event ID not found. Please try rescheduling again.",
-                reply_markup=build_main_menu()
-            )
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('rescheduling_event_id', None)
-            context.user_data.pop('reschedule_conflict_start', None)
-            return
+        # Состояние переноса очищается на выходе, если не выставлен keep (ждём новый ввод)
+        async with _reschedule_state(context) as keep:
+            # Обработка ручного ввода времени (и при необходимости длительности) для переноса задачи
+            event_id = context.user_data.get('rescheduling_event_id')
+            if not event_id:
+                await update.message.reply_text(
+                    "Error: Event ID not found. Please try rescheduling again.",
+                    reply_markup=build_main_menu()
+                )
+                return
         
-        # Получаем credentials
-        stored_tokens = get_google_tokens(chat_id)
-        if not stored_tokens:
-            await update.message.reply_text(
-                "❌ Authorization error. Please reconnect your Google Calendar.",
-                reply_markup=build_main_menu()
-            )
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('rescheduling_event_id', None)
-            context.user_data.pop('reschedule_conflict_start', None)
-            return
+            # Получаем credentials
+            stored_tokens = get_google_tokens(chat_id)
+            if not stored_tokens:
+                await update.message.reply_text(
+                    "❌ Authorization error. Please reconnect your Google Calendar.",
+                    reply_markup=build_main_menu()
+                )
+                return
         
-        credentials = await _get_credentials_or_notify(
-            chat_id, stored_tokens,
-            lambda t: update.message.reply_text(t, reply_markup=build_main_menu())
-        )
-        if not credentials:
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('rescheduling_event_id', None)
-            context.user_data.pop('reschedule_conflict_start', None)
-            return
+            credentials = await _get_credentials_or_notify(
+                chat_id, stored_tokens,
+                lambda t: update.message.reply_text(t, reply_markup=build_main_menu())
+            )
+            if not credentials:
+                return
         
-        try:
-            user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-            tz = pytz.timezone(user_timezone)
-
-            from googleapiclient.discovery import build
-            service = build('calendar', 'v3', credentials=credentials)
-
-            def _get_conflicts_for_slot(start_local, end_local):
-                """Возвращает список конфликтующих событий в локальном времени пользователя."""
-                start_utc = start_local.astimezone(pytz.utc)
-                end_utc = end_local.astimezone(pytz.utc)
-                events_result = service.events().list(
-                    calendarId='primary',
-                    timeMin=start_utc.isoformat(),
-                    timeMax=end_utc.isoformat(),
-                    singleEvents=True,
-                    orderBy='startTime'
-                ).execute()
-                raw_events = events_result.get('items', [])
-                conflicts = []
-                for ev in raw_events:
-                    if ev.get('id') == event_id:
-                        continue
-                    ev_start_str = ev['start'].get('dateTime') or ev['start'].get('date')
-                    ev_end_str = ev['end'].get('dateTime') or ev['end'].get('date')
-                    if not ev_start_str or not ev_end_str:
-                        continue
-                    try:
-                        if 'T' in ev_start_str:
-                            ev_start = datetime.fromisoformat(ev_start_str.replace('Z', '+00:00'))
-                            if ev_start.tzinfo is None:
-                                ev_start = pytz.utc.localize(ev_start)
-                            ev_end = datetime.fromisoformat(ev_end_str.replace('Z', '+00:00'))
-                            if ev_end.tzinfo is None:
-                                ev_end = pytz.utc.localize(ev_end)
-                        else:
-                            # All-day event
-                            ev_start = tz.localize(datetime.strptime(ev_start_str, '%Y-%m-%d'))
-                            ev_end = tz.localize(datetime.strptime(ev_end_str, '%Y-%m-%d'))
-                        ev_start_local = ev_start.astimezone(tz)
-                        ev_end_local = ev_end.astimezone(tz)
-                    except Exception:
-                        continue
-                    # Проверяем пересечение интервалов
-                    if not (end_local <= ev_start_local or start_local >= ev_end_local):
-                        conflicts.append({
-                            "summary": ev.get("summary", "Busy"),
-                            "start": ev_start_local,
-                            "end": ev_end_local,
-                        })
-                return conflicts
-
-            # --- Вариант 1: пользователь меняет ДЛИТЕЛЬНОСТЬ при уже выбранном времени ---
-            conflict_start_iso = context.user_data.get('reschedule_conflict_start')
-            if conflict_start_iso and ':' not in text.strip():
-                try:
-                    new_duration_minutes = _parse_duration_to_minutes(text)
-                except ValueError:
-                    # Не похоже на длительность — будем трактовать как новое время
-                    pass
-                else:
+            try:
+                user_timezone = _user_tz(chat_id)
+                tz = get_tz(user_timezone)
+                now_local = datetime.now(tz)
+                today_date = now_local.date()
+                tomorrow_date = today_date + timedelta(days=1)
+
+                service = get_calendar_service(credentials)
+
+                def _get_conflicts_for_slot(start_local, end_local):
+                    """Возвращает список конфликтующих событий в локальном времени пользователя."""
+                    start_utc = start_local.astimezone(_UTC)
+                    end_utc = end_local.astimezone(_UTC)
+                    events_result = service.events().list(
+                        calendarId='primary',
+                        timeMin=start_utc.isoformat(),
+                        timeMax=end_utc.isoformat(),
+                        singleEvents=True,
+                        orderBy='startTime'
+                    ).execute()
+                    raw_events = events_result.get('items', [])
+                    conflicts = []
+                    for ev in raw_events:
+                        if ev.get('id') == event_id:
+                            continue
+                        ev_start_str = ev['start'].get('dateTime') or ev['start'].get('date')
+                        ev_end_str = ev['end'].get('dateTime') or ev['end'].get('date')
+                        if not ev_start_str or not ev_end_str:
+                            continue
+                        try:
+                            if 'T' in ev_start_str:
+                                ev_start = parse_iso_aware(ev_start_str)
+                                ev_end = parse_iso_aware(ev_end_str)
+                            else:
+                                # All-day event
+                                ev_start = tz.localize(datetime.strptime(ev_start_str, '%Y-%m-%d'))
+                                ev_end = tz.localize(datetime.strptime(ev_end_str, '%Y-%m-%d'))
+                            ev_start_local = ev_start.astimezone(tz)
+                            ev_end_local = ev_end.astimezone(tz)
+                        except Exception:
+                            continue
+                        # Проверяем пересечение интервалов
+                        if not (end_local <= ev_start_local or start_local >= ev_end_local):
+                            conflicts.append({
+                                "summary": ev.get("summary", "Busy"),
+                                "start": ev_start_local,
+                                "end": ev_end_local,
+                            })
+                    return conflicts
+
+                # --- Вариант 1: пользователь меняет ДЛИТЕЛЬНОСТЬ при уже выбранном времени ---
+                conflict_start_iso = context.user_data.get('reschedule_conflict_start')
+                if conflict_start_iso and ':' not in text.strip():
                     try:
-                        new_start_dt = datetime.fromisoformat(conflict_start_iso)
-                    except Exception:
-                        new_start_dt = None
-                    if new_start_dt is not None:
-                        if new_start_dt.tzinfo is None:
-                            new_start_dt = tz.localize(new_start_dt)
-                        new_end_dt = new_start_dt + timedelta(minutes=new_duration_minutes)
-
-                        conflicts = _get_conflicts_for_slot(new_start_dt, new_end_dt)
-                        if not conflicts:
-                            # Слот свободен с новой длительностью — переносим
-                            new_start_utc = new_start_dt.astimezone(pytz.utc)
-                            new_end_utc = new_end_dt.astimezone(pytz.utc)
-
-                            success = reschedule_event(credentials, event_id, new_start_utc, new_end_utc)
-                            if success:
-                                time_str = new_start_dt.strftime('%H:%M')
-                                date_str = new_start_dt.strftime('%Y-%m-%d')
-                                today_str = datetime.now(tz).strftime('%Y-%m-%d')
-                                if date_str == today_str:
-                                    time_display = f"today at {time_str}"
-                                elif date_str == (datetime.now(tz) + timedelta(days=1)).strftime('%Y-%m-%d'):
-                                    time_display = f"tomorrow at {time_str}"
+                        new_duration_minutes = _parse_duration_to_minutes(text)
+                    except ValueError:
+                        # Не похоже на длительность — будем трактовать как новое время
+                        pass
+                    else:
+                        try:
+                            new_start_dt = datetime.fromisoformat(conflict_start_iso)
+                        except Exception:
+                            new_start_dt = None
+                        if new_start_dt is not None:
+                            if new_start_dt.tzinfo is None:
+                                new_start_dt = tz.localize(new_start_dt)
+                            new_end_dt = new_start_dt + timedelta(minutes=new_duration_minutes)
+
+                            conflicts = _get_conflicts_for_slot(new_start_dt, new_end_dt)
+                            if not conflicts:
+                                # Слот свободен с новой длительностью — переносим
+                                new_start_utc = new_start_dt.astimezone(_UTC)
+                                new_end_utc = new_end_dt.astimezone(_UTC)
+
+                                _invalidate_today_events(context)
+                                success = reschedule_event(credentials, event_id, new_start_utc, new_end_utc)
+                                if success:
+                                    time_str = new_start_dt.strftime('%H:%M')
+                                    new_date = new_start_dt.date()
+                                    if new_date == today_date:
+                                        time_display = f"today at {time_str}"
+                                    elif new_date == tomorrow_date:
+                                        time_display = f"tomorrow at {time_str}"
+                                    else:
+                                        time_display = f"{new_start_dt.strftime('%B %d')} at {time_str}"
+
+                                    await _clear_reschedule_prompt(context, chat_id)
+                                    await update.message.reply_text(
+                                        f"✅ Task moved to {time_display} (duration {new_duration_minutes} min)!",
+                                        reply_markup=build_main_menu()
+                                    )
+                                    track_event(chat_id, "task_rescheduled_manual", {
+                                        "event_id": event_id,
+                                        "duration_minutes": new_duration_minutes,
+                                    })
+                                    return
                                 else:
-                                    time_display = f"{new_start_dt.strftime('%B %d')} at {time_str}"
-
-                                await _clear_reschedule_prompt(context, chat_id)
-                                await update.message.reply_text(
-                                    f"✅ Task moved to {time_display} (duration {new_duration_minutes} min)!",
-                                    reply_markup=build_main_menu()
-                                )
-                                track_event(chat_id, "task_rescheduled_manual", {
-                                    "event_id": event_id,
-                                    "duration_minutes": new_duration_minutes,
-                                })
-                                context.user_data.pop('waiting_for', None)
-                                context.user_data.pop('rescheduling_event_id', None)
-                                context.user_data.pop('reschedule_conflict_start', None)
-                                return
-                            else:
-                                await _clear_reschedule_prompt(context, chat_id)
-                                await update.message.reply_text(
-                                    "❌ Failed to reschedule. Please try again.",
-                                    reply_markup=build_main_menu()
+                                    await _clear_reschedule_prompt(context, chat_id)
+                                    await update.message.reply_text(
+                                        "❌ Failed to reschedule. Please try again.",
+                                        reply_markup=build_main_menu()
+                                    )
+                                    return
+
+                            # Всё ещё конфликт — показываем детали и просим выбрать другое время/длительность
+                            lines = []
+                            for c in conflicts[:3]:
+                                lines.append(
+                                    f"• {c['start'].strftime('%H:%M')}–{c['end'].strftime('%H:%M')} {c['summary']}"
                                 )
-                                context.user_data.pop('waiting_for', None)
-                                context.user_data.pop('rescheduling_event_id', None)
-                                context.user_data.pop('reschedule_conflict_start', None)
-                                return
-
-                        # Всё ещё конфликт — показываем детали и просим выбрать другое время/длительность
-                        lines = []
-                        for c in conflicts[:3]:
-                            lines.append(
-                                f"• {c['start'].strftime('%H:%M')}–{c['end'].strftime('%H:%M')} {c['summary']}"
+                            if len(conflicts) > 3:
+                                lines.append("• ...")
+                            conflict_text = "⚠️ That duration still overlaps with other event(s):\n" + "\n".join(lines)
+                            conflict_text += (
+                                "\n\nSend another time (e.g., <b>tomorrow 15:00</b>) or a shorter duration "
+                                "(e.g., <b>30</b>, <b>45 min</b>)."
                             )
-                        if len(conflicts) > 3:
-                            lines.append("• ...")
-                        conflict_text = "⚠️ That duration still overlaps with other event(s):\n" + "\n".join(lines)
-                        conflict_text += (
-                            "\n\nSend another time (e.g., <b>tomorrow 15:00</b>) or a shorter duration "
-                            "(e.g., <b>30</b>, <b>45 min</b>)."
-                        )
-                        cancel_keyboard = InlineKeyboardMarkup([
-                            [InlineKeyboardButton("❌ Cancel reschedule", callback_data=f"cancel_reschedule_{event_id}")]
-                        ])
-                        context.user_data['reschedule_conflict_start'] = new_start_dt.isoformat()
-                        await update.message.reply_text(
-                            conflict_text,
-                            reply_markup=cancel_keyboard,
-                            parse_mode='HTML'
-                        )
-                        return
-
-            # --- Вариант 2: пользователь задаёт НОВОЕ ВРЕМЯ ---
-            # Если был конфликт раньше, но мы получили новый ввод времени, сбрасываем сохранённый старт
-            context.user_data.pop('reschedule_conflict_start', None)
-
-            # Используем AI для парсинга естественного языка (например, "Tomorrow 15:00", "Friday 10am")
-            ai_parsed = await parse_with_ai(text, user_timezone)
-
-            if not ai_parsed or not ai_parsed.get("is_task", True):
-                # Если AI не смог распарсить, пробуем простой формат HH:MM
-                if ':' in text.strip():
-                    time_part = text.strip().split()[-1]  # take last token as HH:MM
-                    parts = time_part.split(':')
-                    if len(parts) == 2:
-                        hour = int(parts[0].strip())
-                        minute = int(parts[1].strip()[:2])
-                        if 0 <= hour <= 23 and 0 <= minute <= 59:
-                            now_local = datetime.now(tz)
-                            candidate = now_local.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                            if candidate.tzinfo is None:
-                                candidate = tz.localize(candidate)
-                            # Use today if time hasn't passed, otherwise tomorrow
-                            if candidate > now_local:
-                                new_start_dt = candidate
-                            else:
-                                new_start_dt = candidate + timedelta(days=1)
+                            cancel_keyboard = _cancel_reschedule_kb(event_id, chat_id)
+                            context.user_data['reschedule_conflict_start'] = new_start_dt.isoformat()
+                            keep["v"] = True
+                            await update.message.reply_text(
+                                conflict_text,
+                                reply_markup=cancel_keyboard,
+                                parse_mode='HTML'
+                            )
+                            return
+
+                # --- Вариант 2: пользователь задаёт НОВОЕ ВРЕМЯ ---
+                # Если был конфликт раньше, но мы получили новый ввод времени, сбрасываем сохранённый старт
+                context.user_data.pop('reschedule_conflict_start', None)
+
+                # Быстрый локальный разбор ("15:00", "tomorrow 15:00", "fri 10:00") — без запроса к AI
+                new_start_dt = _fast_parse_reschedule(text, tz, now_local)
+
+                if new_start_dt is None:
+                    # Используем AI для парсинга естественного языка (например, "Tomorrow 15:00", "Friday 10am")
+                    ai_parsed = await parse_with_ai(text, user_timezone)
+
+                    if not ai_parsed or not ai_parsed.get("is_task", True):
+                        # Если AI не смог распарсить, пробуем простой формат HH:MM
+                        time_str = _parse_hhmm(text.split()[-1]) if text.strip() else None  # last token as HH:MM
+                        if not time_str:
+                            raise ValueError("Invalid time format")
+                        hour, minute = int(time_str[:2]), int(time_str[3:])
+                        candidate = now_local.replace(hour=hour, minute=minute, second=0, microsecond=0)
+                        if candidate.tzinfo is None:
+                            candidate = tz.localize(candidate)
+                        # Use today if time hasn't passed, otherwise tomorrow
+                        if candidate > now_local:
+                            new_start_dt = candidate
                         else:
-                            raise ValueError("Invalid time range")
+                            new_start_dt = candidate + timedelta(days=1)
                     else:
-                        raise ValueError("Invalid time format")
-                else:
-                    raise ValueError("Invalid time format")
-            else:
-                # Используем время из AI парсинга
-                start_dt_str = ai_parsed.get("start_time")
-                if not start_dt_str:
-                    raise ValueError("Could not parse time from input")
+                        # Используем время из AI парсинга
+                        start_dt_str = ai_parsed.get("start_time")
+                        if not start_dt_str:
+                            raise ValueError("Could not parse time from input")
                 
-                start_dt = datetime.fromisoformat(start_dt_str.replace("Z", "+00:00"))
-                if start_dt.tzinfo is None:
-                    start_dt = pytz.utc.localize(start_dt)
+                        start_dt = parse_iso_aware(start_dt_str)
                 
-                # Конвертируем в локальный timezone
-                new_start_dt = start_dt.astimezone(tz)
+                        # Конвертируем в локальный timezone
+                        new_start_dt = start_dt.astimezone(tz)
             
-            # Получаем событие для вычисления длительности
-            event = service.events().get(calendarId='primary', eventId=event_id).execute()
-            
-            # Получаем длительность события
-            start_str = event['start'].get('dateTime', event['start'].get('date'))
-            end_str = event['end'].get('dateTime', event['end'].get('date'))
+                # Получаем событие для вычисления длительности
+                event = service.events().get(
+                    calendarId='primary', eventId=event_id, fields='summary,start,end'
+                ).execute()
             
-            if 'T' in start_str:
-                orig_start_dt = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-                if orig_start_dt.tzinfo is None:
-                    orig_start_dt = pytz.utc.localize(orig_start_dt)
-                orig_end_dt = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
-                if orig_end_dt.tzinfo is None:
-                    orig_end_dt = pytz.utc.localize(orig_end_dt)
-                duration = orig_end_dt - orig_start_dt
-            else:
-                duration = timedelta(hours=1)
+                # Получаем длительность события
+                # (для событий на весь день — 'date' вместо 'dateTime' — берём 1 час без парсинга)
+                start_str = event['start'].get('dateTime')
+                end_str = event['end'].get('dateTime')
+                if start_str and end_str:
+                    orig_start_dt = parse_iso_aware(start_str)
+                    duration = parse_iso_aware(end_str) - orig_start_dt
+                else:
+                    orig_start_dt = None
+                    duration = timedelta(hours=1)
+
+                # Время не изменилось — не дёргаем Google ради проверки слота и переноса
+                if orig_start_dt is not None and new_start_dt == orig_start_dt:
+                    await _clear_reschedule_prompt(context, chat_id)
+                    await update.message.reply_text(
+                        "ℹ️ The task is already scheduled at that time.",
+                        reply_markup=build_main_menu()
+                    )
+                    return
             
-            new_end_dt = new_start_dt + duration
+                new_end_dt = new_start_dt + duration
 
-            conflicts = _get_conflicts_for_slot(new_start_dt, new_end_dt)
+                conflicts = _get_conflicts_for_slot(new_start_dt, new_end_dt)
 
-            if not conflicts:
-                # Слот свободен - переносим событие
-                new_start_utc = new_start_dt.astimezone(pytz.utc)
-                new_end_utc = new_end_dt.astimezone(pytz.utc)
+                if not conflicts:
+                    # Слот свободен - переносим событие
+                    new_start_utc = new_start_dt.astimezone(_UTC)
+                    new_end_utc = new_end_dt.astimezone(_UTC)
                 
-                success = reschedule_event(credentials, event_id, new_start_utc, new_end_utc)
+                    _invalidate_today_events(context)
+                    success = reschedule_event(credentials, event_id, new_start_utc, new_end_utc)
                 
-                if success:
-                    task_summary = event.get('summary', 'Task')
-                    time_str = new_start_dt.strftime('%H:%M')
-                    date_str = new_start_dt.strftime('%Y-%m-%d')
-                    today_str = datetime.now(tz).strftime('%Y-%m-%d')
+                    if success:
+                        task_summary = event.get('summary', 'Task')
+                        time_str = new_start_dt.strftime('%H:%M')
+                        new_date = new_start_dt.date()
+
+                        if new_date == today_date:
+                            time_display = f"today at {time_str}"
+                        elif new_date == tomorrow_date:
+                            time_display = f"tomorrow at {time_str}"
+                        else:
+                            time_display = f"{new_start_dt.strftime('%B %d')} at {time_str}"
                     
-                    if date_str == today_str:
-                        time_display = f"today at {time_str}"
-                    elif date_str == (datetime.now(tz) + timedelta(days=1)).strftime('%Y-%m-%d'):
-                        time_display = f"tomorrow at {time_str}"
+                        await _clear_reschedule_prompt(context, chat_id)
+                        await update.message.reply_text(
+                            f"✅ Task moved to {time_display}!",
+                            reply_markup=build_main_menu()
+                        )
+                        track_event(chat_id, "task_rescheduled_manual", {"event_id": event_id})
                     else:
-                        time_display = f"{new_start_dt.strftime('%B %d')} at {time_str}"
-                    
-                    await _clear_reschedule_prompt(context, chat_id)
-                    await update.message.reply_text(
-                        f"✅ Task moved to {time_display}!",
-                        reply_markup=build_main_menu()
-                    )
-                    track_event(chat_id, "task_rescheduled_manual", {"event_id": event_id})
-                    # Очищаем состояние после успешного переноса
-                    context.user_data.pop('waiting_for', None)
-                    context.user_data.pop('rescheduling_event_id', None)
-                    context.user_data.pop('reschedule_conflict_start', None)
+                        await _clear_reschedule_prompt(context, chat_id)
+                        await update.message.reply_text(
+                            "❌ Failed to reschedule. Please try again.",
+                            reply_markup=build_main_menu()
+                        )
                 else:
-                    await _clear_reschedule_prompt(context, chat_id)
-                    await update.message.reply_text(
-                        "❌ Failed to reschedule. Please try again.",
-                        reply_markup=build_main_menu()
+                    # Слот занят — показываем детали и предлагаем другое время или длительность
+                    lines = []
+                    for c in conflicts[:3]:
+                        lines.append(
+                            f"• {c['start'].strftime('%H:%M')}–{c['end'].strftime('%H:%M')} {c['summary']}"
+                        )
+                    if len(conflicts) > 3:
+                        lines.append("• ...")
+                    conflict_text = "⚠️ That time overlaps with other event(s):\n" + "\n".join(lines)
+                    conflict_text += (
+                        "\n\nSend another time (e.g., <b>tomorrow 15:00</b>) or a new duration for this task "
+                        "(e.g., <b>30</b>, <b>45 min</b>, <b>1h</b>)."
                     )
-                    # Очищаем состояние при ошибке
-                    context.user_data.pop('waiting_for', None)
-                    context.user_data.pop('rescheduling_event_id', None)
-                    context.user_data.pop('reschedule_conflict_start', None)
-            else:
-                # Слот занят — показываем детали и предлагаем другое время или длительность
-                lines = []
-                for c in conflicts[:3]:
-                    lines.append(
-                        f"• {c['start'].strftime('%H:%M')}–{c['end'].strftime('%H:%M')} {c['summary']}"
+                    cancel_keyboard = _cancel_reschedule_kb(event_id, chat_id)
+                    context.user_data['reschedule_conflict_start'] = new_start_dt.isoformat()
+                    keep["v"] = True
+                    await update.message.reply_text(
+                        conflict_text,
+                        reply_markup=cancel_keyboard,
+                        parse_mode='HTML'
                     )
-                if len(conflicts) > 3:
-                    lines.append("• ...")
-                conflict_text = "⚠️ That time overlaps with other event(s):\n" + "\n".join(lines)
-                conflict_text += (
-                    "\n\nSend another time (e.g., <b>tomorrow 15:00</b>) or a new duration for this task "
-                    "(e.g., <b>30</b>, <b>45 min</b>, <b>1h</b>)."
-                )
-                cancel_keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("❌ Cancel reschedule", callback_data=f"cancel_reschedule_{event_id}")]
-                ])
-                context.user_data['reschedule_conflict_start'] = new_start_dt.isoformat()
+                    return
+            
+            except (ValueError, IndexError, TypeError):
+                keep["v"] = True  # ждём повторный ввод времени
+                cancel_keyboard = _cancel_reschedule_kb(event_id, chat_id)
                 await update.message.reply_text(
-                    conflict_text,
+                    "❌ Couldn't understand that time or duration. Try: <b>today 18:00</b>, <b>tomorrow 10:00</b>, <b>wed 14:30</b> or a duration like <b>30</b>, <b>45 min</b>.",
                     reply_markup=cancel_keyboard,
                     parse_mode='HTML'
                 )
-                return
-            
-        except (ValueError, IndexError, TypeError):
-            cancel_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("❌ Cancel reschedule", callback_data=f"cancel_reschedule_{event_id}")]
-            ])
-            await update.message.reply_text(
-                "❌ Couldn't understand that time or duration. Try: <b>today 18:00</b>, <b>tomorrow 10:00</b>, <b>wed 14:30</b> or a duration like <b>30</b>, <b>45 min</b>.",
-                reply_markup=cancel_keyboard,
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            print(f"[Bot] Ошибка при ручном переносе задачи: {e}")
-            await _clear_reschedule_prompt(context, chat_id)
-            await update.message.reply_text(
-                "❌ An error occurred. Please try again.",
-                reply_markup=build_main_menu()
-            )
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('rescheduling_event_id', None)
-            context.user_data.pop('reschedule_conflict_start', None)
+            except Exception:
+                keep["v"] = False
+                logger.exception("Ошибка при ручном переносе задачи")
+                await _clear_reschedule_prompt(context, chat_id)
+                await update.message.reply_text(
+                    "❌ An error occurred. Please try again.",
+                    reply_markup=build_main_menu()
+                )
         return
 
     elif waiting_for == 'task_duration':
         # Пользователь отвечает на вопрос о длительности задачи
         if text.strip().lower() in ("cancel", "отмена", "отменить"):
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('pending_event_data', None)
-            context.user_data.pop('pending_event_source', None)
+            _clear_event_preview_state(context)
             await update.message.reply_text("❌ Task creation cancelled.", reply_markup=build_main_menu())
             return
         pending_event = context.user_data.get('pending_event_data')
@@ -1489,8 +2149,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 "Sorry, I lost the task details. Please send the task again.",
                 reply_markup=build_main_menu()
             )
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('pending_event_source', None)
+            _clear_event_preview_state(context)
             return
 
         try:
@@ -1508,9 +2167,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             start_str = pending_event.get("start_time")
             if not start_str:
                 raise ValueError("Missing start_time in pending task")
-            start_dt = datetime.fromisoformat(start_str.replace("Z", "+00:00"))
-            if start_dt.tzinfo is None:
-                start_dt = pytz.utc.localize(start_dt)
+            start_dt = parse_iso_aware(start_str)
             end_dt = start_dt + timedelta(minutes=duration_minutes)
 
             pending_event["end_time"] = end_dt.isoformat()
@@ -1518,9 +2175,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             pending_event["duration_was_inferred"] = False
 
             # Очищаем состояние duration-ожидания и показываем предпросмотр
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('pending_event_data', None)
-            context.user_data.pop('pending_event_source', None)
+            _clear_event_preview_state(context)
 
             await show_event_preview(update, context, pending_event, source=pending_source)
         except Exception:
@@ -1528,9 +2183,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 "❌ An error occurred while saving the task. Please try again.",
                 reply_markup=build_main_menu()
             )
-            context.user_data.pop('waiting_for', None)
-            context.user_data.pop('pending_event_data', None)
-            context.user_data.pop('pending_event_source', None)
+            _clear_event_preview_state(context)
         return
     
     # Обработка редактирования события при подтверждении
@@ -1587,11 +2240,11 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             context.user_data.pop('waiting_for', None)
             return
         try:
-            user_tz = get_user_timezone(chat_id) or DEFAULT_TZ
-            tz = pytz.timezone(user_tz)
+            user_tz = _user_tz(chat_id)
+            tz = get_tz(user_tz)
             now_local = datetime.now(tz)
 
-            time_match = re.search(r'(\d{1,2}):(\d{2})', text)
+            time_match = _CLOCK_TIME_RE.search(text)
             if not time_match:
                 await update.message.reply_text(
                     "❌ Couldn't parse the time. Please use HH:MM format (e.g., '14:30'):"
@@ -1602,9 +2255,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             new_min = int(time_match.group(2))
 
             # Parse existing start datetime in user's timezone
-            start_dt = datetime.fromisoformat(pending_event['start_time'].replace('Z', '+00:00'))
-            if start_dt.tzinfo is None:
-                start_dt = pytz.utc.localize(start_dt)
+            start_dt = parse_iso_aware(pending_event['start_time'])
             start_local = start_dt.astimezone(tz)
 
             # Check if user also specified a day of week
@@ -1614,7 +2265,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 'friday': 4, 'fri': 4, 'saturday': 5, 'sat': 5,
                 'sunday': 6, 'sun': 6,
             }
-            text_words = re.split(r'\W+', text.lower())
+            text_words = _NON_WORD_RE.split(text.lower())
             mentioned_dow = None
             for kw, wd in dow_map.items():
                 if kw in text_words:
@@ -1635,9 +2286,7 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             # Preserve duration
             end_dt_raw = pending_event.get('end_time', '')
             if end_dt_raw:
-                end_dt = datetime.fromisoformat(end_dt_raw.replace('Z', '+00:00'))
-                if end_dt.tzinfo is None:
-                    end_dt = pytz.utc.localize(end_dt)
+                end_dt = parse_iso_aware(end_dt_raw)
                 duration = end_dt - start_dt
             else:
                 duration = timedelta(hours=1)
@@ -1653,259 +2302,19 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
                 reply_markup=build_event_preview_buttons()
             )
             context.user_data['waiting_for'] = 'event_confirmation'
-        except Exception as e:
-            print(f"[Bot] Error editing event time: {e}")
+        except Exception:
+            logger.exception("Error editing event time")
             await update.message.reply_text(
                 "❌ An error occurred. Please try again or send the time in HH:MM format:"
             )
         return
     
-    # Обработка онбординга
-    if context.chat_data.get('onboard_stage') == 'ask_name':
-        # Вопрос об имени
-        if text.strip():
-            try:
-                validated_name = _validate_user_input(text, "Name", max_length=100)
-                set_user_name(chat_id, validated_name)
-                await ask_timezone(update, context)
-            except ValueError as e:
-                await update.message.reply_text(f"❌ {e}\n\nPlease enter your name:")
-        else:
-            await update.message.reply_text(
-                "Please enter your name:"
-            )
-        return
-
-    if context.chat_data.get('onboard_stage') == 'timezone':
-        # Пользователь выбирает таймзону
-        if text == "✏️ Enter City Manually":
-            await update.message.reply_text(
-                "Please enter your city/timezone manually (e.g., Europe/London, America/New_York, Asia/Tokyo):",
-                reply_markup=ReplyKeyboardRemove()
-            )
-            context.chat_data['onboard_stage'] = 'timezone_manual'
-            return
-
-        if text == "🌍 Choose from UTC List":
-            await update.message.reply_text(
-                "Choose your UTC offset:",
-                reply_markup=build_utc_list_keyboard()
-            )
-            context.chat_data['onboard_stage'] = 'timezone_utc_list'
-            return
-
-        # Если это не кнопка, значит пользователь ввел что-то другое
-        await update.message.reply_text(
-            "Please choose one of the options:",
-            reply_markup=build_timezone_keyboard()
-        )
+    # Обработка онбординга: диспетчеризация по стадии через таблицу
+    onboard_handler = _ONBOARD_HANDLERS.get(context.chat_data.get('onboard_stage'))
+    if onboard_handler:
+        await onboard_handler(update, context, text)
         return
 
-    if context.chat_data.get('onboard_stage') == 'timezone_manual':
-        # Пользователь вводит таймзону вручную
-        try:
-            pytz.timezone(text)
-            set_user_timezone(chat_id, text)
-            await ask_morning_time(update, context)
-        except pytz.exceptions.UnknownTimeZoneError:
-            await update.message.reply_text(
-                "Invalid timezone. Please enter a valid timezone (e.g., Europe/London):"
-            )
-        return
-
-    if context.chat_data.get('onboard_stage') == 'timezone_utc_list':
-        # Пользователь выбрал UTC из списка
-        if text == "⬅️ Back":
-            await ask_timezone(update, context)
-            return
-        
-        # Парсим UTC offset
-        tz = parse_utc_offset(text)
-        if tz:
-            set_user_timezone(chat_id, tz)
-            await ask_morning_time(update, context)
-            return
-        else:
-            await update.message.reply_text(
-                "Invalid selection. Please choose from the list:",
-                reply_markup=build_utc_list_keyboard()
-            )
-            return
-    
-    if context.chat_data.get('onboard_stage') == 'ask_morning_time':
-        # Вопрос о времени утренней сводки
-        if text == "✏️ Enter Manually":
-            await update.message.reply_text(
-                "Please enter time in format HH:MM (e.g., 09:00, 08:30):",
-                reply_markup=ReplyKeyboardRemove()
-            )
-            context.chat_data['onboard_stage'] = 'ask_morning_time_manual'
-            return
-
-        # Проверяем, является ли это валидным временем
-        try:
-            if ':' in text:
-                parts = text.split(':')
-                if len(parts) == 2:
-                    hour = int(parts[0].strip())
-                    minute = int(parts[1].strip())
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        time_str = f"{hour:02d}:{minute:02d}"
-                        set_morning_time(chat_id, time_str)
-                        await ask_evening_time(update, context)
-                        return
-            raise ValueError("Invalid time format")
-        except (ValueError, IndexError):
-            await update.message.reply_text(
-                "Invalid time format. Please choose from the buttons or enter manually:",
-                reply_markup=build_morning_time_keyboard()
-            )
-            return
-
-    if context.chat_data.get('onboard_stage') == 'ask_morning_time_manual':
-        # Пользователь вводит время утренней сводки вручную
-        try:
-            if ':' in text:
-                parts = text.split(':')
-                if len(parts) == 2:
-                    hour = int(parts[0].strip())
-                    minute = int(parts[1].strip())
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        time_str = f"{hour:02d}:{minute:02d}"
-                        set_morning_time(chat_id, time_str)
-                        await ask_evening_time(update, context)
-                        return
-            raise ValueError("Invalid time format")
-        except (ValueError, IndexError):
-            await update.message.reply_text(
-                "Invalid time format. Please enter time in HH:MM format (e.g., 09:00, 08:30):"
-            )
-        return
-
-    if context.chat_data.get('onboard_stage') == 'ask_evening_time':
-        # Вопрос о времени вечерней сводки
-        if text == "✏️ Enter Manually":
-            await update.message.reply_text(
-                "Please enter time in format HH:MM (e.g., 21:00, 23:00):",
-                reply_markup=ReplyKeyboardRemove()
-            )
-            context.chat_data['onboard_stage'] = 'ask_evening_time_manual'
-            return
-
-        # Проверяем, является ли это валидным временем
-        try:
-            if ':' in text:
-                parts = text.split(':')
-                if len(parts) == 2:
-                    hour = int(parts[0].strip())
-                    minute = int(parts[1].strip())
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        time_str = f"{hour:02d}:{minute:02d}"
-                        set_evening_time(chat_id, time_str)
-                        await ask_default_duration_preference(update, context)
-                        return
-            raise ValueError("Invalid time format")
-        except (ValueError, IndexError):
-            await update.message.reply_text(
-                "Invalid time format. Please choose from the buttons or enter manually:",
-                reply_markup=build_evening_time_keyboard()
-            )
-        return
-
-    if context.chat_data.get('onboard_stage') == 'ask_evening_time_manual':
-        # Пользователь вводит время вечерней сводки вручную
-        try:
-            if ':' in text:
-                parts = text.split(':')
-                if len(parts) == 2:
-                    hour = int(parts[0].strip())
-                    minute = int(parts[1].strip())
-                    if 0 <= hour <= 23 and 0 <= minute <= 59:
-                        time_str = f"{hour:02d}:{minute:02d}"
-                        set_evening_time(chat_id, time_str)
-                        await ask_default_duration_preference(update, context)
-                        return
-            raise ValueError("Invalid time format")
-        except (ValueError, IndexError):
-            await update.message.reply_text(
-                "Invalid time format. Please enter time in HH:MM format (e.g., 21:00, 23:00):"
-            )
-        return
-
-    if context.chat_data.get('onboard_stage') == 'ask_default_duration_preference':
-        # Вопрос о предпочтении использВания дефолтной длительности
-        if "Yes" in text or "yes" in text:
-            # Пользователь хочет использовать дефолтную длительность
-            context.chat_data['use_default_duration'] = True
-            await ask_default_duration_value(update, context)
-            return
-        elif "No" in text or "no" in text:
-            # Пользователь хочет, чтобы мы спрашивали длительность каждый раз
-            context.chat_data['use_default_duration'] = False
-            set_default_duration_settings(chat_id, False, 30)
-            await finish_onboarding(update, context)
-            return
-        else:
-            await update.message.reply_text(
-                "Please choose an option:",
-                reply_markup=build_default_duration_keyboard()
-            )
-            return
-
-    if context.chat_data.get('onboard_stage') == 'ask_default_duration_value':
-        # Выбор дефолтной длительности задачи
-        use_default = context.chat_data.get('use_default_duration', True)
-        duration_map = {
-            "15 min": 15,
-            "15": 15,
-            "30 min": 30,
-            "30": 30,
-            "1 hour": 60,
-            "1": 60,
-            "60": 60,
-            "1.5 hours": 90,
-            "1.5": 90,
-            "90": 90,
-            "2 hours": 120,
-            "2": 120,
-            "120": 120,
-        }
-
-        if text in duration_map:
-            duration_minutes = duration_map[text]
-            set_default_duration_settings(chat_id, use_default, duration_minutes)
-            await finish_onboarding(update, context)
-            return
-        elif text == "✏️ Custom":
-            await update.message.reply_text(
-                "Please enter the default duration in minutes (e.g., 30, 45, 60):",
-                reply_markup=ReplyKeyboardRemove()
-            )
-            context.chat_data['onboard_stage'] = 'ask_default_duration_custom'
-            return
-        else:
-            await update.message.reply_text(
-                "Please choose a duration from the options:",
-                reply_markup=build_duration_choice_keyboard()
-            )
-            return
-
-    if context.chat_data.get('onboard_stage') == 'ask_default_duration_custom':
-        # Пользователь вводит дефолтную длительность вручную
-        try:
-            use_default = context.chat_data.get('use_default_duration', True)
-            duration_minutes = int(text.strip())
-            if duration_minutes <= 0 or duration_minutes > 1440:
-                raise ValueError("Duration must be between 1 and 1440 minutes")
-            set_default_duration_settings(chat_id, use_default, duration_minutes)
-            await finish_onboarding(update, context)
-            return
-        except (ValueError, TypeError):
-            await update.message.reply_text(
-                "Invalid duration. Please enter a number between 1 and 1440 (minutes):"
-            )
-            return
-
     # Ожидание подключения Google Calendar после онбординга
     if context.chat_data.get('onboard_stage') == 'awaiting_gcal_auth':
         if is_onboarded(chat_id):
@@ -1922,13 +2331,39 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not is_onboarded(chat_id):
         await update.message.reply_text(
             "Please complete the setup first by sending /start",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=_KEYBOARD_REMOVE
         )
         return
 
     await process_task(update, context, text=text, source="text")
 
 
+# Кэш скачанных файлов Telegram по file_id: повторная отправка того же файла
+# не требует get_file() + скачивания. Ограничен по числу записей и суммарному размеру.
+_FILE_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+_FILE_CACHE_MAX_ITEMS = 64
+_FILE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+_file_cache_bytes = 0
+
+
+async def _download_file_bytes(context: ContextTypes.DEFAULT_TYPE, file_id: str) -> bytes:
+    """Скачивает файл Telegram в память, используя кэш по file_id"""
+    global _file_cache_bytes
+    data = _FILE_CACHE.get(file_id)
+    if data is not None:
+        _FILE_CACHE.move_to_end(file_id)
+        return data
+    tg_file = await context.bot.get_file(file_id)
+    data = bytes(await tg_file.download_as_bytearray())
+    if data and len(data) <= _FILE_CACHE_MAX_BYTES:
+        _FILE_CACHE[file_id] = data
+        _file_cache_bytes += len(data)
+        while len(_FILE_CACHE) > _FILE_CACHE_MAX_ITEMS or _file_cache_bytes > _FILE_CACHE_MAX_BYTES:
+            _, evicted = _FILE_CACHE.popitem(last=False)
+            _file_cache_bytes -= len(evicted)
+    return data
+
+
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик голосовых сообщений"""
     if not update.message or not update.message.voice:
@@ -1965,36 +2400,22 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
     # Трекинг события
     track_event(chat_id, "task_source_voice")
     
-    # Скачиваем голосовое сообщение
-    voice_file = await context.bot.get_file(update.message.voice.file_id)
-    
-    # Сохраняем во временный файл
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as tmp_file:
-        await voice_file.download_to_drive(tmp_file.name)
-        tmp_path = tmp_file.name
-    
-    try:
-        # Транскрибируем голос
-        transcribed_text = await transcribe_voice(tmp_path)
-        
-        if not transcribed_text:
-            await update.message.reply_text(
-                "❌ Couldn't transcribe the voice message. Please try again or send as text.",
-                reply_markup=build_main_menu()
-            )
-            track_event(chat_id, "error", {"error_type": "voice_transcription_failed"})
-            return
+    # Скачиваем голосовое сообщение в память — без временного файла на диске
+    voice_bytes = await _download_file_bytes(context, update.message.voice.file_id)
 
-        # Обрабатываем транскрибированный текст
-        await process_task(update, context, text=transcribed_text, source="voice")
-    finally:
-        # Удаляем временный файл
-        try:
-            os.unlink(tmp_path)
-        except FileNotFoundError:
-            pass  # File already deleted - OK
-        except OSError as e:
-            print(f"[Bot] Warning: Failed to delete temp file {tmp_path}: {e}")
+    # Транскрибируем голос
+    transcribed_text = await transcribe_voice(voice_bytes, filename="voice.ogg")
+
+    if not transcribed_text:
+        await update.message.reply_text(
+            "❌ Couldn't transcribe the voice message. Please try again or send as text.",
+            reply_markup=build_main_menu()
+        )
+        track_event(chat_id, "error", {"error_type": "voice_transcription_failed"})
+        return
+
+    # Обрабатываем транскрибированный текст
+    await process_task(update, context, text=transcribed_text, source="voice")
 
 
 def format_event_preview(event_data: Dict[str, str]) -> str:
@@ -2118,55 +2539,41 @@ async def show_schedule_preview(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
 
-async def _process_photo_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str, suffix: str = '.jpg'):
+async def _process_photo_file(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str,
+                              mime_type: str = 'image/jpeg'):
     """Shared logic for processing a photo or image document."""
     chat_id = update.effective_chat.id
     track_event(chat_id, "task_source_photo")
 
-    photo_file = await context.bot.get_file(file_id)
-
-    # Create temp file then close it immediately so download_to_drive can write
-    # to it freely (on Windows an open NamedTemporaryFile causes a lock error).
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-        tmp_path = tmp_file.name
-    await photo_file.download_to_drive(tmp_path)
-
-    try:
-        file_size = os.path.getsize(tmp_path)
-        print(f"[Bot] Image downloaded: {tmp_path} ({file_size} bytes)")
-        if file_size == 0:
-            print("[Bot] Error: downloaded image file is empty")
-            await update.message.reply_text(
-                "❌ Couldn't download the image. Please try again.",
-                reply_markup=build_main_menu()
-            )
-            track_event(chat_id, "error", {"error_type": "image_download_empty"})
-            return
-
-        tz = get_user_timezone(chat_id) or DEFAULT_TZ
-        event_data = await extract_events_from_image(tmp_path, tz)
+    # Скачиваем в память — без временного файла на диске
+    image_bytes = await _download_file_bytes(context, file_id)
+    logger.info("Image downloaded: %d bytes", len(image_bytes))
+    if not image_bytes:
+        logger.error("Downloaded image file is empty")
+        await update.message.reply_text(
+            "❌ Couldn't download the image. Please try again.",
+            reply_markup=build_main_menu()
+        )
+        track_event(chat_id, "error", {"error_type": "image_download_empty"})
+        return
 
-        if not event_data:
-            await update.message.reply_text(
-                "❌ Couldn't find any events in the image.\n\n"
-                "Make sure the photo clearly shows a schedule, timetable, or a task with a time.\n"
-                "You can also send the task as a text message.",
-                reply_markup=build_main_menu()
-            )
-            track_event(chat_id, "error", {"error_type": "image_extraction_failed"})
-            return
+    tz = _user_tz(chat_id)
+    event_data = await extract_events_from_image(image_bytes, tz, mime_type=mime_type)
 
-        if event_data.get("is_recurring_schedule", False):
-            await show_schedule_preview(update, context, event_data, source="photo")
-        else:
-            await show_event_preview(update, context, event_data, source="photo")
-    finally:
-        try:
-            os.unlink(tmp_path)
-        except FileNotFoundError:
-            pass
-        except OSError as e:
-            print(f"[Bot] Warning: Failed to delete temp file {tmp_path}: {e}")
+    if not event_data:
+        await update.message.reply_text(
+            "❌ Couldn't find any events in the image.\n\n"
+            "Make sure the photo clearly shows a schedule, timetable, or a task with a time.\n"
+            "You can also send the task as a text message.",
+            reply_markup=build_main_menu()
+        )
+        track_event(chat_id, "error", {"error_type": "image_extraction_failed"})
+        return
+
+    if event_data.get("is_recurring_schedule", False):
+        await show_schedule_preview(update, context, event_data, source="photo")
+    else:
+        await show_event_preview(update, context, event_data, source="photo")
 
 
 async def handle_photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2194,7 +2601,7 @@ async def handle_photo_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Получаем фото наибольшего размера
     photo = update.message.photo[-1]
-    await _process_photo_file(update, context, photo.file_id, suffix='.jpg')
+    await _process_photo_file(update, context, photo.file_id)
 
 
 async def handle_document_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2232,23 +2639,19 @@ async def handle_document_message(update: Update, context: ContextTypes.DEFAULT_
         await _process_heic_document(update, context, doc.file_id)
         return
 
-    # Map MIME type to a temp file extension GPT-4o understands
-    mime_to_ext = {
-        "image/jpeg": ".jpg",
-        "image/jpg": ".jpg",
-        "image/png": ".png",
-        "image/webp": ".webp",
-        "image/gif": ".gif",
+    # Normalize MIME type to one GPT-4o understands (unknown types are sent as JPEG)
+    supported_mimes = {
+        "image/jpeg": "image/jpeg",
+        "image/jpg": "image/jpeg",
+        "image/png": "image/png",
+        "image/webp": "image/webp",
+        "image/gif": "image/gif",
     }
-    suffix = mime_to_ext.get(mime, ".jpg")
-
-    await _process_photo_file(update, context, doc.file_id, suffix=suffix)
+    await _process_photo_file(update, context, doc.file_id, mime_type=supported_mimes.get(mime, "image/jpeg"))
 
 
 async def _process_heic_document(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id: str):
     """Downloads a HEIC file, converts it to JPEG, then runs the normal image processing."""
-    heic_path = None
-    jpeg_path = None
     try:
         import pillow_heif
         from PIL import Image
@@ -2263,23 +2666,17 @@ async def _process_heic_document(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     try:
-        photo_file = await context.bot.get_file(file_id)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.heic') as hf:
-            heic_path = hf.name
-        await photo_file.download_to_drive(heic_path)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as jf:
-            jpeg_path = jf.name
-
-        with Image.open(heic_path) as img:
-            img.convert('RGB').save(jpeg_path, 'JPEG', quality=90)
+        # Конвертация целиком в памяти — без временных файлов
+        heic_bytes = await _download_file_bytes(context, file_id)
+        jpeg_buf = io.BytesIO()
+        with Image.open(io.BytesIO(heic_bytes)) as img:
+            img.convert('RGB').save(jpeg_buf, 'JPEG', quality=90)
 
         # Process the converted JPEG
         chat_id = update.effective_chat.id
         track_event(chat_id, "task_source_photo")
-        tz = get_user_timezone(chat_id) or DEFAULT_TZ
-        event_data = await extract_events_from_image(jpeg_path, tz)
+        tz = _user_tz(chat_id)
+        event_data = await extract_events_from_image(jpeg_buf.getvalue(), tz, mime_type="image/jpeg")
 
         if not event_data:
             await update.message.reply_text(
@@ -2294,56 +2691,15 @@ async def _process_heic_document(update: Update, context: ContextTypes.DEFAULT_T
         else:
             await show_event_preview(update, context, event_data, source="photo")
 
-    except Exception as e:
-        print(f"[Bot] Error processing HEIC image: {e}")
+    except Exception:
+        logger.exception("Error processing HEIC image")
         await update.message.reply_text(
             "❌ Couldn't process the HEIC image. Please try sending as a regular photo.",
             reply_markup=build_main_menu()
         )
-    finally:
-        for path in (heic_path, jpeg_path):
-            if path:
-                try:
-                    os.unlink(path)
-                except OSError:
-                    pass
 
 
-def get_next_occurrence_of_weekday(start_date: datetime, target_weekday: str) -> datetime:
-    """
-    Находит следующее вхождение указанного дня недели, начиная с start_date.
-    
-    Args:
-        start_date: Дата начала поиска (datetime с timezone)
-        target_weekday: День недели на английском (Monday, Tuesday, etc.)
-    
-    Returns:
-        datetime следующего вхождения дня недели
-    """
-    weekday_map = {
-        "Monday": 0,
-        "Tuesday": 1,
-        "Wednesday": 2,
-        "Thursday": 3,
-        "Friday": 4,
-        "Saturday": 5,
-        "Sunday": 6
-    }
-    
-    target_weekday_num = weekday_map.get(target_weekday)
-    if target_weekday_num is None:
-        raise ValueError(f"Invalid weekday: {target_weekday}")
-    
-    current_weekday = start_date.weekday()
-    days_ahead = target_weekday_num - current_weekday
-
-    if days_ahead < 0:
-        # Day already passed this week — jump to next week
-        days_ahead += 7
-    # If days_ahead == 0, today is that weekday — use today as-is
-    # (caller is responsible for checking if the time has passed and adding 7 days if needed)
-
-    return start_date + timedelta(days=days_ahead)
+_WEEKDAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
 
 
 async def handle_schedule_import(update: Update, context: ContextTypes.DEFAULT_TYPE, schedule_data: Dict, source: str):
@@ -2399,7 +2755,7 @@ async def handle_schedule_import(update: Update, context: ContextTypes.DEFAULT_T
     context.user_data['state'] = 'WAITING_FOR_WEEKS'
 
     # Отправляем сообщение с вопросом о количестве недель
-    cancel_kb = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data="schedule_weeks_cancel")]])
+    cancel_kb = build_schedule_weeks_cancel_button()
     weeks_prompt_msg = await msg.reply_text(
         f"👀 I see a weekly schedule with {len(events)} classes. For how many weeks should I add this to your calendar? (e.g., write '10' or '12'):",
         reply_markup=cancel_kb
@@ -2423,8 +2779,7 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
     # Allow user to cancel via text
     if text.strip().lower() in ("cancel", "отмена", "отменить"):
         await _clear_schedule_weeks_prompt(context, chat_id)
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
         await update.effective_message.reply_text("❌ Schedule import cancelled.", reply_markup=build_main_menu())
         return
 
@@ -2435,8 +2790,7 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
             "❌ Please connect your Google Calendar first using /start",
             reply_markup=build_main_menu()
         )
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
         return
 
     credentials = await _get_credentials_or_notify(
@@ -2444,8 +2798,7 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
         lambda t: update.effective_message.reply_text(t, reply_markup=build_main_menu())
     )
     if not credentials:
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
         return
 
     # Парсим количество недель
@@ -2467,17 +2820,16 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
             "❌ Schedule data not found. Please try importing the schedule again.",
             reply_markup=build_main_menu()
         )
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
         return
     
     # Получаем таймзону пользователя
-    user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-    tz = pytz.timezone(user_timezone)
+    user_timezone = _user_tz(chat_id)
+    tz = get_tz(user_timezone)
     now_local = datetime.now(tz)
 
     # Начинаем с сегодняшнего дня
-    start_date = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = tz.localize(datetime.combine(now_local.date(), datetime.min.time()))
 
     # Build the full list of events to create (without creating them yet)
     events_to_create = _build_schedule_event_list(pending_schedule, num_weeks, start_date)
@@ -2488,71 +2840,31 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
             "❌ No valid events could be parsed from the schedule.",
             reply_markup=build_main_menu()
         )
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
         return
 
-    # Check for conflicts with existing [SCHEDULE] events
+    # Check for conflicts with ALL existing events (not just previously imported schedules)
     conflict_lines = []
+    conflict_existing_ids: list = []
     try:
-        from googleapiclient.discovery import build as gcal_build
-        service = gcal_build('calendar', 'v3', credentials=credentials)
-
-        # Fetch all events in the import date range in one call
-        range_start = events_to_create[0]["start_time"]
-        range_end = events_to_create[-1]["end_time"]
-        existing_result = service.events().list(
-            calendarId='primary',
-            timeMin=range_start,
-            timeMax=range_end,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        existing_events = existing_result.get('items', [])
-
-        # Check against ALL existing events (not just previously imported schedules)
-        schedule_existing = existing_events
-
-        # Check each new event against existing events
+        # Список событий за весь диапазон импорта — самый долгий запрос в этом сценарии,
+        # поэтому вместе с поиском пересечений выполняется в рабочем потоке
+        conflicts = await asyncio.to_thread(_find_schedule_conflicts, credentials, events_to_create)
         seen_conflicts: set = set()
-        conflict_existing_ids: list = []
-        for ev in events_to_create:
-            new_start = datetime.fromisoformat(ev["start_time"].replace("Z", "+00:00"))
-            new_end = datetime.fromisoformat(ev["end_time"].replace("Z", "+00:00"))
-            if new_start.tzinfo is None:
-                new_start = pytz.utc.localize(new_start)
-            if new_end.tzinfo is None:
-                new_end = pytz.utc.localize(new_end)
-
-            for ex in schedule_existing:
-                ex_start_str = (ex.get('start') or {}).get('dateTime') or (ex.get('start') or {}).get('date')
-                ex_end_str = (ex.get('end') or {}).get('dateTime') or (ex.get('end') or {}).get('date')
-                if not ex_start_str or not ex_end_str:
-                    continue
-                try:
-                    ex_start = datetime.fromisoformat(ex_start_str.replace("Z", "+00:00"))
-                    ex_end = datetime.fromisoformat(ex_end_str.replace("Z", "+00:00"))
-                    if ex_start.tzinfo is None:
-                        ex_start = pytz.utc.localize(ex_start)
-                    if ex_end.tzinfo is None:
-                        ex_end = pytz.utc.localize(ex_end)
-                except Exception:
-                    continue
-                if new_start < ex_end and new_end > ex_start:
-                    ex_id = ex.get('id', '')
-                    ex_start_local = ex_start.astimezone(tz)
-                    conflict_key = (ex_id, ex_start_local.strftime('%a %H:%M'))
-                    if conflict_key not in seen_conflicts:
-                        seen_conflicts.add(conflict_key)
-                        ex_end_local = ex_end.astimezone(tz)
-                        conflict_lines.append(
-                            f"• {ex_start_local.strftime('%a %d %b %H:%M')}–{ex_end_local.strftime('%H:%M')} {ex.get('summary', 'Event')}"
-                        )
-                        if ex_id and ex_id not in conflict_existing_ids:
-                            conflict_existing_ids.append(ex_id)
-                    break
+        for _ev, ex, ex_start, ex_end in conflicts:
+            ex_id = ex.get('id', '')
+            ex_start_local = ex_start.astimezone(tz)
+            conflict_key = (ex_id, ex_start_local.strftime('%a %H:%M'))
+            if conflict_key not in seen_conflicts:
+                seen_conflicts.add(conflict_key)
+                ex_end_local = ex_end.astimezone(tz)
+                conflict_lines.append(
+                    f"• {ex_start_local.strftime('%a %d %b %H:%M')}–{ex_end_local.strftime('%H:%M')} {ex.get('summary', 'Event')}"
+                )
+                if ex_id and ex_id not in conflict_existing_ids:
+                    conflict_existing_ids.append(ex_id)
     except Exception as e:
-        print(f"[Bot] Warning: Could not check schedule conflicts: {e}")
+        logger.warning("Could not check schedule conflicts: %s", e)
 
     if conflict_lines:
         # Clear the "for how many weeks?" prompt now that we're moving to the conflict picker
@@ -2567,23 +2879,14 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
             f"⚠️ New schedule conflicts with {len(conflict_lines)} existing event(s):\n"
             f"{conflict_summary}\n\n"
             "What would you like to do?",
-            reply_markup=InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("🔄 Replace old", callback_data="schedule_weeks_replace"),
-                    InlineKeyboardButton("➕ Add both", callback_data="schedule_weeks_force"),
-                ],
-                [
-                    InlineKeyboardButton("⏭ Skip conflicts", callback_data="schedule_weeks_skip"),
-                    InlineKeyboardButton("❌ Cancel", callback_data="schedule_weeks_cancel"),
-                ],
-            ])
+            reply_markup=build_schedule_conflict_buttons()
         )
         track_event(chat_id, "schedule_import_conflicts_found", {"conflicts": len(conflict_lines)})
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
         return
 
     # No conflicts – proceed with creation
+    _invalidate_today_events(context)
     events_created = await _execute_schedule_creation(credentials, events_to_create, include_conflicts=True)
     await _clear_schedule_weeks_prompt(context, chat_id)
     await update.effective_message.reply_text(
@@ -2591,8 +2894,82 @@ async def handle_weeks_response(update: Update, context: ContextTypes.DEFAULT_TY
         reply_markup=build_main_menu()
     )
     track_event(chat_id, "schedule_imported", {"weeks": num_weeks, "events_created": events_created})
-    context.user_data.pop('state', None)
-    context.user_data.pop('pending_schedule', None)
+    _clear_schedule_import_state(context)
+
+
+def _find_schedule_conflicts(credentials, events_to_create: List[Dict]) -> List[tuple]:
+    """
+    Пересечения новых событий расписания с уже существующими в календаре.
+    Все события диапазона импорта берутся одним events().list; для каждого нового
+    события возвращается первое пересекающееся: (новое, существующее, его начало, его конец).
+    Блокирующий вызов — запускать через asyncio.to_thread.
+    """
+    service = get_calendar_service(credentials)
+    existing_result = service.events().list(
+        calendarId='primary',
+        timeMin=events_to_create[0]["start_time"],
+        timeMax=events_to_create[-1]["end_time"],
+        singleEvents=True,
+        orderBy='startTime'
+    ).execute()
+
+    existing = []
+    for ex in existing_result.get('items', []):
+        ex_start_str = (ex.get('start') or {}).get('dateTime') or (ex.get('start') or {}).get('date')
+        ex_end_str = (ex.get('end') or {}).get('dateTime') or (ex.get('end') or {}).get('date')
+        if not ex_start_str or not ex_end_str:
+            continue
+        try:
+            existing.append((ex, parse_iso_aware(ex_start_str), parse_iso_aware(ex_end_str)))
+        except Exception:
+            continue
+
+    conflicts = []
+    for ev in events_to_create:
+        new_start = parse_iso_aware(ev["start_time"])
+        new_end = parse_iso_aware(ev["end_time"])
+        for ex, ex_start, ex_end in existing:
+            if new_start < ex_end and new_end > ex_start:
+                conflicts.append((ev, ex, ex_start, ex_end))
+                break
+    return conflicts
+
+
+def _normalize_schedule_row(event: Dict) -> Optional[tuple]:
+    """
+    Приводит строку расписания к кортежу
+    (day_of_week, start_h, start_m, end_h, end_m, end_shift, summary, location).
+    end_shift — timedelta от начала, если конец не в тот же день после начала
+    (переход через полночь или пустой интервал → 1 час), иначе None.
+    Возвращает None для некорректных строк.
+    """
+    day_of_week = event.get("day_of_week")
+    start_time_str = event.get("start_time")
+    end_time_str = event.get("end_time")
+    if not day_of_week or not start_time_str:
+        return None
+
+    start_parts = start_time_str.split(":")
+    end_parts = (end_time_str or "").split(":")
+    if len(start_parts) != 2 or len(end_parts) != 2:
+        return None
+    try:
+        sh, sm = int(start_parts[0]), int(start_parts[1])
+        eh, em = int(end_parts[0]), int(end_parts[1])
+    except ValueError as e:
+        logger.warning("Error building schedule event: %s", e)
+        return None
+    if not (0 <= sh <= 23 and 0 <= sm <= 59 and 0 <= eh <= 23 and 0 <= em <= 59):
+        return None
+
+    end_shift = None
+    if (eh, em) < (sh, sm):
+        # Конец на следующий день (пара через полночь)
+        end_shift = timedelta(hours=eh - sh + 24, minutes=em - sm)
+    elif (eh, em) == (sh, sm):
+        end_shift = timedelta(hours=1)
+    return (day_of_week, sh, sm, eh, em, end_shift,
+            event.get("summary", "Event"), event.get("location", ""))
 
 
 def _build_schedule_event_list(pending_schedule: List[Dict], num_weeks: int, start_date: datetime) -> List[Dict]:
@@ -2602,60 +2979,54 @@ def _build_schedule_event_list(pending_schedule: List[Dict], num_weeks: int, sta
     """
     tz = start_date.tzinfo
     events_list = []
-    for week in range(num_weeks):
-        for event in pending_schedule:
-            day_of_week = event.get("day_of_week")
-            start_time_str = event.get("start_time")
-            end_time_str = event.get("end_time")
-            summary = event.get("summary", "Event")
-            location = event.get("location", "")
-
-            if not day_of_week or not start_time_str:
-                continue
+    start_day = start_date.date()
+    start_weekday = start_day.weekday()
+
+    # UTC-смещение постоянно в пределах дня (кроме дней перехода DST),
+    # поэтому считаем его один раз на дату и дальше переводим в UTC вычитанием
+    day_offsets: Dict = {}
+
+    def _to_utc(naive: datetime) -> datetime:
+        day = naive.date()
+        if day not in day_offsets:
+            midnight = datetime(day.year, day.month, day.day)
+            off = tz.localize(midnight).utcoffset()
+            next_off = tz.localize(midnight + timedelta(days=1)).utcoffset()
+            day_offsets[day] = off if off == next_off else None  # None — день перехода DST
+        off = day_offsets[day]
+        if off is None:
+            return tz.localize(naive).astimezone(_UTC)
+        return (naive - off).replace(tzinfo=_UTC)
+
+    # Разбор строк расписания один раз, а не на каждую неделю
+    normalized = [row for row in map(_normalize_schedule_row, pending_schedule) if row]
 
-            week_start = start_date + timedelta(weeks=week)
-            try:
-                event_date = get_next_occurrence_of_weekday(week_start, day_of_week)
-            except ValueError:
+    for week in range(num_weeks):
+        # Даты всех дней недели считаем один раз на неделю, а не для каждого события;
+        # арифметика только над date — без aware-datetime в цикле
+        week_start = start_day + timedelta(weeks=week)
+        week_dates = {
+            _WEEKDAY_NAMES[i]: week_start + timedelta(days=(i - start_weekday) % 7)
+            for i in range(7)
+        }
+        for day_of_week, sh, sm, eh, em, end_shift, summary, location in normalized:
+            event_date = week_dates.get(day_of_week)
+            if event_date is None:
                 continue
 
-            try:
-                start_parts = start_time_str.split(":")
-                end_parts = (end_time_str or "").split(":")
-                if len(start_parts) != 2 or len(end_parts) != 2:
-                    continue
-
-                start_hour = int(start_parts[0])
-                start_minute = int(start_parts[1])
-                end_hour = int(end_parts[0])
-                end_minute = int(end_parts[1])
-
-                if not (0 <= start_hour <= 23 and 0 <= start_minute <= 59 and
-                        0 <= end_hour <= 23 and 0 <= end_minute <= 59):
-                    continue
-
-                event_start = event_date.replace(hour=start_hour, minute=start_minute, second=0, microsecond=0)
-                event_end = event_date.replace(hour=end_hour, minute=end_minute, second=0, microsecond=0)
-
-                if event_end <= event_start:
-                    if end_hour < start_hour or (end_hour == start_hour and end_minute < start_minute):
-                        event_end = event_end + timedelta(days=1)
-                    else:
-                        event_end = event_start + timedelta(hours=1)
-
-                event_start_utc = event_start.astimezone(pytz.utc)
-                event_end_utc = event_end.astimezone(pytz.utc)
-
-                events_list.append({
-                    "summary": summary,
-                    "start_time": event_start_utc.isoformat(),
-                    "end_time": event_end_utc.isoformat(),
-                    "description": "[SCHEDULE]",
-                    "location": location,
-                })
-            except (ValueError, IndexError) as e:
-                print(f"[Bot] Error building schedule event: {e}")
-                continue
+            event_start = datetime(event_date.year, event_date.month, event_date.day, sh, sm)
+            if end_shift is None:
+                event_end = datetime(event_date.year, event_date.month, event_date.day, eh, em)
+            else:
+                event_end = event_start + end_shift
+
+            events_list.append({
+                "summary": summary,
+                "start_time": _to_utc(event_start).isoformat(),
+                "end_time": _to_utc(event_end).isoformat(),
+                "description": "[SCHEDULE]",
+                "location": location,
+            })
 
     return events_list
 
@@ -2667,19 +3038,34 @@ async def _execute_schedule_creation(credentials, events_to_create: List[Dict],
     If include_conflicts=False, skips events whose start_time is in conflict_starts (ISO strings).
     Returns the number of events successfully created.
     """
-    events_created = 0
-    for event_data in events_to_create:
-        if not include_conflicts and conflict_starts and event_data["start_time"] in conflict_starts:
-            continue
-        try:
-            event_url = create_event(credentials, event_data)
-            if event_url:
-                events_created += 1
-            await asyncio.sleep(0.05)  # Avoid hitting Google Calendar API rate limits
-        except Exception as e:
-            print(f"[Bot] Error creating schedule event '{event_data.get('summary')}': {e}")
-            continue
-    return events_created
+    if not include_conflicts and conflict_starts:
+        events_to_create = [e for e in events_to_create if e["start_time"] not in conflict_starts]
+    if not events_to_create:
+        return 0
+    # Batch-вставка: ⌈N/50⌉ HTTP-запросов вместо N последовательных; в отдельном потоке,
+    # чтобы не блокировать event loop на время сетевых вызовов
+    return await asyncio.to_thread(create_events_batch, credentials, events_to_create)
+
+
+async def _cancel_events_concurrently(credentials, event_ids: List[str]) -> int:
+    """
+    Удаляет события параллельно (не более _GCAL_CONCURRENCY запросов одновременно).
+    Returns the number of events successfully deleted.
+    """
+    sem = asyncio.Semaphore(_GCAL_CONCURRENCY)
+
+    async def _one(eid: str) -> bool:
+        async with sem:
+            return await asyncio.to_thread(cancel_event, credentials, eid)
+
+    results = await asyncio.gather(*(_one(eid) for eid in event_ids), return_exceptions=True)
+    deleted = 0
+    for eid, result in zip(event_ids, results):
+        if isinstance(result, Exception):
+            logger.warning("Error deleting conflicting event %s: %s", eid, result)
+        elif result:
+            deleted += 1
+    return deleted
 
 
 def _find_best_matching_event_for_text(events: List[Dict], text_lower: str, user_timezone: str) -> Optional[Dict]:
@@ -2690,13 +3076,13 @@ def _find_best_matching_event_for_text(events: List[Dict], text_lower: str, user
     if not events:
         return None
 
-    tz = pytz.timezone(user_timezone)
+    tz = get_tz(user_timezone)
     now_local = datetime.now(tz)
     today = now_local.date()
     tomorrow = (now_local + timedelta(days=1)).date()
 
     # Ищем времена формата HH:MM в тексте
-    time_matches = re.findall(r"\b(\d{1,2}):(\d{2})\b", text_lower)
+    time_matches = _CLOCK_TIME_WORD_RE.findall(text_lower)
     times_in_text = []
     for h_str, m_str in time_matches:
         try:
@@ -2727,9 +3113,7 @@ def _find_best_matching_event_for_text(events: List[Dict], text_lower: str, user
         try:
             if start_raw:
                 if "T" in start_raw:
-                    dt = datetime.fromisoformat(start_raw.replace("Z", "+00:00"))
-                    if dt.tzinfo is None:
-                        dt = pytz.utc.localize(dt)
+                    dt = parse_iso_aware(start_raw)
                     dt_local = dt.astimezone(tz)
                     local_time_tuple = (dt_local.hour, dt_local.minute)
                     local_date = dt_local.date()
@@ -2808,8 +3192,8 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
     if not credentials:
         return True
 
-    user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-    tz = pytz.timezone(user_timezone)
+    user_timezone = _user_tz(chat_id)
+    tz = get_tz(user_timezone)
     now_local = datetime.now(tz)
 
     # Собираем события на сегодня и ближайшие 6 дней
@@ -2819,8 +3203,8 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
         for offset in range(1, 7):
             target_date = (now_local + timedelta(days=offset)).date()
             events.extend(get_events_for_date(credentials, user_timezone, target_date))
-    except Exception as e:
-        print(f"[Bot] Ошибка при загрузке событий для команды управления задачами: {e}")
+    except Exception:
+        logger.exception("Ошибка при загрузке событий для команды управления задачами")
         await update.message.reply_text(
             "❌ Couldn't load your tasks. Please try again.",
             reply_markup=build_main_menu()
@@ -2860,9 +3244,7 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
     try:
         if start_raw:
             if "T" in start_raw:
-                dt = datetime.fromisoformat(start_raw.replace("Z", "+00:00"))
-                if dt.tzinfo is None:
-                    dt = pytz.utc.localize(dt)
+                dt = parse_iso_aware(start_raw)
                 dt_local = dt.astimezone(tz)
                 time_str = dt_local.strftime("%H:%M")
                 date_str = dt_local.strftime("%Y-%m-%d")
@@ -2881,6 +3263,7 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
     if is_cancel_cmd and not is_reschedule_cmd:
         # Отмена задачи
         try:
+            _invalidate_today_events(context)
             success = cancel_event(credentials, event_id)
             if success:
                 await update.message.reply_text(
@@ -2893,8 +3276,8 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
                     "❌ Failed to cancel the task. Please try again or use the buttons.",
                     reply_markup=build_main_menu()
                 )
-        except Exception as e:
-            print(f"[Bot] Ошибка при отмене задачи через естественный язык: {e}")
+        except Exception:
+            logger.exception("Ошибка при отмене задачи через естественный язык")
             await update.message.reply_text(
                 "❌ An error occurred while cancelling the task. Please try again.",
                 reply_markup=build_main_menu()
@@ -2906,9 +3289,7 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
         context.user_data['rescheduling_event_id'] = event_id
         context.user_data['waiting_for'] = 'reschedule_time'
 
-        cancel_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Cancel reschedule", callback_data=f"cancel_reschedule_{event_id}")]
-        ])
+        cancel_keyboard = _cancel_reschedule_kb(event_id, chat_id)
 
         await update.message.reply_text(
             f"📅 I found this task:\n<b>{label}</b>\n\n"
@@ -2927,7 +3308,7 @@ async def _try_handle_management_command(update: Update, context: ContextTypes.D
 async def process_task(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, source: str):
     """Обрабатывает задачу (текст или транскрибированный голос)"""
     chat_id = update.effective_chat.id
-    tz = get_user_timezone(chat_id) or DEFAULT_TZ
+    tz = _user_tz(chat_id)
     
     # Трекинг события
     track_event(chat_id, "message_received", {"source": source, "text_length": len(text)})
@@ -2939,7 +3320,7 @@ async def process_task(update: Update, context: ContextTypes.DEFAULT_TYPE, text:
             return
         
         # Определяем язык (простая проверка на кириллицу)
-        source_language = "ru" if any('\u0400' <= char <= '\u04FF' for char in text) else "en"
+        source_language = "ru" if _CYRILLIC_RE.search(text) else "en"
         
         # Парсим задачу с помощью AI
         ai_parsed = await parse_with_ai(text, tz, source_language)
@@ -3005,7 +3386,7 @@ async def process_task(update: Update, context: ContextTypes.DEFAULT_TYPE, text:
                 context.user_data['pending_event_data'] = ai_parsed
                 context.user_data['pending_event_source'] = source
 
-                cancel_kb = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data="cancel_task_duration")]])
+                cancel_kb = build_task_duration_cancel_button()
                 await update.message.reply_text(
                     "⏱ Please specify how long this task will take.\n\n"
                     "Examples: <b>30</b>, <b>30 min</b>, <b>1h</b>, <b>1:30</b>",
@@ -3018,7 +3399,7 @@ async def process_task(update: Update, context: ContextTypes.DEFAULT_TYPE, text:
             await show_event_preview(update, context, ai_parsed, source=source)
         
     except Exception as e:
-        print(f"[Bot] Ошибка при обработке задачи: {e}")
+        logger.exception("Ошибка при обработке задачи")
         track_event(chat_id, "error", {"error_type": str(type(e).__name__), "error_message": str(e)[:100]})
         await update.message.reply_text(
             "❌ An error occurred. Please try again.",
@@ -3047,11 +3428,13 @@ async def show_daily_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        # Получаем таймзону пользователя
-        user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
+        # Получаем таймзону пользователя (объект tz — один раз на весь рендер)
+        user_timezone = _user_tz(chat_id)
+        tz = get_tz(user_timezone)
         
-        # Получаем события на сегодня
-        events = get_today_events(credentials, user_timezone)
+        # Получаем события на сегодня (блокирующий HTTP — в отдельном потоке, не держим event loop)
+        events = await asyncio.to_thread(get_today_events, credentials, user_timezone)
+        _remember_today_events(context, events)
         
         if not events:
             await update.message.reply_text(
@@ -3062,67 +3445,9 @@ async def show_daily_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # Разделяем выполненные и невыполненные задачи; скрываем отменённые (❌)
-        completed_events = [e for e in events if e.get('summary', '').startswith('✅ ')]
-        incomplete_events = [
-            e for e in events
-            if not e.get('summary', '').startswith('✅ ')
-            and not e.get('summary', '').startswith('❌ ')
-        ]
-        
-        # Формируем текст сообщения - только интро
-        message_text = "📅 <b>Here are your tasks for today:</b>\n\n"
-        
-        # Добавляем информацию о выполненных задачах в текст
-        if completed_events:
-            message_text += "✅ Completed:\n"
-            for event in completed_events:
-                summary = event.get('summary', 'Task')
-                # Убираем "✅ " для отображения
-                if summary.startswith('✅ '):
-                    summary = summary[2:]
-                # Добавляем время задачи
-                start_time = event.get('start_time', '')
-                time_str = ""
-                if start_time:
-                    try:
-                        if 'T' in start_time:
-                            dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                            if dt.tzinfo:
-                                dt = dt.astimezone(pytz.timezone(user_timezone))
-                                time_str = dt.strftime('%H:%M')
-                    except Exception:
-                        pass
-                message_text += f"  • {time_str} {summary}\n" if time_str else f"  • {summary}\n"
-            message_text += "\n"
-        
-        # Добавляем информацию о невыполненных задачах
-        if incomplete_events:
-            message_text += "📋 Tasks to complete:\n"
-        else:
-            message_text += "🎉 All tasks completed! Great job!"
-        
-        # Создаем inline-клавиатуру для невыполненных задач (одна строка на задачу)
-        keyboard = []
-        tz = pytz.timezone(user_timezone)
-        for event in incomplete_events:
-            summary = event.get('summary', 'Task')
-            event_id = event.get('id', '')
-            if event_id:
-                start_time = event.get('start_time', '')
-                time_str = ""
-                if start_time:
-                    try:
-                        if 'T' in start_time:
-                            dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                            if dt.tzinfo:
-                                dt = dt.astimezone(tz)
-                                time_str = dt.strftime('%H:%M')
-                    except Exception:
-                        pass
-
-                label_text = f"{time_str} {summary}" if time_str else summary
-                keyboard.extend(_build_task_row(event_id, label_text))
+        message_text, keyboard = _render_task_list(
+            events, tz, "📅 <b>Here are your tasks for today:</b>\n\n", chat_id
+        )
         
         reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
 
@@ -3132,8 +3457,8 @@ async def show_daily_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='HTML'
         )
 
-    except Exception as e:
-        print(f"[Bot] Ошибка при отображении задач на сегодня: {e}")
+    except Exception:
+        logger.exception("Ошибка при отображении задач на сегодня")
         await update.message.reply_text(
             "❌ An error occurred while loading tasks. Please try again.",
             reply_markup=build_main_menu()
@@ -3143,47 +3468,36 @@ async def show_daily_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_tasks_for_date(update: Update, context: ContextTypes.DEFAULT_TYPE, date_text: str):
     """Shows tasks for a user-specified date"""
     chat_id = update.effective_chat.id
-    user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-    tz = pytz.timezone(user_timezone)
+    user_timezone = _user_tz(chat_id)
+    tz = get_tz(user_timezone)
     now_local = datetime.now(tz)
+    today = now_local.date()
+    tomorrow = today + timedelta(days=1)
 
     # Parse the date using AI or simple rules
     target_date = None
     date_text_lower = date_text.strip().lower()
 
-    # Simple built-in parsing first
-    if date_text_lower in ('today',):
-        target_date = now_local.date()
-    elif date_text_lower in ('tomorrow',):
-        target_date = (now_local + timedelta(days=1)).date()
+    # Simple built-in parsing first — AI только если ни один локальный формат не подошёл
+    day_offset = _RESCHEDULE_DAY_OFFSETS.get(date_text_lower)
+    if day_offset is not None:
+        target_date = today + timedelta(days=day_offset)
     else:
-        # Day-of-week names
-        day_names = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-        day_shorts = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
-        matched_dow = None
-        for i, (full, short) in enumerate(zip(day_names, day_shorts)):
-            if date_text_lower == full or date_text_lower == short:
-                matched_dow = i  # 0=Monday
-                break
+        # Day-of-week names (0=Monday) — общий словарь с быстрым разбором переноса
+        matched_dow = _RESCHEDULE_WEEKDAYS.get(date_text_lower)
         if matched_dow is not None:
-            current_dow = now_local.weekday()  # 0=Monday
+            current_dow = today.weekday()  # 0=Monday
             days_ahead = (matched_dow - current_dow) % 7
-            target_date = (now_local + timedelta(days=days_ahead)).date()
+            target_date = today + timedelta(days=days_ahead)
         else:
-            # Try ISO format YYYY-MM-DD
-            try:
-                target_date = datetime.strptime(date_text.strip(), '%Y-%m-%d').date()
-            except ValueError:
-                pass
+            target_date = _parse_numeric_date(date_text_lower, today)
 
         if target_date is None:
             # Fall back to AI parsing
             ai_parsed = await parse_with_ai(date_text, user_timezone)
             if ai_parsed and ai_parsed.get('start_time'):
                 try:
-                    dt = datetime.fromisoformat(ai_parsed['start_time'].replace('Z', '+00:00'))
-                    if dt.tzinfo is None:
-                        dt = pytz.utc.localize(dt)
+                    dt = parse_iso_aware(ai_parsed['start_time'])
                     target_date = dt.astimezone(tz).date()
                 except Exception:
                     pass
@@ -3215,12 +3529,12 @@ async def show_tasks_for_date(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
 
     try:
-        events = get_events_for_date(credentials, user_timezone, target_date)
+        events = await asyncio.to_thread(get_events_for_date, credentials, user_timezone, target_date)
 
         date_label = target_date.strftime('%A, %B %d')
-        if target_date == now_local.date():
+        if target_date == today:
             date_label = f"Today ({date_label})"
-        elif target_date == (now_local + timedelta(days=1)).date():
+        elif target_date == tomorrow:
             date_label = f"Tomorrow ({date_label})"
 
         if not events:
@@ -3231,60 +3545,9 @@ async def show_tasks_for_date(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return
 
-        completed_events = [e for e in events if e.get('summary', '').startswith('✅ ')]
-        incomplete_events = [
-            e for e in events
-            if not e.get('summary', '').startswith('✅ ')
-            and not e.get('summary', '').startswith('❌ ')
-        ]
-
-        message_text = f"📆 <b>{date_label}</b>\n\n"
-
-        if completed_events:
-            message_text += "✅ Completed:\n"
-            for event in completed_events:
-                summary = event.get('summary', 'Task')
-                if summary.startswith('✅ '):
-                    summary = summary[2:]
-                start_time = event.get('start_time', '')
-                time_str = ""
-                if start_time and 'T' in start_time:
-                    try:
-                        dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                        if dt.tzinfo:
-                            dt = dt.astimezone(tz)
-                            time_str = dt.strftime('%H:%M')
-                    except Exception:
-                        pass
-                if time_str:
-                    message_text += f"  • {time_str} {summary}\n"
-                else:
-                    message_text += f"  • {summary}\n"
-            message_text += "\n"
-
-        if incomplete_events:
-            message_text += "📋 Tasks to complete:\n"
-        else:
-            message_text += "🎉 All tasks completed!"
-
-        keyboard = []
-        for event in incomplete_events:
-            event_id = event.get('id', '')
-            if not event_id:
-                continue
-            summary = event.get('summary', 'Task')
-            start_time = event.get('start_time', '')
-            time_str = ""
-            if start_time and 'T' in start_time:
-                try:
-                    dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                    if dt.tzinfo:
-                        dt = dt.astimezone(tz)
-                        time_str = dt.strftime('%H:%M')
-                except Exception:
-                    pass
-            label_text = f"{time_str} {summary}" if time_str else summary
-            keyboard.extend(_build_task_row(event_id, label_text))
+        message_text, keyboard = _render_task_list(
+            events, tz, f"📆 <b>{date_label}</b>\n\n", chat_id, all_done_text="🎉 All tasks completed!"
+        )
 
         reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else build_main_menu()
         await update.message.reply_text(
@@ -3293,14 +3556,148 @@ async def show_tasks_for_date(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode='HTML'
         )
 
-    except Exception as e:
-        print(f"[Bot] Error loading tasks for date: {e}")
+    except Exception:
+        logger.exception("Error loading tasks for date")
         await update.message.reply_text(
             "❌ An error occurred while loading tasks. Please try again.",
             reply_markup=build_main_menu()
         )
 
 
+# callback_data, для которых handle_callback_query не отвечает сразу —
+# они сами вызывают query.answer() в своей ветке (до или после обработки)
+_NO_EARLY_ANSWER_PREFIXES = (
+    "done_", "already_done_", "resch_", "reschedule_", "confirm_move_", "cancel_", "del_", "delete_",
+)
+_NO_EARLY_ANSWER_EXACT = frozenset({"refresh_today", "reschedule_leftovers"})
+
+
+@lru_cache(maxsize=None)
+def build_duration_settings_buttons() -> InlineKeyboardMarkup:
+    """Build the default task duration picker for Settings"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("❓ Ask me each time", callback_data="duration_ask")],
+        [
+            InlineKeyboardButton("15 min", callback_data="duration_15"),
+            InlineKeyboardButton("30 min", callback_data="duration_30"),
+            InlineKeyboardButton("45 min", callback_data="duration_45"),
+        ],
+        [
+            InlineKeyboardButton("1h", callback_data="duration_60"),
+            InlineKeyboardButton("1.5h", callback_data="duration_90"),
+            InlineKeyboardButton("2h", callback_data="duration_120"),
+        ],
+    ])
+
+
+async def _cb_set_name(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    await query.edit_message_text(
+        "✏️ Enter your new name:",
+        reply_markup=None
+    )
+    context.user_data['waiting_for'] = 'name'
+
+
+# Здесь и ниже правка старого сообщения и новое сообщение с reply-клавиатурой
+# независимы (reply-клавиатуру нельзя повесить на отредактированное сообщение) —
+# отправляем их параллельно: один RTT до Telegram вместо двух.
+# waiting_for выставляется до отправки, а неудачная правка только логируется —
+# иначе ошибка edit (например, "message is not modified") оставила бы диалог без состояния.
+async def _edit_and_reply(query, edit_text: str, *reply_args, **reply_kwargs):
+    edit_result, reply_result = await asyncio.gather(
+        query.edit_message_text(edit_text),
+        query.message.reply_text(*reply_args, **reply_kwargs),
+        return_exceptions=True,
+    )
+    if isinstance(edit_result, Exception):
+        logger.warning("[settings] Failed to edit message: %s", edit_result)
+    if isinstance(reply_result, Exception):
+        raise reply_result
+
+
+async def _cb_set_tz(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    context.user_data['waiting_for'] = 'timezone'
+    await _edit_and_reply(
+        query,
+        "🌍 Changing timezone...",
+        "🌍 Share your location or enter timezone manually:",
+        reply_markup=build_timezone_keyboard()
+    )
+
+
+async def _cb_set_morning(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    context.user_data['waiting_for'] = 'morning_time'
+    await _edit_and_reply(
+        query,
+        "🌅 Changing morning briefing time...",
+        "🌅 At what time do you want to receive your Daily Plan?\n\n"
+        "Send time in HH:MM format (e.g., 09:00):",
+        reply_markup=build_morning_time_keyboard()
+    )
+
+
+async def _cb_set_evening(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    context.user_data['waiting_for'] = 'evening_time'
+    await _edit_and_reply(
+        query,
+        "🌙 Changing evening recap time...",
+        "🌙 When should I send you the Evening Recap?\n\n"
+        "Send time in HH:MM format (e.g., 21:00):",
+        reply_markup=build_evening_time_keyboard()
+    )
+
+
+async def _cb_connect_gcal(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    auth_url = get_authorization_url(chat_id, _oauth_redirect_uri())
+    await query.edit_message_text(
+        "To (re)connect your Google Calendar, click the link below:\n\n"
+        f'<a href="{auth_url}">🔗 Connect Google Calendar</a>',
+        parse_mode='HTML'
+    )
+
+
+async def _cb_disconnect_gcal(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    # Удаляем токены и помечаем, что онбординг по календарю больше не активен
+    delete_google_tokens(chat_id)
+    set_onboarded(chat_id, False)
+
+    await _edit_and_reply(
+        query,
+        "🔌 Google Calendar has been disconnected.\n\n"
+        "You can connect a new account at any time from Settings or by typing /start.",
+        "What would you like to do next?",
+        reply_markup=build_main_menu()
+    )
+
+
+async def _cb_set_duration(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    use_default = get_use_default_duration(chat_id)
+    default_dur = get_default_task_duration(chat_id)
+    status = f"{default_dur} min default" if use_default else "ask each time"
+    await query.edit_message_text(
+        f"⏱ Task Duration\nCurrent: {status}\n\n"
+        "When a task has no specified duration, should I ask you or use a default?",
+        reply_markup=build_duration_settings_buttons()
+    )
+
+
+async def _cb_duration_ask(query, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    set_default_duration_settings(chat_id, False, get_default_task_duration(chat_id))
+    await query.edit_message_text("✅ I'll ask you for duration each time it's not specified.")
+
+
+_SETTINGS_CALLBACK_HANDLERS = {
+    "set_name": _cb_set_name,
+    "set_tz": _cb_set_tz,
+    "set_morning": _cb_set_morning,
+    "set_evening": _cb_set_evening,
+    "connect_gcal": _cb_connect_gcal,
+    "disconnect_gcal": _cb_disconnect_gcal,
+    "set_duration": _cb_set_duration,
+    "duration_ask": _cb_duration_ask,
+}
+
+
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на inline-кнопки"""
     query = update.callback_query
@@ -3315,114 +3712,15 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         await query.answer("")  # Тихий ответ, чтобы убрать loading
         return
     
-    # Обработка настроек (не требуют авторизации Google Calendar)
-    if callback_data == "set_name":
-        await query.answer("")  # Убираем дублирование текста кнопки
-        await query.edit_message_text(
-            "✏️ Enter your new name:",
-            reply_markup=None
-        )
-        context.user_data['waiting_for'] = 'name'
-        return
-
-    elif callback_data == "set_tz":
-        await query.answer("")
-        await query.edit_message_text("🌍 Changing timezone...")
-        await query.message.reply_text(
-            "🌍 Share your location or enter timezone manually:",
-            reply_markup=build_timezone_keyboard()
-        )
-        context.user_data['waiting_for'] = 'timezone'
-        return
-
-    elif callback_data == "set_morning":
-        await query.answer("")
-        await query.edit_message_text("🌅 Changing morning briefing time...")
-        await query.message.reply_text(
-            "🌅 At what time do you want to receive your Daily Plan?\n\n"
-            "Send time in HH:MM format (e.g., 09:00):",
-            reply_markup=build_morning_time_keyboard()
-        )
-        context.user_data['waiting_for'] = 'morning_time'
-        return
-
-    elif callback_data == "set_evening":
-        await query.answer("")
-        await query.edit_message_text("🌙 Changing evening recap time...")
-        await query.message.reply_text(
-            "🌙 When should I send you the Evening Recap?\n\n"
-            "Send time in HH:MM format (e.g., 21:00):",
-            reply_markup=build_evening_time_keyboard()
-        )
-        context.user_data['waiting_for'] = 'evening_time'
-        return
-
-    elif callback_data == "connect_gcal":
-        await query.answer("")  # тихий ответ
-        chat_id = query.message.chat_id
-        # Формируем redirect_uri для callback.
-        redirect_uri = os.getenv("REDIRECT_URI")
-        if not redirect_uri:
-            base_url = os.getenv("BASE_URL")
-            if not base_url:
-                port = int(os.getenv("PORT", 8000))
-                base_url = f"http://localhost:{port}"
-            redirect_uri = f"{base_url}/google/callback"
-
-        auth_url = get_authorization_url(chat_id, redirect_uri)
-        await query.edit_message_text(
-            "To (re)connect your Google Calendar, click the link below:\n\n"
-            f'<a href="{auth_url}">🔗 Connect Google Calendar</a>',
-            parse_mode='HTML'
-        )
-        return
-
-    elif callback_data == "disconnect_gcal":
-        await query.answer("")  # тихий ответ
-        chat_id = query.message.chat_id
-        # Удаляем токены и помечаем, что онбординг по календарю больше не активен
-        delete_google_tokens(chat_id)
-        set_onboarded(chat_id, False)
-
-        await query.edit_message_text(
-            "🔌 Google Calendar has been disconnected.\n\n"
-            "You can connect a new account at any time from Settings or by typing /start."
-        )
-        await query.message.reply_text("What would you like to do next?", reply_markup=build_main_menu())
-        return
-
-    elif callback_data == "set_duration":
-        await query.answer("")
-        use_default = get_use_default_duration(chat_id)
-        default_dur = get_default_task_duration(chat_id)
-        status = f"{default_dur} min default" if use_default else "ask each time"
-        keyboard = [
-            [InlineKeyboardButton("❓ Ask me each time", callback_data="duration_ask")],
-            [
-                InlineKeyboardButton("15 min", callback_data="duration_15"),
-                InlineKeyboardButton("30 min", callback_data="duration_30"),
-                InlineKeyboardButton("45 min", callback_data="duration_45"),
-            ],
-            [
-                InlineKeyboardButton("1h", callback_data="duration_60"),
-                InlineKeyboardButton("1.5h", callback_data="duration_90"),
-                InlineKeyboardButton("2h", callback_data="duration_120"),
-            ],
-        ]
-        await query.edit_message_text(
-            f"⏱ Task Duration\nCurrent: {status}\n\n"
-            "When a task has no specified duration, should I ask you or use a default?",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return
-
-    elif callback_data == "duration_ask":
-        await query.answer("")
-        set_default_duration_settings(chat_id, False, get_default_task_duration(chat_id))
-        await query.edit_message_text("✅ I'll ask you for duration each time it's not specified.")
+    # Обработка настроек (не требуют авторизации Google Calendar): точные callback_data —
+    # одним поиском в dict, а не цепочкой сравнений перед каждым ✅/➡️/❌
+    settings_handler = _SETTINGS_CALLBACK_HANDLERS.get(callback_data)
+    if settings_handler is not None:
+        await query.answer("")  # тихий ответ, убираем дублирование текста кнопки
+        await settings_handler(query, context, chat_id)
         return
 
-    elif callback_data.startswith("duration_"):
+    if callback_data.startswith("duration_"):
         await query.answer("")
         try:
             mins = int(callback_data.split("_")[1])
@@ -3458,9 +3756,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
             pass
 
         # Очищаем состояние
-        context.user_data.pop('pending_event_preview', None)
-        context.user_data.pop('pending_event_source', None)
-        context.user_data.pop('waiting_for', None)
+        _clear_event_preview_state(context)
 
         await create_calendar_event(update, context, event_data, source=source)
         track_event(chat_id, "event_preview_confirmed", {"source": source})
@@ -3490,9 +3786,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
             return
         
         # Очищаем временные данные предпросмотра
-        context.user_data.pop('pending_schedule_preview', None)
-        context.user_data.pop('pending_event_source', None)
-        context.user_data.pop('waiting_for', None)
+        _clear_schedule_import_state(context)
         
         # Вызываем обработку импорта расписания (которая спросит о количестве недель)
         await handle_schedule_import(update, context, schedule_data, source=source)
@@ -3503,9 +3797,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         await query.answer("")  # тихий ответ
 
         # Очищаем сохраненные данные
-        context.user_data.pop('pending_schedule_preview', None)
-        context.user_data.pop('pending_event_source', None)
-        context.user_data.pop('waiting_for', None)
+        _clear_schedule_import_state(context)
 
         await query.edit_message_text("❌ Schedule import cancelled.")
         await query.message.reply_text("What would you like to do next?", reply_markup=build_main_menu())
@@ -3515,8 +3807,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         await query.answer("")
         events_to_create = context.user_data.pop('pending_schedule_events', None)
         conflict_existing_ids = context.user_data.pop('pending_schedule_conflict_ids', [])
-        context.user_data.pop('state', None)
-        context.user_data.pop('pending_schedule', None)
+        _clear_schedule_import_state(context)
 
         if callback_data == "schedule_weeks_cancel" or not events_to_create:
             await query.edit_message_text("❌ Schedule import cancelled.")
@@ -3537,20 +3828,15 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
 
         if callback_data == "schedule_weeks_replace":
             # Delete conflicting existing events, then import all new ones
-            deleted = 0
-            for eid in conflict_existing_ids:
-                try:
-                    ok = await asyncio.to_thread(cancel_event, credentials, eid)
-                    if ok:
-                        deleted += 1
-                except Exception as e:
-                    print(f"[Bot] Error deleting conflicting schedule event {eid}: {e}")
+            deleted = await _cancel_events_concurrently(credentials, conflict_existing_ids)
+            _invalidate_today_events(context)
             events_created = await _execute_schedule_creation(credentials, events_to_create, include_conflicts=True)
             await query.edit_message_text(
                 f"🔄 Replaced {deleted} old event(s). Created {events_created} new event(s)."
             )
         elif callback_data == "schedule_weeks_force":
             # Add both — import all new events without deleting old ones
+            _invalidate_today_events(context)
             events_created = await _execute_schedule_creation(credentials, events_to_create, include_conflicts=True)
             await query.edit_message_text(
                 f"✅ Schedule imported! Created {events_created} event(s) (kept existing ones too)."
@@ -3559,45 +3845,12 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
             # skip conflicts: re-check and skip new events that still conflict
             conflict_starts: set = set()
             try:
-                from googleapiclient.discovery import build as gcal_build2
-                service2 = gcal_build2('calendar', 'v3', credentials=credentials)
-                range_start = events_to_create[0]["start_time"]
-                range_end = events_to_create[-1]["end_time"]
-                existing_result2 = service2.events().list(
-                    calendarId='primary',
-                    timeMin=range_start,
-                    timeMax=range_end,
-                    singleEvents=True,
-                    orderBy='startTime'
-                ).execute()
-                schedule_existing2 = existing_result2.get('items', [])
-                for ev in events_to_create:
-                    new_start = datetime.fromisoformat(ev["start_time"].replace("Z", "+00:00"))
-                    new_end = datetime.fromisoformat(ev["end_time"].replace("Z", "+00:00"))
-                    if new_start.tzinfo is None:
-                        new_start = pytz.utc.localize(new_start)
-                    if new_end.tzinfo is None:
-                        new_end = pytz.utc.localize(new_end)
-                    for ex in schedule_existing2:
-                        ex_s = (ex.get('start') or {}).get('dateTime') or (ex.get('start') or {}).get('date')
-                        ex_e = (ex.get('end') or {}).get('dateTime') or (ex.get('end') or {}).get('date')
-                        if not ex_s or not ex_e:
-                            continue
-                        try:
-                            ex_start = datetime.fromisoformat(ex_s.replace("Z", "+00:00"))
-                            ex_end = datetime.fromisoformat(ex_e.replace("Z", "+00:00"))
-                            if ex_start.tzinfo is None:
-                                ex_start = pytz.utc.localize(ex_start)
-                            if ex_end.tzinfo is None:
-                                ex_end = pytz.utc.localize(ex_end)
-                        except Exception:
-                            continue
-                        if new_start < ex_end and new_end > ex_start:
-                            conflict_starts.add(ev["start_time"])
-                            break
+                conflicts = await asyncio.to_thread(_find_schedule_conflicts, credentials, events_to_create)
+                conflict_starts = {ev["start_time"] for ev, _ex, _s, _e in conflicts}
             except Exception as e:
-                print(f"[Bot] Error re-checking schedule conflicts: {e}")
+                logger.warning("Error re-checking schedule conflicts: %s", e)
 
+            _invalidate_today_events(context)
             events_created = await _execute_schedule_creation(
                 credentials, events_to_create, include_conflicts=False, conflict_starts=conflict_starts
             )
@@ -3669,11 +3922,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         if not credentials:
             return
         # Delete the conflicting old events first
-        for eid in conflict_ids:
-            try:
-                await asyncio.to_thread(cancel_event, credentials, eid)
-            except Exception as e:
-                print(f"[Bot] Error deleting conflicting event {eid}: {e}")
+        await _cancel_events_concurrently(credentials, conflict_ids)
         await query.edit_message_text("🔄 Replacing old event(s)...")
         await _do_create_and_confirm(update, context, credentials, event_data, source)
         return
@@ -3726,9 +3975,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
 
     elif callback_data == "cancel_task_duration":
         await query.answer("")
-        context.user_data.pop('waiting_for', None)
-        context.user_data.pop('pending_event_data', None)
-        context.user_data.pop('pending_event_source', None)
+        _clear_event_preview_state(context)
         await query.edit_message_text("❌ Task creation cancelled.")
         await query.message.reply_text("What would you like to do next?", reply_markup=build_main_menu())
         return
@@ -3738,20 +3985,12 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     # - "done_*" и "already_done_*" - вызывают query.answer() в конце обработки
     # - "refresh_today" - вызывает query.answer() после обновления списка
     # - "reschedule_*" - вызывают query.answer() после обработки
-    # - "confirm_move_*" - вызывают query.answer() после обработки
-    # - "cancel_*" - вызывают query.answer() после обработки
-    # - "reschedule_leftovers" - вызывает query.answer() после переноса задач
+    # - "confirm_move_*" - вызывают query.answer() в начале ветки, до запросов к Google
+    # - "cancel_*" - вызывают query.answer() в начале ветки (кроме cancel_reschedule_ — после)
+    # - "reschedule_leftovers" - вызывает query.answer() в начале ветки, до переноса задач
     # Вызываем только для других callback, которые не обрабатываются дальше
-    if (not callback_data.startswith("done_") and 
-        not callback_data.startswith("already_done_") and 
-        callback_data != "refresh_today" and 
-        not callback_data.startswith("resch_") and
-        not callback_data.startswith("reschedule_") and
-        not callback_data.startswith("confirm_move_") and
-        not callback_data.startswith("cancel_") and
-        not callback_data.startswith("del_") and
-        not callback_data.startswith("delete_") and
-        callback_data != "reschedule_leftovers"):
+    if (callback_data not in _NO_EARLY_ANSWER_EXACT
+            and not callback_data.startswith(_NO_EARLY_ANSWER_PREFIXES)):
         await query.answer("")  # Убираем дублирование текста кнопки для других callback
     
     stored_tokens = get_google_tokens(chat_id)
@@ -3774,82 +4013,27 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     if callback_data == "refresh_today":
         try:
             # Авторизация уже проверена выше
-            # Получаем таймзону пользователя
-            user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
+            # Получаем таймзону пользователя (объект tz — один раз на весь рендер)
+            user_timezone = _user_tz(chat_id)
+            tz_obj = get_tz(user_timezone)
             
             # Получаем события на сегодня
-            events = get_today_events(credentials, user_timezone)
+            events = await asyncio.to_thread(get_today_events, credentials, user_timezone)
+            _remember_today_events(context, events)
             
             if not events:
                 await query.edit_message_text(
                     "📅 <b>Here are your tasks for today:</b>\n\n"
-                    "No tasks scheduled for today! 🎉",
-                    reply_markup=None,
-                    parse_mode='HTML'
-                )
-                await query.answer("✅ List updated!")
-                return
-
-            # Разделяем выполненные и невыполненные задачи; скрываем отменённые (❌)
-            completed_events = [e for e in events if e.get('summary', '').startswith('✅ ')]
-            incomplete_events = [
-                e for e in events
-                if not e.get('summary', '').startswith('✅ ')
-                and not e.get('summary', '').startswith('❌ ')
-            ]
-            
-            # Формируем текст сообщения
-            message_text = "📅 <b>Here are your tasks for today:</b>\n\n"
-            
-            # Добавляем выполненные задачи
-            if completed_events:
-                message_text += "✅ Completed:\n"
-                for event in completed_events:
-                    summary = event.get('summary', 'Task')
-                    if summary.startswith('✅ '):
-                        summary = summary[2:]
-                    # Добавляем время задачи
-                    start_time = event.get('start_time', '')
-                    time_str = ""
-                    if start_time:
-                        try:
-                            if 'T' in start_time:
-                                dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                                # Форматируем только если есть timezone info и конвертация прошла успешно
-                                if dt.tzinfo:
-                                    dt = dt.astimezone(pytz.timezone(user_timezone))
-                                    time_str = dt.strftime('%H:%M')
-                        except Exception:
-                            pass
-                    message_text += f"  • {time_str} {summary}\n" if time_str else f"  • {summary}\n"
-                message_text += "\n"
-            
-            # Добавляем секцию невыполненных задач
-            if incomplete_events:
-                message_text += "📋 Tasks to complete:\n"
-            else:
-                message_text += "🎉 All tasks completed! Great job!"
-
-            # Создаем клавиатуру для невыполненных задач (одна строка на задачу)
-            keyboard = []
-            tz_obj = pytz.timezone(user_timezone)
-            for event in incomplete_events:
-                summary = event.get('summary', 'Task')
-                event_id = event.get('id', '')
-                if event_id:
-                    start_time = event.get('start_time', '')
-                    time_str = ""
-                    if start_time:
-                        try:
-                            if 'T' in start_time:
-                                dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                                if dt.tzinfo:
-                                    dt = dt.astimezone(tz_obj)
-                                    time_str = dt.strftime('%H:%M')
-                        except Exception:
-                            pass
-                    label_text = f"{time_str} {summary}" if time_str else summary
-                    keyboard.extend(_build_task_row(event_id, label_text))
+                    "No tasks scheduled for today! 🎉",
+                    reply_markup=None,
+                    parse_mode='HTML'
+                )
+                await query.answer("✅ List updated!")
+                return
+
+            message_text, keyboard = _render_task_list(
+                events, tz_obj, "📅 <b>Here are your tasks for today:</b>\n\n", chat_id
+            )
             
             reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
             
@@ -3859,8 +4043,8 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
                 parse_mode='HTML'
             )
             await query.answer("✅ List updated!")
-        except Exception as e:
-            print(f"[Bot] Ошибка при обновлении списка задач: {e}")
+        except Exception:
+            logger.exception("Ошибка при обновлении списка задач")
             await query.answer("❌ Error updating. Please try again.", show_alert=True)
         return
 
@@ -3869,415 +4053,379 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         await query.answer("✅ This task is already marked as completed!", show_alert=True)
         return
 
-    # Обработка отметки задачи как выполненной
-    if callback_data.startswith("done_"):
-        event_id = callback_data[5:]  # Убираем префикс "done_"
+    # Callback с event_id — через таблицу префиксов (одна проверка на префикс)
+    for prefix, handler in _EVENT_CALLBACK_HANDLERS:
+        if callback_data.startswith(prefix):
+            await handler(query, context, credentials, chat_id, callback_data[len(prefix):])
+            return
+
+
+def _get_calendar_event(credentials, event_id: str) -> Dict:
+    """events().get для вызова из рабочего потока (сервис берётся из кэша этого потока)"""
+    return get_calendar_service(credentials).events().get(calendarId='primary', eventId=event_id).execute()
+
+
+_EXPIRED_BUTTON_TEXT = "⌛ This button has expired. Please open the task list again."
+
+
+async def _cb_done(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Отметка задачи как выполненной"""
+    event_id = resolve_short_id(payload, chat_id)
+    if not event_id:
+        await query.answer(_EXPIRED_BUTTON_TEXT, show_alert=True)
+        return
+    
+    try:
+        # Отмечаем как выполненное; актуальный заголовок mark_event_done читает сам,
+        # отдельный events().get здесь был лишним round trip
+        success = await asyncio.to_thread(mark_event_done, credentials, event_id, 'Task')
         
-        try:
-            # Получаем событие для получения текущего заголовка
-            from googleapiclient.discovery import build
-            service = build('calendar', 'v3', credentials=credentials)
-            event = service.events().get(calendarId='primary', eventId=event_id).execute()
-            event_title = event.get('summary', 'Task')
+        if success:
+            # Обновляем UI на месте - удаляем строки с кнопками для этой задачи и обновляем текст
+            message_text = query.message.text or ""
             
-            # Убираем "✅ " если уже есть
-            if event_title.startswith('✅ '):
-                event_title = event_title[2:]
+            # Определяем тип сообщения
+            is_evening_recap = "hope it was a productive day" in message_text
+            is_tasks_today = "Here are your tasks" in message_text or "Mark what you've already done" in message_text
             
-            # Отмечаем как выполненное
-            success = mark_event_done(credentials, event_id, event_title)
+            inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
+            new_keyboard = _remove_task_row(inline_keyboard, payload)
             
-            if success:
-                # Обновляем UI на месте - удаляем строки с кнопками для этой задачи и обновляем текст
-                message_text = query.message.text or ""
-                
-                # Определяем тип сообщения
-                is_evening_recap = "hope it was a productive day" in message_text
-                is_tasks_today = "Here are your tasks" in message_text or "Mark what you've already done" in message_text
-                
-                if is_evening_recap or is_tasks_today:
-                    # Получаем обновленный список событий
-                    user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-                    events = get_today_events(credentials, user_timezone)
-                    completed_events = [e for e in events if e.get('summary', '').startswith('✅ ')]
-                    incomplete_events = [
-                        e for e in events
-                        if not e.get('summary', '').startswith('✅ ')
-                        and not e.get('summary', '').startswith('❌ ')
-                    ]
-                    
-                    # Пересоздаем текст сообщения
-                    if is_evening_recap:
-                        new_message_text = "Hey, hope it was a productive day!\n\n"
-                    else:
-                        new_message_text = "📅 <b>Here are your tasks for today:</b>\n\n"
-                    
-                    # Добавляем выполненные задачи
-                    if completed_events:
-                        tz = pytz.timezone(user_timezone)
-                        new_message_text += "✅ Completed:\n"
-                        for event in completed_events:
-                            summary = event.get('summary', 'Task')
-                            if summary.startswith('✅ '):
-                                summary = summary[2:]
-                            start_time = event.get('start_time', '')
-                            time_str = ""
-                            if start_time:
-                                try:
-                                    if 'T' in start_time:
-                                        dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                                        if dt.tzinfo:
-                                            dt = dt.astimezone(tz)
-                                            time_str = dt.strftime('%H:%M')
-                                except Exception:
-                                    pass
-                            new_message_text += f"  • {time_str} {summary}\n" if time_str else f"  • {summary}\n"
-                        new_message_text += "\n"
-                    
-                    # Добавляем информацию о невыполненных задачах
-                    if incomplete_events:
-                        if is_evening_recap:
-                            new_message_text += "📋 Tasks left behind:\n"
-                        else:
-                            new_message_text += "📋 Tasks to complete:\n"
-                    else:
-                        new_message_text += "🎉 All tasks completed! Great job!"
-                    
-                    # Пересоздаем клавиатуру для оставшихся задач (одна строка на задачу)
-                    new_keyboard = []
-                    tz = pytz.timezone(user_timezone)
-                    for evt in incomplete_events:
-                        evt_summary = evt.get('summary', 'Task')
-                        event_id_item = evt.get('id', '')
-                        if event_id_item:
-                            start_time = evt.get('start_time', '')
-                            time_str = ""
-                            if start_time:
-                                try:
-                                    if 'T' in start_time:
-                                        dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                                        if dt.tzinfo:
-                                            dt = dt.astimezone(tz)
-                                            time_str = dt.strftime('%H:%M')
-                                except Exception:
-                                    pass
-                            label_text = f"{time_str} {evt_summary}" if time_str else evt_summary
-                            new_keyboard.extend(_build_task_row(event_id_item, label_text))
-                    
-                    new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
-                    await query.edit_message_text(
-                        new_message_text,
-                        reply_markup=new_markup,
-                        parse_mode='HTML' if "<b>" in new_message_text else None
+            if new_keyboard is inline_keyboard:
+                # Кнопок этой задачи в сообщении уже нет (повторное нажатие) —
+                # сообщение не меняется, не перерисовываем и не дёргаем Bot API
+                pass
+            elif is_evening_recap or is_tasks_today:
+                # Обновленный список: отмечаем задачу в последнем отрисованном,
+                # и только если его нет (или устарел) — запрашиваем заново
+                user_timezone = _user_tz(chat_id)
+                tz = get_tz(user_timezone)
+                events = _today_events_after_done(context, event_id)
+                if events is None:
+                    events = await asyncio.to_thread(get_today_events, credentials, user_timezone)
+                    _remember_today_events(context, events)
+                # Пересоздаем текст сообщения и клавиатуру для оставшихся задач
+                if is_evening_recap:
+                    new_message_text, new_keyboard = _render_task_list(
+                        events, tz, "Hey, hope it was a productive day!\n\n", chat_id,
+                        leftovers_label="📋 Tasks left behind:\n"
                     )
                 else:
-                    inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
-                    new_keyboard = _remove_task_row(inline_keyboard, event_id)
-                    new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
-                    await query.edit_message_reply_markup(reply_markup=new_markup)
-                
-                await query.answer("✅ Task marked as completed!")
-                track_event(chat_id, "task_marked_done", {"event_id": event_id})
-            else:
-                await query.answer("❌ Failed to mark task as done. Please try again.", show_alert=True)
+                    new_message_text, new_keyboard = _render_task_list(
+                        events, tz, "📅 <b>Here are your tasks for today:</b>\n\n", chat_id
+                    )
                 
-        except Exception as e:
-            print(f"[Bot] Ошибка при отметке задачи как выполненной: {e}")
-            await query.answer("❌ An error occurred. Please try again.", show_alert=True)
-            track_event(chat_id, "error", {"error_type": "mark_task_done", "error_message": str(e)[:100]})
-    
-    # Обработка подтверждения переноса на предложенный слот (должен быть перед reschedule_manual_)
-    elif callback_data.startswith("confirm_move_"):
-        # Формат: confirm_move_{event_id}|{timestamp}
-        # Используем | как разделитель, так как event_id может содержать underscores
-        prefix = "confirm_move_"
-        if len(callback_data) > len(prefix):
-            remaining = callback_data[len(prefix):]
-            # Разделяем на event_id и timestamp по |
-            if "|" in remaining:
-                parts = remaining.split("|", 1)
-                if len(parts) == 2:
-                    event_id = parts[0]
-                    timestamp_str = parts[1]
-                else:
-                    event_id = None
-                    timestamp_str = None
+                new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
+                await query.edit_message_text(
+                    new_message_text,
+                    reply_markup=new_markup,
+                    parse_mode='HTML' if "<b>" in new_message_text else None
+                )
             else:
-                event_id = None
-                timestamp_str = None
+                # В сообщении нет списка задач — достаточно убрать строки кнопок
+                new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
+                await query.edit_message_reply_markup(reply_markup=new_markup)
+            
+            await query.answer("✅ Task marked as completed!")
+            track_event(chat_id, "task_marked_done", {"event_id": event_id})
         else:
-            event_id = None
-            timestamp_str = None
-        
-        if event_id and timestamp_str:
+            await query.answer("❌ Failed to mark task as done. Please try again.", show_alert=True)
+            
+    except Exception as e:
+        logger.exception("Ошибка при отметке задачи как выполненной")
+        await query.answer("❌ An error occurred. Please try again.", show_alert=True)
+        track_event(chat_id, "error", {"error_type": "mark_task_done", "error_message": str(e)[:100]})
+
+
+async def _cb_confirm_move(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Обработка подтверждения переноса на предложенный слот"""
+    # Сразу подтверждаем callback — дальше запросы к Google Calendar
+    await query.answer()
+    # Формат: confirm_move_{event_id}|{timestamp}
+    # Используем | как разделитель, так как event_id может содержать underscores
+    m = _CONFIRM_MOVE_RE.match(payload)
+    ref, timestamp_str = (m[1], m[2]) if m else (None, None)
+    event_id = resolve_short_id(ref, chat_id) if ref else None
+    
+    if event_id and timestamp_str:
+        try:
+            # Восстанавливаем datetime из timestamp
             try:
-                from googleapiclient.discovery import build
-                
-                # Восстанавливаем datetime из timestamp
-                try:
-                    timestamp_int = int(timestamp_str)
-                    suggested_time = datetime.fromtimestamp(timestamp_int, tz=pytz.utc)
-                except (ValueError, OSError) as e:
-                    print(f"[Bot] Invalid timestamp in confirm_move: {timestamp_str}, error: {e}")
-                    await query.answer("❌ Invalid timestamp. Please try rescheduling again.", show_alert=True)
-                    return
-                
-                user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-                tz = pytz.timezone(user_timezone)
-                suggested_time = suggested_time.astimezone(tz)
-                
-                # Получаем событие для вычисления длительности
-                service = build('calendar', 'v3', credentials=credentials)
-                event = service.events().get(calendarId='primary', eventId=event_id).execute()
-                
-                # Вычисляем длительность
-                start_str = event['start'].get('dateTime', event['start'].get('date'))
-                end_str = event['end'].get('dateTime', event['end'].get('date'))
-                
-                if 'T' in start_str:
-                    orig_start_dt = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-                    if orig_start_dt.tzinfo is None:
-                        orig_start_dt = pytz.utc.localize(orig_start_dt)
-                    orig_end_dt = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
-                    if orig_end_dt.tzinfo is None:
-                        orig_end_dt = pytz.utc.localize(orig_end_dt)
-                    duration = orig_end_dt - orig_start_dt
+                timestamp_int = int(timestamp_str)
+                new_start_utc = datetime.fromtimestamp(timestamp_int, tz=_UTC)
+            except (ValueError, OSError) as e:
+                logger.warning("Invalid timestamp in confirm_move: %s, error: %s", timestamp_str, e)
+                await query.message.reply_text("❌ Invalid timestamp. Please try rescheduling again.")
+                return
+            
+            # Получаем событие для вычисления длительности (в рабочем потоке, как и перенос ниже)
+            event = await asyncio.to_thread(_get_calendar_event, credentials, event_id)
+            
+            # Вычисляем длительность
+            start_str = event['start'].get('dateTime', event['start'].get('date'))
+            end_str = event['end'].get('dateTime', event['end'].get('date'))
+            
+            if 'T' in start_str:
+                duration = parse_iso_aware(end_str) - parse_iso_aware(start_str)
+            else:
+                duration = timedelta(hours=1)
+            
+            # Переносим событие — всё в UTC, в таймзону пользователя только для текста
+            new_end_utc = new_start_utc + duration
+            
+            _invalidate_today_events(context)
+            success = await asyncio.to_thread(
+                reschedule_event, credentials, event_id, new_start_utc, new_end_utc
+            )
+            
+            if success:
+                inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
+                new_keyboard = _remove_task_row(inline_keyboard, ref)
+                message_text = query.message.text or ""
+                tz = get_tz(_user_tz(chat_id))
+                suggested_time = new_start_utc.astimezone(tz)
+                today_date = datetime.now(tz).date()
+                time_str = suggested_time.strftime('%H:%M')
+                new_date = suggested_time.date()
+                if new_date == today_date:
+                    time_display = f"today at {time_str}"
+                elif new_date == today_date + timedelta(days=1):
+                    time_display = f"tomorrow at {time_str}"
                 else:
-                    duration = timedelta(hours=1)
-                
-                new_end_dt = suggested_time + duration
-                
-                # Переносим событие
-                new_start_utc = suggested_time.astimezone(pytz.utc)
-                new_end_utc = new_end_dt.astimezone(pytz.utc)
-                
-                success = reschedule_event(credentials, event_id, new_start_utc, new_end_utc)
+                    time_display = f"{suggested_time.strftime('%B %d')} at {time_str}"
+                message_text += f"\n\n✅ Moved to {time_display}"
+                new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
+                await query.edit_message_text(message_text, reply_markup=new_markup)
+                track_event(chat_id, "task_rescheduled_smart", {"event_id": event_id})
+            else:
+                await query.message.reply_text("❌ Failed to reschedule. Please try again.")
                 
-                if success:
-                    inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
-                    new_keyboard = _remove_task_row(inline_keyboard, event_id)
-                    message_text = query.message.text or ""
-                    user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-                    tz_local = pytz.timezone(user_timezone)
-                    now_local = datetime.now(tz_local)
-                    time_str = suggested_time.strftime('%H:%M')
-                    date_str = suggested_time.strftime('%Y-%m-%d')
-                    if date_str == now_local.strftime('%Y-%m-%d'):
-                        time_display = f"today at {time_str}"
-                    elif date_str == (now_local + timedelta(days=1)).strftime('%Y-%m-%d'):
-                        time_display = f"tomorrow at {time_str}"
-                    else:
-                        time_display = f"{suggested_time.strftime('%B %d')} at {time_str}"
-                    message_text += f"\n\n✅ Moved to {time_display}"
-                    new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
-                    await query.edit_message_text(message_text, reply_markup=new_markup)
-                    await query.answer("✅ Task moved!")
-                    track_event(chat_id, "task_rescheduled_smart", {"event_id": event_id})
-                else:
-                    await query.answer("❌ Failed to reschedule. Please try again.", show_alert=True)
-                    
-            except Exception as e:
-                print(f"[Bot] Ошибка при подтверждении переноса задачи: {e}")
-                await query.answer("❌ An error occurred. Please try again.", show_alert=True)
-                track_event(chat_id, "error", {"error_type": "confirm_reschedule", "error_message": str(e)[:100]})
-        else:
-            await query.answer("❌ Invalid confirmation data.", show_alert=True)
-    
-    # Обработка ручного ввода времени для переноса (должен быть перед общим reschedule_)
-    elif callback_data.startswith("reschedule_manual_"):
-        event_id = callback_data[18:]  # Убираем префикс "reschedule_manual_"
+        except Exception as e:
+            logger.exception("Ошибка при подтверждении переноса задачи")
+            await query.message.reply_text("❌ An error occurred. Please try again.")
+            track_event(chat_id, "error", {"error_type": "confirm_reschedule", "error_message": str(e)[:100]})
+    else:
+        await query.message.reply_text("❌ Invalid confirmation data.")
 
-        context.user_data['rescheduling_event_id'] = event_id
-        context.user_data['waiting_for'] = 'reschedule_time'
 
-        cancel_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Cancel reschedule", callback_data=f"cancel_reschedule_{event_id}")]
-        ])
-        prompt_msg = await query.message.reply_text(
-            "📅 For what time to reschedule?\n\n"
-            "Examples: <b>today 18:00</b>, <b>tomorrow 10:00</b>, <b>wed 14:30</b>, <b>15:00</b>",
-            reply_markup=cancel_keyboard,
-            parse_mode='HTML'
-        )
-        context.user_data['reschedule_prompt_msg_id'] = prompt_msg.message_id
-        await query.answer("")
+async def _cb_reschedule(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Обработка переноса задачи: запрос нового времени (resch_, reschedule_manual_, legacy reschedule_)"""
+    event_id = resolve_short_id(payload, chat_id)
+    if not event_id:
+        await query.answer(_EXPIRED_BUTTON_TEXT, show_alert=True)
+        return
 
-    # Обработка переноса задачи (resch_ or legacy reschedule_)
-    elif callback_data.startswith("resch_") or (callback_data.startswith("reschedule_") and not callback_data.startswith("reschedule_manual_") and not callback_data.startswith("reschedule_leftovers")):
-        event_id = callback_data[6:] if callback_data.startswith("resch_") else callback_data[11:]
+    context.user_data['rescheduling_event_id'] = event_id
+    context.user_data['waiting_for'] = 'reschedule_time'
 
-        context.user_data['rescheduling_event_id'] = event_id
-        context.user_data['waiting_for'] = 'reschedule_time'
+    cancel_keyboard = _cancel_reschedule_kb(event_id, chat_id)
+    prompt_msg = await query.message.reply_text(
+        "📅 For what time to reschedule?\n\n"
+        "Examples: <b>today 18:00</b>, <b>tomorrow 10:00</b>, <b>wed 14:30</b>, <b>15:00</b>",
+        reply_markup=cancel_keyboard,
+        parse_mode='HTML'
+    )
+    context.user_data['reschedule_prompt_msg_id'] = prompt_msg.message_id
+    await query.answer("")
 
-        cancel_keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("❌ Cancel reschedule", callback_data=f"cancel_reschedule_{event_id}")]
-        ])
-        prompt_msg = await query.message.reply_text(
-            "📅 For what time to reschedule?\n\n"
-            "Examples: <b>today 18:00</b>, <b>tomorrow 10:00</b>, <b>wed 14:30</b>, <b>15:00</b>",
-            reply_markup=cancel_keyboard,
-            parse_mode='HTML'
-        )
-        context.user_data['reschedule_prompt_msg_id'] = prompt_msg.message_id
-        await query.answer("")
+
+async def _cb_delete(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Обработка удаления задачи (del_ or legacy delete_)"""
+    event_id = resolve_short_id(payload, chat_id)
+    if not event_id:
+        await query.answer(_EXPIRED_BUTTON_TEXT, show_alert=True)
+        return
     
-    # Обработка удаления задачи (del_ or legacy delete_)
-    elif callback_data.startswith("del_") or callback_data.startswith("delete_"):
-        event_id = callback_data[4:] if callback_data.startswith("del_") else callback_data[7:]
+    # Сразу подтверждаем callback — дальше запрос к Google Calendar
+    await query.answer()
+    try:
+        _invalidate_today_events(context)
+        success = await asyncio.to_thread(cancel_event, credentials, event_id)
         
-        try:
-            success = cancel_event(credentials, event_id)
-            
-            if success:
-                inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
-                new_keyboard = _remove_task_row(inline_keyboard, event_id)
+        if success:
+            inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
+            new_keyboard = _remove_task_row(inline_keyboard, payload)
+            if new_keyboard is not inline_keyboard:
+                # Без изменений клавиатуры editMessageReplyMarkup не нужен
                 new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
                 await query.edit_message_reply_markup(reply_markup=new_markup)
-                await query.answer("✅ Task deleted!")
-                track_event(chat_id, "task_deleted", {"event_id": event_id})
-            else:
-                await query.answer("❌ Failed to delete task. Please try again.", show_alert=True)
-                
-        except Exception as e:
-            print(f"[Bot] Ошибка при удалении задачи: {e}")
-            await query.answer("❌ An error occurred. Please try again.", show_alert=True)
-            track_event(chat_id, "error", {"error_type": "delete_task", "error_message": str(e)[:100]})
-    
-    # Отмена операции переноса (не удаляет задачу)
-    elif callback_data.startswith("cancel_reschedule_"):
-        # Clear all reschedule state
-        await _clear_reschedule_prompt(context, chat_id)
-        context.user_data.pop('waiting_for', None)
-        context.user_data.pop('rescheduling_event_id', None)
-        context.user_data.pop('reschedule_conflict_start', None)
-        await query.edit_message_text("❌ Reschedule cancelled.")
-        await query.message.reply_text("What would you like to do next?", reply_markup=build_main_menu())
-        await query.answer("")
+            track_event(chat_id, "task_deleted", {"event_id": event_id})
+        else:
+            await query.message.reply_text("❌ Failed to delete task. Please try again.")
+            
+    except Exception as e:
+        logger.exception("Ошибка при удалении задачи")
+        await query.message.reply_text("❌ An error occurred. Please try again.")
+        track_event(chat_id, "error", {"error_type": "delete_task", "error_message": str(e)[:100]})
+
 
-    # Обработка отмены задачи (cancel_ - для обратной совместимости)
-    elif callback_data.startswith("cancel_"):
-        event_id = callback_data[7:]  # Убираем префикс "cancel_"
+async def _cb_cancel_reschedule(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Отмена операции переноса (не удаляет задачу)"""
+    # Clear all reschedule state
+    await _clear_reschedule_prompt(context, chat_id)
+    _clear_reschedule_state(context)
+    await query.edit_message_text("❌ Reschedule cancelled.")
+    await query.message.reply_text("What would you like to do next?", reply_markup=build_main_menu())
+    await query.answer("")
+
+
+async def _cb_cancel(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Обработка отмены задачи (cancel_ - для обратной совместимости)"""
+    event_id = resolve_short_id(payload, chat_id)
+    if not event_id:
+        await query.answer(_EXPIRED_BUTTON_TEXT, show_alert=True)
+        return
+    
+    # Сразу подтверждаем callback — дальше запрос к Google Calendar
+    await query.answer()
+    try:
+        _invalidate_today_events(context)
+        success = await asyncio.to_thread(cancel_event, credentials, event_id)
         
-        try:
-            success = cancel_event(credentials, event_id)
-            
-            if success:
-                inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
-                new_keyboard = _remove_task_row(inline_keyboard, event_id)
+        if success:
+            inline_keyboard = query.message.reply_markup.inline_keyboard if query.message.reply_markup else []
+            new_keyboard = _remove_task_row(inline_keyboard, payload)
+            if new_keyboard is not inline_keyboard:
+                # Без изменений клавиатуры editMessageReplyMarkup не нужен
                 new_markup = InlineKeyboardMarkup(new_keyboard) if new_keyboard else None
                 await query.edit_message_reply_markup(reply_markup=new_markup)
-                await query.answer("✅ Task cancelled!")
-                track_event(chat_id, "task_cancelled", {"event_id": event_id})
-            else:
-                await query.answer("❌ Failed to cancel task. Please try again.", show_alert=True)
-                
-        except Exception as e:
-            print(f"[Bot] Ошибка при отмене задачи: {e}")
-            await query.answer("❌ An error occurred. Please try again.", show_alert=True)
-            track_event(chat_id, "error", {"error_type": "cancel_task", "error_message": str(e)[:100]})
-    
-    # Обработка переноса остатка задач на завтра
-    elif callback_data == "reschedule_leftovers":
-        try:
-            user_timezone = get_user_timezone(chat_id) or DEFAULT_TZ
-            tz = pytz.timezone(user_timezone)
-            now_local = datetime.now(tz)
-            
-            # Получаем события на сегодня
-            events = get_today_events(credentials, user_timezone)
-            
-            # Фильтруем невыполненные (без "✅") и не отменённые (без "❌")
-            incomplete_events = [
-                e for e in events
-                if not e.get('summary', '').startswith('✅ ')
-                and not e.get('summary', '').startswith('❌ ')
-            ]
-            
-            if not incomplete_events:
-                await query.answer("✅ All tasks are already completed!", show_alert=True)
-                return
-            
-            # Переносим каждое событие на завтра
-            from googleapiclient.discovery import build
-            service = build('calendar', 'v3', credentials=credentials)
-            
-            rescheduled_count = 0
-            tomorrow = now_local + timedelta(days=1)
-            
-            for event in incomplete_events:
-                event_id = event.get('id')
-                if not event_id:
-                    continue
-                
-                try:
-                    # Получаем событие
-                    calendar_event = service.events().get(calendarId='primary', eventId=event_id).execute()
-                    
-                    # Парсим текущее время начала
-                    start_str = calendar_event['start'].get('dateTime', calendar_event['start'].get('date'))
-                    is_all_day = 'T' not in start_str
-                    
-                    if is_all_day:
-                        # Если это событие на весь день, используем 09:00 завтра
-                        start_dt = tomorrow.replace(hour=9, minute=0, second=0, microsecond=0)
-                        start_dt = tz.localize(start_dt) if start_dt.tzinfo is None else start_dt
-                    else:
-                        # Timed событие - парсим текущее время
-                        start_dt = datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-                        if start_dt.tzinfo is None:
-                            start_dt = pytz.utc.localize(start_dt)
-                    
-                    # Вычисляем длительность
-                    end_str = calendar_event['end'].get('dateTime', calendar_event['end'].get('date'))
-                    if 'T' in end_str:
-                        end_dt = datetime.fromisoformat(end_str.replace('Z', '+00:00'))
-                        if end_dt.tzinfo is None:
-                            end_dt = pytz.utc.localize(end_dt)
-                        duration = end_dt - start_dt
-                    else:
-                        duration = timedelta(hours=1)  # По умолчанию 1 час для all-day событий
-                    
-                    # Переносим на завтра
-                    if is_all_day:
-                        # Для all-day событий start_dt уже установлен на завтра, не добавляем день
-                        new_start = start_dt
-                    else:
-                        # Для timed событий конвертируем в локальный timezone и добавляем один день
-                        start_dt_local = start_dt.astimezone(tz)
-                        new_start = start_dt_local + timedelta(days=1)
-                        if new_start < now_local:
-                            # Если время уже прошло, ставим на утро завтра
-                            new_start = tomorrow.replace(hour=9, minute=0, second=0, microsecond=0)
-                            new_start = tz.localize(new_start) if new_start.tzinfo is None else new_start
-                    
-                    new_end = new_start + duration
-                    
-                    # Конвертируем в UTC для API
-                    new_start_utc = new_start.astimezone(pytz.utc)
-                    new_end_utc = new_end.astimezone(pytz.utc)
-                    
-                    # Переносим событие
-                    success = reschedule_event(credentials, event_id, new_start_utc, new_end_utc)
-                    if success:
-                        rescheduled_count += 1
-                        
-                except Exception as e:
-                    print(f"[Bot] Ошибка при переносе события {event_id}: {e}")
-                    continue
+            track_event(chat_id, "task_cancelled", {"event_id": event_id})
+        else:
+            await query.message.reply_text("❌ Failed to cancel task. Please try again.")
             
-            if rescheduled_count > 0:
-                await query.edit_message_text(
-                    f"✅ Rescheduled {rescheduled_count} task(s) to tomorrow."
-                )
-                await query.answer("✅ Done!")
-                track_event(chat_id, "tasks_rescheduled", {"count": rescheduled_count})
-            else:
-                await query.answer("❌ Failed to reschedule tasks. Please try again.", show_alert=True)
-                
+    except Exception as e:
+        logger.exception("Ошибка при отмене задачи")
+        await query.message.reply_text("❌ An error occurred. Please try again.")
+        track_event(chat_id, "error", {"error_type": "cancel_task", "error_message": str(e)[:100]})
+
+
+async def _cb_reschedule_leftovers(query, context: ContextTypes.DEFAULT_TYPE, credentials, chat_id: int, payload: str):
+    """Обработка переноса остатка задач на завтра"""
+    # Сразу подтверждаем callback — перенос может занять несколько секунд
+    await query.answer()
+    # Исходное сообщение (с форматированием и кнопками) — чтобы вернуть его,
+    # если перенос не удался и "⏳ Rescheduling…" больше не актуально
+    original_text = query.message.text or ''
+    original_entities = query.message.entities or None
+    original_markup = query.message.reply_markup
+    placeholder_shown = False
+
+    async def _restore_original():
+        if not placeholder_shown:
+            return
+        try:
+            await query.edit_message_text(
+                original_text, entities=original_entities, reply_markup=original_markup
+            )
         except Exception as e:
-            print(f"[Bot] Ошибка при переносе задач на завтра: {e}")
-            await query.answer("❌ An error occurred. Please try again.", show_alert=True)
-            track_event(chat_id, "error", {"error_type": "reschedule_tasks", "error_message": str(e)[:100]})
+            logger.warning("Не удалось вернуть исходное сообщение после ошибки переноса: %s", e)
+
+    try:
+        user_timezone = _user_tz(chat_id)
+        tz = get_tz(user_timezone)
+        now_local = datetime.now(tz)
+        
+        # Получаем события на сегодня; все блокирующие вызовы Google API ниже —
+        # в рабочем потоке, чтобы не держать event loop на время перепланирования
+        events = await asyncio.to_thread(get_today_events, credentials, user_timezone)
+        
+        # Фильтруем невыполненные (без "✅") и не отменённые (без "❌")
+        incomplete_events = [
+            e for e in events
+            if e.get('id') and e.get('summary', '')[:2] not in ('✅ ', '❌ ')
+        ]
+        
+        if not incomplete_events:
+            await query.message.reply_text("✅ All tasks are already completed!")
+            return
+        
+        # start/end уже есть в ответе events().list — новые времена считаем локально,
+        # перенос — batch patch: ⌈N/50⌉ HTTP-запросов вместо get + update на каждое событие
+        tomorrow = (now_local + timedelta(days=1)).date()
+        morning_utc = tz.localize(
+            datetime(tomorrow.year, tomorrow.month, tomorrow.day, 9)
+        ).astimezone(_UTC)
+        # Сущности исходного текста остаются валидными: плейсхолдер дописывается в конец.
+        # Кнопки на время переноса убираем, чтобы не было повторных нажатий
+        await query.edit_message_text(
+            f"{original_text}\n\n⏳ Rescheduling {len(incomplete_events)} task(s)…",
+            entities=original_entities,
+            reply_markup=None
+        )
+        placeholder_shown = True
+        
+        moves = []
+        for event in incomplete_events:
+            event_id = event['id']
+            try:
+                new_start_utc, new_end_utc = _leftover_move_times(
+                    event['start_time'], event.get('end_time', ''), tz, now_local, morning_utc
+                )
+            except Exception as e:
+                logger.warning("Ошибка при переносе события %s: %s", event_id, e)
+                continue
+            moves.append((event_id, new_start_utc, new_end_utc))
+        
+        _invalidate_today_events(context)
+        rescheduled_count = (
+            await asyncio.to_thread(reschedule_events_batch, credentials, moves) if moves else 0
+        )
+        
+        if rescheduled_count > 0:
+            await query.edit_message_text(
+                f"✅ Rescheduled {rescheduled_count} task(s) to tomorrow."
+            )
+            track_event(chat_id, "tasks_rescheduled", {"count": rescheduled_count})
+        else:
+            await _restore_original()
+            await query.message.reply_text("❌ Failed to reschedule tasks. Please try again.")
+            
+    except Exception as e:
+        logger.exception("Ошибка при переносе задач на завтра")
+        await _restore_original()
+        await query.message.reply_text("❌ An error occurred. Please try again.")
+        track_event(chat_id, "error", {"error_type": "reschedule_tasks", "error_message": str(e)[:100]})
+
+
+# Порядок важен: более длинные префиксы раньше пересекающихся коротких
+# (reschedule_manual_/reschedule_leftovers перед reschedule_, cancel_reschedule_ перед cancel_)
+_EVENT_CALLBACK_HANDLERS = (
+    ("done_", _cb_done),
+    ("confirm_move_", _cb_confirm_move),
+    ("reschedule_manual_", _cb_reschedule),
+    ("reschedule_leftovers", _cb_reschedule_leftovers),
+    ("resch_", _cb_reschedule),
+    ("reschedule_", _cb_reschedule),
+    ("del_", _cb_delete),
+    ("delete_", _cb_delete),
+    ("cancel_reschedule_", _cb_cancel_reschedule),
+    ("cancel_", _cb_cancel),
+)
+
+
+def _leftover_move_times(start_str: str, end_str: str, tz, now_local: datetime, morning_utc: datetime) -> tuple:
+    """
+    Новое время (UTC) для переноса невыполненной задачи на завтра.
+    Timed-события сдвигаются на сутки (если это время уже прошло — на 09:00 завтра),
+    события на весь день ставятся на 09:00 завтра длительностью 1 час.
+    morning_utc — 09:00 завтра по времени пользователя в UTC, считается один раз на весь перенос.
+    """
+    if 'T' not in start_str:
+        return morning_utc, morning_utc + timedelta(hours=1)
+
+    start_dt = parse_iso_aware(start_str)
+    duration = parse_iso_aware(end_str) - start_dt if 'T' in end_str else timedelta(hours=1)
+
+    # Если время завтра уже прошло — сразу утро завтра, без пересчёта таймзоны
+    if start_dt + timedelta(days=1) < now_local:
+        return morning_utc, morning_utc + duration
+
+    # Переносим на завтра в локальной таймзоне (сутки по часам пользователя, с учётом DST)
+    new_start = tz.normalize(start_dt.astimezone(tz) + timedelta(days=1))
+    if new_start < now_local:
+        return morning_utc, morning_utc + duration
+    new_start_utc = new_start.astimezone(_UTC)
+    return new_start_utc, new_start_utc + duration
 
 
 def _check_event_conflicts(credentials, event_start_utc: datetime, event_end_utc: datetime, exclude_event_id: str = None) -> List[Dict]:
@@ -4294,15 +4442,11 @@ def _check_event_conflicts(credentials, event_start_utc: datetime, event_end_utc
         List of conflicting events (empty if no conflicts)
     """
     try:
-        from google.oauth2.credentials import Credentials
-        from google.auth.transport.requests import Request
-        from googleapiclient.discovery import build
-        
         # Refresh credentials if needed
         if credentials.expired:
             credentials.refresh(Request())
         
-        service = build('calendar', 'v3', credentials=credentials)
+        service = get_calendar_service(credentials)
         
         # Query for events in the time range
         events_result = service.events().list(
@@ -4334,15 +4478,11 @@ def _check_event_conflicts(credentials, event_start_utc: datetime, event_end_utc
                 # Handle all-day events (date-only, no 'T' in the string)
                 if 'T' not in event_start_iso:
                     # All-day event: parse as midnight UTC so it gets a proper timezone
-                    e_start = pytz.utc.localize(datetime.strptime(event_start_iso, '%Y-%m-%d'))
-                    e_end = pytz.utc.localize(datetime.strptime(event_end_iso, '%Y-%m-%d'))
+                    e_start = _UTC.localize(datetime.strptime(event_start_iso, '%Y-%m-%d'))
+                    e_end = _UTC.localize(datetime.strptime(event_end_iso, '%Y-%m-%d'))
                 else:
-                    e_start = datetime.fromisoformat(event_start_iso.replace('Z', '+00:00'))
-                    e_end = datetime.fromisoformat(event_end_iso.replace('Z', '+00:00'))
-                    if e_start.tzinfo is None:
-                        e_start = pytz.utc.localize(e_start)
-                    if e_end.tzinfo is None:
-                        e_end = pytz.utc.localize(e_end)
+                    e_start = parse_iso_aware(event_start_iso)
+                    e_end = parse_iso_aware(event_end_iso)
 
                 # Check for overlap
                 if e_start < event_end_utc and e_end > event_start_utc:
@@ -4356,8 +4496,8 @@ def _check_event_conflicts(credentials, event_start_utc: datetime, event_end_utc
                 continue
         
         return conflicts
-    except Exception as e:
-        print(f"[Bot] Error checking event conflicts: {e}")
+    except Exception:
+        logger.exception("Error checking event conflicts")
         return []
 
 
@@ -4367,30 +4507,26 @@ async def create_calendar_event(update: Update, context: ContextTypes.DEFAULT_TY
     reply_fn = update.effective_message.reply_text
 
     # Проверяем авторизацию
-    print(f"[Bot] create_calendar_event вызван для chat_id={chat_id}, source={source}")
+    logger.info("create_calendar_event вызван для chat_id=%s, source=%s", chat_id, source)
     has_auth = has_google_auth(chat_id)
-    print(f"[Bot] Результат проверки авторизации для chat_id={chat_id}: {has_auth}")
+    logger.info("Результат проверки авторизации для chat_id=%s: %s", chat_id, has_auth)
 
     if not has_auth:
         # Дополнительная проверка - может быть токены есть, но refresh_token отсутствует
         stored_tokens = get_google_tokens(chat_id)
         if stored_tokens:
-            print(f"[Bot] Токены найдены для chat_id={chat_id}, но авторизация не прошла. Детали:")
-            print(f"[Bot] - token: {'есть' if stored_tokens.get('token') else 'нет'}")
-            print(f"[Bot] - refresh_token: {'есть' if stored_tokens.get('refresh_token') else 'нет'}")
-            print(f"[Bot] - client_id: {'есть' if stored_tokens.get('client_id') else 'нет'}")
-            print(f"[Bot] - client_secret: {'есть' if stored_tokens.get('client_secret') else 'нет'}")
-
-        redirect_uri = os.getenv("REDIRECT_URI")
-        if not redirect_uri:
-            base_url = os.getenv("BASE_URL")
-            if not base_url:
-                port = int(os.getenv("PORT", 8000))
-                base_url = f"http://localhost:{port}"
-            redirect_uri = f"{base_url}/google/callback"
+            logger.warning(
+                "Токены найдены для chat_id=%s, но авторизация не прошла: "
+                "token=%s, refresh_token=%s, client_id=%s, client_secret=%s",
+                chat_id,
+                *('есть' if stored_tokens.get(k) else 'нет'
+                  for k in ('token', 'refresh_token', 'client_id', 'client_secret')),
+            )
+
+        redirect_uri = _oauth_redirect_uri()
 
         auth_url = get_authorization_url(chat_id, redirect_uri)
-        print(f"[Bot] Отправляем ссылку на авторизацию Google Calendar для chat_id={chat_id}")
+        logger.info("Отправляем ссылку на авторизацию Google Calendar для chat_id=%s", chat_id)
         await reply_fn(
             f"🔗 Please connect your Google Calendar first:\n\n"
             f'<a href="{auth_url}">🔗 Connect Google Calendar</a>',
@@ -4417,17 +4553,13 @@ async def create_calendar_event(update: Update, context: ContextTypes.DEFAULT_TY
 
     # Check for conflicts with existing events
     try:
-        start_dt = datetime.fromisoformat(event_data["start_time"].replace("Z", "+00:00"))
-        end_dt = datetime.fromisoformat(event_data["end_time"].replace("Z", "+00:00"))
-        if start_dt.tzinfo is None:
-            start_dt = pytz.utc.localize(start_dt)
-        if end_dt.tzinfo is None:
-            end_dt = pytz.utc.localize(end_dt)
+        start_dt = parse_iso_aware(event_data["start_time"])
+        end_dt = parse_iso_aware(event_data["end_time"])
 
         conflicts = await asyncio.to_thread(_check_event_conflicts, credentials, start_dt, end_dt)
         if conflicts:
-            user_tz = get_user_timezone(chat_id) or DEFAULT_TZ
-            tz = pytz.timezone(user_tz)
+            user_tz = _user_tz(chat_id)
+            tz = get_tz(user_tz)
             lines = []
             for c in conflicts[:3]:
                 c_start = c['start'].astimezone(tz)
@@ -4443,20 +4575,11 @@ async def create_calendar_event(update: Update, context: ContextTypes.DEFAULT_TY
             conflict_text = "⚠️ This event overlaps with existing event(s):\n" + "\n".join(lines)
             conflict_text += "\n\nWhat would you like to do?"
 
-            markup = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton("🔄 Replace old", callback_data="conflict_replace"),
-                    InlineKeyboardButton("➕ Add both", callback_data="conflict_proceed"),
-                ],
-                [
-                    InlineKeyboardButton("🚫 Keep old", callback_data="conflict_cancel"),
-                    InlineKeyboardButton("✏️ Change time", callback_data="conflict_change_time"),
-                ],
-            ])
+            markup = build_conflict_buttons()
             await reply_fn(conflict_text, reply_markup=markup)
             return
-    except Exception as e:
-        print(f"[Bot] Error checking conflicts before event creation: {e}")
+    except Exception:
+        logger.exception("Error checking conflicts before event creation")
         # Continue with creation even if conflict check fails
 
     # Создаем событие
@@ -4468,6 +4591,7 @@ async def _do_create_and_confirm(update: Update, context: ContextTypes.DEFAULT_T
     chat_id = update.effective_chat.id
     reply_fn = update.effective_message.reply_text
 
+    _invalidate_today_events(context)
     event_url = create_event(credentials, event_data)
 
     if event_url:
@@ -4477,12 +4601,9 @@ async def _do_create_and_confirm(update: Update, context: ContextTypes.DEFAULT_T
             "summary": event_data.get("summary", "")[:50]
         })
 
-        tz = get_user_timezone(chat_id) or DEFAULT_TZ
-        start_dt = datetime.fromisoformat(event_data["start_time"].replace("Z", "+00:00"))
-        # Убеждаемся, что timezone установлен правильно
-        if start_dt.tzinfo is None:
-            start_dt = pytz.utc.localize(start_dt)
-        start_local = start_dt.astimezone(pytz.timezone(tz))
+        tz = _user_tz(chat_id)
+        start_dt = parse_iso_aware(event_data["start_time"])
+        start_local = start_dt.astimezone(get_tz(tz))
 
         await reply_fn(
             f"✅ Event added: {event_data.get('summary', 'Task')} on {start_local.strftime('%a %d %b')} at {start_local.strftime('%H:%M')}",
@@ -4507,28 +4628,123 @@ async def set_commands(app: Application):
 
 # ----------------- Main -----------------
 
+# Ответы Google OAuth callback — заранее закодированные байты
+_OAUTH_OK_HTML = """\
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Authorization Successful</title>
+    <meta charset="UTF-8">
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            display: flex;
+            justify-content: center;
+            align-items: center;
+            height: 100vh;
+            margin: 0;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        }
+        .container {
+            background: white;
+            padding: 40px;
+            border-radius: 10px;
+            box-shadow: 0 10px 25px rgba(0,0,0,0.2);
+            text-align: center;
+        }
+        h1 {
+            color: #4CAF50;
+            margin-bottom: 20px;
+        }
+        p {
+            color: #666;
+            font-size: 16px;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>✅ Authorization Successful!</h1>
+        <p>You can close this window and return to the bot.</p>
+    </div>
+</body>
+</html>
+""".encode("utf-8")
+_OAUTH_ERR_MISSING = b"Error: Missing code or state parameter"
+_OAUTH_ERR_STATE = b"Error: Invalid state parameter"
+_OAUTH_ERR_TOKEN_EXCHANGE = b"Error: Failed to exchange authorization code for tokens"
+
+
+# Render дёргает health check каждые несколько секунд: тело ответа — готовые байты,
+# а строки access-лога aiohttp для этих запросов не пишем
+_HEALTH_BODY = b"OK"
+_HEALTH_PATHS = ('"GET / ', '"GET /health ', '"HEAD / ', '"HEAD /health ')
+
+# Хендлеры обрабатывают только сообщения и нажатия inline-кнопок — остальные типы
+# апдейтов (edited_message, my_chat_member, ...) Telegram не будет присылать вовсе
+_ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+_POLLING_TIMEOUT = 30
+
+
+def _skip_health_access_log(record: logging.LogRecord) -> bool:
+    message = record.getMessage()
+    return not any(path in message for path in _HEALTH_PATHS)
+
+
+def _setup_logging():
+    """
+    Логи пишутся через QueueHandler: хендлеры бота только кладут запись в очередь,
+    а запись в stderr делает фоновый поток QueueListener (не блокирует event loop).
+    """
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    # Root — WARNING: httpx (PTB) пишет на INFO каждый запрос, включая URL с токеном бота,
+    # а googleapiclient/apscheduler шумят каждую минуту. INFO — только для своих логгеров.
+    root.setLevel(logging.WARNING)
+    for name in ("bot", "services", "aiohttp.access"):
+        logging.getLogger(name).setLevel(logging.INFO)
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    logging.getLogger("aiohttp.access").addFilter(_skip_health_access_log)
+    listener.start()
+    return listener
+
+
 def main():
+    listener = _setup_logging()
+    try:
+        _main()
+    finally:
+        # Поток QueueListener — daemon: без stop() записи, оставшиеся в очереди
+        # (например, "[singleton-*] ... exiting" прямо перед выходом), потеряются
+        listener.stop()
+
+
+def _main():
     init_db()
 
     # Singleton gates (Render etc.)
     holder = os.getenv("RENDER_INSTANCE_ID") or os.getenv("DYNO") or os.getenv("HOSTNAME") or "unknown"
     primary_env = os.getenv("PRIMARY_INSTANCE_ID")
     if primary_env and holder != primary_env:
-        print(f"[singleton-env] Instance {holder} != PRIMARY_INSTANCE_ID {primary_env}: exiting.")
+        logger.warning("[singleton-env] Instance %s != PRIMARY_INSTANCE_ID %s: exiting.", holder, primary_env)
         return
     if os.getenv("INSTANCE_PREFERRED", "").lower() == "min":
         idx = os.getenv("RENDER_INSTANCE_INDEX")
         if idx and idx != "0":
-            print(f"[singleton-env] RENDER_INSTANCE_INDEX={idx} != 0: exiting.")
+            logger.warning("[singleton-env] RENDER_INSTANCE_INDEX=%s != 0: exiting.", idx)
             return
         if not (holder.endswith("0") or holder.endswith("a")):
-            print(f"[singleton-env] Heuristic min holder not matched for {holder}: exiting.")
+            logger.warning("[singleton-env] Heuristic min holder not matched for %s: exiting.", holder)
             return
 
-    con = get_con()
-    try:
+    with get_db_connection() as con:
         cur = con.cursor()
-        now_utc = datetime.now(pytz.utc)
+        now_utc = datetime.now(_UTC)
         stale_threshold_seconds = 180  # treat lock as stale after 3 minutes
 
         cur.execute("SELECT holder, acquired_utc FROM app_lock WHERE id=1")
@@ -4548,21 +4764,19 @@ def main():
             try:
                 lock_time = datetime.fromisoformat(row[1])
                 if lock_time.tzinfo is None:
-                    lock_time = pytz.utc.localize(lock_time)
+                    lock_time = _UTC.localize(lock_time)
                 stale = (now_utc - lock_time).total_seconds() > stale_threshold_seconds
             except Exception:
                 pass  # unparseable timestamp → treat as stale
 
             if stale:
-                print(f"[singleton-sqlite] Stale lock from '{row[0]}' (age>{stale_threshold_seconds}s), taking over.")
+                logger.warning("[singleton-sqlite] Stale lock from %r (age>%ss), taking over.", row[0], stale_threshold_seconds)
                 cur.execute("UPDATE app_lock SET holder=?, acquired_utc=? WHERE id=1",
                             (holder, now_utc.isoformat()))
                 con.commit()
             else:
-                print("[singleton-sqlite] Another instance is already running (holder=", row[0], ") — exiting.")
+                logger.warning("[singleton-sqlite] Another instance is already running (holder=%s) — exiting.", row[0])
                 return
-    finally:
-        con.close()
 
     token = os.getenv("BOT_TOKEN")
     if not token:
@@ -4583,7 +4797,7 @@ def main():
 
     async def health_check(request):
         """Health check endpoint для Render"""
-        return web.Response(text="OK")
+        return web.Response(body=_HEALTH_BODY, content_type="text/plain")
     
     async def google_callback(request):
         """Обработчик Google OAuth callback"""
@@ -4595,25 +4809,14 @@ def main():
             state = request.query.get('state')  # Это chat_id
             
             if not code or not state:
-                return web.Response(
-                    text="Error: Missing code or state parameter",
-                    status=400
-                )
+                return web.Response(body=_OAUTH_ERR_MISSING, content_type="text/plain", status=400)
             
-            try:
-                chat_id = int(state)
-            except (ValueError, TypeError):
-                return web.Response(
-                    text="Error: Invalid state parameter",
-                    status=400
-                )
-            # Формируем redirect_uri: сначала пробуем REDIRECT_URI, иначе BASE_URL/google/callback
-            redirect_uri = os.getenv("REDIRECT_URI")
-            if not redirect_uri:
-                redirect_uri = f"{base_url}/google/callback"
+            if not state.lstrip('-').isdigit():
+                return web.Response(body=_OAUTH_ERR_STATE, content_type="text/plain", status=400)
+            chat_id = int(state)
             
             # Обмениваем код на токены
-            tokens = exchange_code_for_tokens(code, redirect_uri)
+            tokens = exchange_code_for_tokens(code, _oauth_redirect_uri())
             
             if tokens:
                 # Сохраняем токены в БД
@@ -4629,63 +4832,19 @@ def main():
                         reply_markup=build_main_menu()
                     )
                     track_event(chat_id, "google_auth_success")
-                except Exception as e:
-                    print(f"[Bot] Ошибка при отправке сообщения пользователю {chat_id}: {e}")
+                except Exception:
+                    logger.exception("Ошибка при отправке сообщения пользователю %s", chat_id)
                 
                 # Возвращаем HTML страницу
-                html_response = """
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Authorization Successful</title>
-                    <meta charset="UTF-8">
-                    <style>
-                        body {
-                            font-family: Arial, sans-serif;
-                            display: flex;
-                            justify-content: center;
-                            align-items: center;
-                            height: 100vh;
-                            margin: 0;
-                            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                        }
-                        .container {
-                            background: white;
-                            padding: 40px;
-                            border-radius: 10px;
-                            box-shadow: 0 10px 25px rgba(0,0,0,0.2);
-                            text-align: center;
-                        }
-                        h1 {
-                            color: #4CAF50;
-                            margin-bottom: 20px;
-                        }
-                        p {
-                            color: #666;
-                            font-size: 16px;
-                        }
-                    </style>
-                </head>
-                <body>
-                    <div class="container">
-                        <h1>✅ Authorization Successful!</h1>
-                        <p>You can close this window and return to the bot.</p>
-                    </div>
-                </body>
-                </html>
-                """
-                return web.Response(text=html_response, content_type='text/html')
+                return web.Response(body=_OAUTH_OK_HTML, content_type='text/html', charset='utf-8')
             else:
                 if chat_id:
                     track_event(chat_id, "google_auth_failed")
-                return web.Response(
-                    text="Error: Failed to exchange authorization code for tokens",
-                    status=500
-                )
+                return web.Response(body=_OAUTH_ERR_TOKEN_EXCHANGE, content_type="text/plain", status=500)
         except Exception as e:
-            print(f"[Bot] Ошибка при обработке Google callback: {e}")
+            logger.exception("Ошибка при обработке Google callback")
             # Используем chat_id если он был определен, иначе 0
-            error_chat_id = chat_id if chat_id else (int(state) if state and state.isdigit() else 0)
+            error_chat_id = chat_id or 0
             track_event(error_chat_id, "error", {
                 "error_type": "oauth_callback_processing",
                 "error_message": str(e)[:100]
@@ -4695,24 +4854,59 @@ def main():
                 status=500
             )
     
+    # Webhook-режим: Telegram сам присылает апдейты на наш HTTP сервер
+    # (без long polling getUpdates и без ретраев на Conflict)
+    webhook_url = os.getenv("TELEGRAM_WEBHOOK_URL")
+    webhook_path = None
+    if webhook_url:
+        # Маршрут и URL для set_webhook должны совпадать: если в URL нет пути,
+        # дописываем дефолтный и туда же вешаем хендлер
+        parsed_webhook_url = urlparse(webhook_url)
+        webhook_path = parsed_webhook_url.path.rstrip("/") or "/telegram/webhook"
+        webhook_url = urlunparse(parsed_webhook_url._replace(path=webhook_path))
+    # Без секрета любой мог бы слать поддельные апдейты — генерируем его при старте
+    webhook_secret = os.getenv("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+    async def telegram_webhook(request):
+        """Принимает апдейт от Telegram и кладёт его в очередь PTB"""
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != webhook_secret:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await app.update_queue.put(Update.de_json(data, app.bot))
+        return web.Response()
+
     # Создаем aiohttp приложение
     http_app = web.Application()
     http_app.router.add_get("/", health_check)
     http_app.router.add_get("/health", health_check)
     http_app.router.add_get("/google/callback", google_callback)
+    if webhook_path:
+        http_app.router.add_post(webhook_path, telegram_webhook)
     
     # Запускаем HTTP сервер в фоне
+    http_runner = web.AppRunner(http_app)
+
     async def start_http_server():
         """Запускает HTTP сервер на указанном порту"""
-        runner = web.AppRunner(http_app)
-        await runner.setup()
-        site = web.TCPSite(runner, "0.0.0.0", port)
+        await http_runner.setup()
+        site = web.TCPSite(http_runner, "0.0.0.0", port)
         await site.start()
-        print(f"[HTTP Server] Started on port {port}")
-        print(f"[HTTP Server] Callback URL: {base_url}/google/callback")
+        logger.info("HTTP server started on port %s", port)
+        logger.info("Google OAuth callback URL: %s/google/callback", base_url)
     
     async def _post_init(app_instance):
-        await app_instance.bot.delete_webhook(drop_pending_updates=True)
+        if webhook_url:
+            await app_instance.bot.set_webhook(
+                url=webhook_url,
+                allowed_updates=_ALLOWED_UPDATES,
+                drop_pending_updates=True,
+                secret_token=webhook_secret,
+            )
+        else:
+            await app_instance.bot.delete_webhook(drop_pending_updates=True)
         await set_commands(app_instance)
         # Запускаем scheduler после инициализации бота
         start_scheduler(app_instance.bot)
@@ -4733,18 +4927,54 @@ def main():
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
     app.add_handler(CallbackQueryHandler(handle_callback_query))
 
+    if webhook_url:
+        logger.info("Webhook mode: %s", webhook_url)
+        asyncio.run(_run_webhook(app, _post_init, http_runner))
+        return
+
     while True:
         try:
-            app.run_polling(close_loop=False)
+            # Long polling: Telegram держит getUpdates открытым до 30 с, пока не придёт апдейт,
+            # вместо пустого ответа раз в 10 с (дефолт PTB)
+            app.run_polling(
+                close_loop=False,
+                timeout=_POLLING_TIMEOUT,
+                allowed_updates=_ALLOWED_UPDATES,
+            )
             break
         except Conflict as e:
-            print(
+            logger.warning(
                 "[polling] Conflict detected (another getUpdates request is active). "
-                "Retrying in 5 seconds...",
-                str(e),
+                "Retrying in 5 seconds... %s",
+                e,
             )
             time_module.sleep(5)
 
 
+async def _run_webhook(app: Application, post_init, http_runner: web.AppRunner):
+    """
+    Запуск в webhook-режиме: апдейты приходят через aiohttp-маршрут в app.update_queue,
+    PTB только обрабатывает очередь. Работает до SIGINT/SIGTERM,
+    после чего останавливает PTB и HTTP сервер.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows
+
+    async with app:
+        # post_init вызывают только run_polling/run_webhook — здесь вызываем сами
+        await post_init(app)
+        await app.start()
+        try:
+            await stop_event.wait()
+        finally:
+            await app.stop()
+            await http_runner.cleanup()
+
+
 if __name__ == "__main__":
     main()
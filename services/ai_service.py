@@ -5,7 +5,7 @@ import os
 import re
 import json
 import base64
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 from datetime import datetime, timedelta
 import pytz
 
@@ -15,6 +15,10 @@ load_dotenv()
 from openai import AsyncOpenAI
 from openai import AuthenticationError, APIError
 
+from services.time_utils import get_tz
+
+_NON_WORD_RE = re.compile(r"\W+")
+
 
 # Инициализация клиента OpenAI
 _openai_key = os.getenv("OPENAI_API_KEY")
@@ -33,12 +37,13 @@ elif _is_valid_key:
     print(f"[AI Service] OPENAI_API_KEY успешно загружен (длина: {len(_openai_key_clean)} символов, начинается с '{_openai_key_clean[:10]}...')")
 
 
-async def transcribe_voice(file_path: str) -> Optional[str]:
+async def transcribe_voice(audio: Union[str, bytes], filename: str = "voice.ogg") -> Optional[str]:
     """
     Транскрибирует голосовое сообщение через Whisper API.
     
     Args:
-        file_path: Путь к аудио файлу
+        audio: Путь к аудио файлу или содержимое файла в памяти
+        filename: Имя файла для API (по расширению определяется формат), если audio — bytes
     
     Returns:
         Транскрибированный текст или None
@@ -47,20 +52,24 @@ async def transcribe_voice(file_path: str) -> Optional[str]:
         print("[AI Service] OPENAI_API_KEY не установлен")
         return None
     try:
-        with open(file_path, "rb") as audio_file:
-            # Используем whisper-1 с улучшенными параметрами для лучшего распознавания
-            # language=None позволяет автоматически определить язык
-            # prompt помогает модели лучше распознавать время и числа
-            transcript = await client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language=None,  # Автоопределение языка
-                prompt="This is a task or event description. Numbers, times, and dates are important. Please transcribe them accurately, including times like 3 PM, 15:00, three o'clock, etc.",
-                response_format="text",
-                temperature=0.0  # Более детерминированный результат для лучшего распознавания чисел
-            )
-            # Если response_format="text", transcript уже строка
-            return transcript if isinstance(transcript, str) else transcript.text
+        if isinstance(audio, (bytes, bytearray)):
+            audio_file = (filename, bytes(audio))
+        else:
+            with open(audio, "rb") as f:
+                audio_file = (os.path.basename(audio), f.read())
+        # Используем whisper-1 с улучшенными параметрами для лучшего распознавания
+        # language=None позволяет автоматически определить язык
+        # prompt помогает модели лучше распознавать время и числа
+        transcript = await client.audio.transcriptions.create(
+            model="whisper-1",
+            file=audio_file,
+            language=None,  # Автоопределение языка
+            prompt="This is a task or event description. Numbers, times, and dates are important. Please transcribe them accurately, including times like 3 PM, 15:00, three o'clock, etc.",
+            response_format="text",
+            temperature=0.0  # Более детерминированный результат для лучшего распознавания чисел
+        )
+        # Если response_format="text", transcript уже строка
+        return transcript if isinstance(transcript, str) else transcript.text
     except AuthenticationError as e:
         print(f"[AI Service] Ошибка аутентификации OpenAI (Invalid API key): {e}")
         return None
@@ -72,13 +81,24 @@ async def transcribe_voice(file_path: str) -> Optional[str]:
         return None
 
 
-async def extract_events_from_image(image_path: str, user_timezone: str = "UTC") -> Optional[Dict[str, str]]:
+_IMAGE_MIME_BY_EXT = {
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+}
+
+
+async def extract_events_from_image(image: Union[str, bytes], user_timezone: str = "UTC",
+                                    mime_type: Optional[str] = None) -> Optional[Dict[str, str]]:
     """
     Извлекает события из изображения через GPT-4 Vision.
     
     Args:
-        image_path: Путь к изображению
+        image: Путь к изображению или его содержимое в памяти
         user_timezone: Часовой пояс пользователя
+        mime_type: MIME-тип изображения (если не указан — по расширению, иначе JPEG)
     
     Returns:
         Словарь с событиями или None
@@ -88,32 +108,27 @@ async def extract_events_from_image(image_path: str, user_timezone: str = "UTC")
         return None
     try:
         # Читаем изображение и кодируем в base64
-        import os as _os
-        if not _os.path.exists(image_path):
-            print(f"[AI Service] Image file not found: {image_path}")
-            return None
-        file_size = _os.path.getsize(image_path)
-        if file_size == 0:
-            print(f"[AI Service] Image file is empty: {image_path}")
+        if isinstance(image, (bytes, bytearray)):
+            image_bytes = bytes(image)
+            label = "<memory>"
+        else:
+            if not os.path.exists(image):
+                print(f"[AI Service] Image file not found: {image}")
+                return None
+            with open(image, "rb") as image_file:
+                image_bytes = image_file.read()
+            label = image
+            if not mime_type:
+                mime_type = _IMAGE_MIME_BY_EXT.get(os.path.splitext(image)[1].lower())
+        if not image_bytes:
+            print(f"[AI Service] Image file is empty: {label}")
             return None
-        print(f"[AI Service] Processing image: {image_path} ({file_size} bytes)")
+        print(f"[AI Service] Processing image: {label} ({len(image_bytes)} bytes)")
 
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
         
-        # Определяем формат изображения
-        path_lower = image_path.lower()
-        if path_lower.endswith('.png'):
-            image_format = "image/png"
-        elif path_lower.endswith('.gif'):
-            image_format = "image/gif"
-        elif path_lower.endswith('.webp'):
-            image_format = "image/webp"
-        elif path_lower.endswith(('.jpg', '.jpeg')):
-            image_format = "image/jpeg"
-        else:
-            # По умолчанию предполагаем JPEG для неизвестных расширений
-            image_format = "image/jpeg"
+        # По умолчанию предполагаем JPEG для неизвестных форматов
+        image_format = mime_type or "image/jpeg"
         
         response = await client.chat.completions.create(
             model="gpt-4o",
@@ -327,9 +342,9 @@ async def parse_with_ai(text: str, user_timezone: str = "UTC", source_language:
         return None
     
     # Определяем текущее время в часовом поясе пользователя
-    tz = pytz.timezone(user_timezone)
+    tz = get_tz(user_timezone)
     now_local = datetime.now(tz)
-    now_utc = datetime.now(pytz.utc)
+    now_utc = now_local.astimezone(pytz.utc)  # тот же момент, без второго datetime.now
     current_date = now_local.strftime('%Y-%m-%d')
     current_time = now_local.strftime('%H:%M:%S')
     utc_offset = now_local.strftime('%z')  # e.g. +0300
@@ -566,7 +581,7 @@ Return JSON with task information."""
             # GPT models often return +00:00 (UTC) instead of the user's local offset,
             # but the date/time values themselves are correct in local terms.
             # Store in local timezone (with offset) so format_event_preview can display correctly.
-            tz_obj = pytz.timezone(user_timezone)
+            tz_obj = get_tz(user_timezone)
             start_dt = tz_obj.localize(start_dt.replace(tzinfo=None))
             end_dt = tz_obj.localize(end_dt.replace(tzinfo=None))
 
@@ -582,7 +597,7 @@ Return JSON with task information."""
                 "saturday": 5, "sat": 5, "суббота": 5, "субботу": 5, "сб": 5,
                 "sunday": 6, "sun": 6, "воскресенье": 6, "вс": 6,
             }
-            user_words = re.split(r'\W+', text.lower())
+            user_words = _NON_WORD_RE.split(text.lower())
             mentioned_weekday = None
             for kw, wd in day_to_weekday.items():
                 if kw in user_words:
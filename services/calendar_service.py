@@ -3,19 +3,25 @@ Google Calendar Service для создания событий через OAuth2
 """
 import os
 import json
-from typing import Optional, Dict, Tuple
-from datetime import datetime
+import time
+import threading
+import traceback
+from typing import Optional, Dict, List, Tuple
+from datetime import datetime, timedelta
 import pytz
 import urllib.parse
 import requests
+import httplib2
 import logging
 
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from services.db_service import save_google_tokens, delete_google_tokens
+from services.time_utils import parse_iso_aware
 
 # Setup logging - will inherit parent logger configuration if available
 logger = logging.getLogger(__name__)
@@ -25,6 +31,50 @@ logger = logging.getLogger(__name__)
 SCOPES = ['https://www.googleapis.com/auth/calendar.events']
 # REDIRECT_URI теперь формируется динамически на основе базового URL сервера
 
+# Кэш собранных Calendar-сервисов: build() парсит discovery-документ и
+# генерирует классы ресурсов, поэтому переиспользуем сервис для одного токена.
+# httplib2 внутри сервиса не потокобезопасен, поэтому кэш свой у каждого потока
+# (threading.local, как соединения в db_service): token -> (service, истечение по monotonic).
+# Access token живёт ~1 час, после refresh ключ меняется, старые записи вытесняются по TTL.
+_service_local = threading.local()
+_SERVICE_CACHE_MAX = 64  # на поток
+_SERVICE_CACHE_TTL = 3600
+_HTTP_TIMEOUT = 15
+
+
+def _build_calendar_service(credentials: Credentials):
+    """Собирает сервис с таймаутом на HTTP (по умолчанию httplib2 ждёт бесконечно)"""
+    http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=_HTTP_TIMEOUT))
+    return build('calendar', 'v3', http=http, cache_discovery=False)
+
+
+def get_calendar_service(credentials: Credentials):
+    """
+    Возвращает Calendar API сервис для credentials, переиспользуя уже собранный.
+    Кэш у каждого потока свой и ключуется access token: после refresh токен меняется
+    и сервис пересобирается, а разные потоки не делят один httplib2-клиент.
+    Возвращённый сервис использовать только в том потоке, где он получен
+    (в to_thread-функции вызывать get_calendar_service внутри неё самой).
+    """
+    token = getattr(credentials, "token", None)
+    if not token:
+        return _build_calendar_service(credentials)
+    cache = getattr(_service_local, "cache", None)
+    if cache is None:
+        cache = _service_local.cache = {}
+    now = time.monotonic()
+    cached = cache.get(token)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    service = _build_calendar_service(credentials)
+    if len(cache) >= _SERVICE_CACHE_MAX:
+        for stale_token in [t for t, (_, exp) in cache.items() if exp <= now]:
+            del cache[stale_token]
+        if len(cache) >= _SERVICE_CACHE_MAX:
+            cache.pop(next(iter(cache)))
+    cache[token] = (service, now + _SERVICE_CACHE_TTL)
+    return service
+
 
 def get_authorization_url(user_id: int, redirect_uri: str) -> str:
     """
@@ -139,7 +189,6 @@ def exchange_code_for_tokens(auth_code: str, redirect_uri: str) -> Optional[Dict
     except Exception as e:
         logger.error(f"🚨 Ошибка при обмене кода на токены: {type(e).__name__}: {e}")
         logger.error(f"redirect_uri used: {effective_redirect_uri}")
-        import traceback
         traceback.print_exc()
         return None
 
@@ -227,11 +276,42 @@ def get_credentials_from_stored(user_id: int, stored_tokens: Dict) -> Optional[C
         raise
     except Exception as e:
         print(f"[Calendar Service] Ошибка при создании credentials для user_id={user_id}: {e}")
-        import traceback
         traceback.print_exc()
         return None
 
 
+def _build_event_body(event_data: Dict[str, str], normalize: bool = True) -> Dict:
+    """
+    Формирует тело события Google Calendar из словаря event_data.
+    normalize=False — строки времени уже получены из datetime.isoformat()
+    и передаются как есть, без повторного парсинга и форматирования.
+    """
+    start_time = event_data["start_time"]
+    end_time = event_data["end_time"]
+    if normalize:
+        start_time = datetime.fromisoformat(start_time.replace("Z", "+00:00")).isoformat()
+        end_time = datetime.fromisoformat(end_time.replace("Z", "+00:00")).isoformat()
+
+    event = {
+        'summary': event_data.get("summary", "Задача"),
+        'description': event_data.get("description", ""),
+        'start': {
+            'dateTime': start_time,
+            'timeZone': 'UTC',
+        },
+        'end': {
+            'dateTime': end_time,
+            'timeZone': 'UTC',
+        },
+    }
+
+    # Добавляем location, если указан
+    location = event_data.get("location", "")
+    if location:
+        event['location'] = location
+    return event
+
+
 def create_event(credentials: Credentials, event_data: Dict[str, str]) -> Optional[str]:
     """
     Создает событие в Google Calendar.
@@ -248,30 +328,10 @@ def create_event(credentials: Credentials, event_data: Dict[str, str]) -> Option
         URL созданного события или None в случае ошибки
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        
-        # Парсим время
-        start_dt = datetime.fromisoformat(event_data["start_time"].replace("Z", "+00:00"))
-        end_dt = datetime.fromisoformat(event_data["end_time"].replace("Z", "+00:00"))
+        service = get_calendar_service(credentials)
         
         # Формируем событие для Google Calendar API
-        event = {
-            'summary': event_data.get("summary", "Задача"),
-            'description': event_data.get("description", ""),
-            'start': {
-                'dateTime': start_dt.isoformat(),
-                'timeZone': 'UTC',
-            },
-            'end': {
-                'dateTime': end_dt.isoformat(),
-                'timeZone': 'UTC',
-            },
-        }
-        
-        # Добавляем location, если указан
-        location = event_data.get("location", "")
-        if location:
-            event['location'] = location
+        event = _build_event_body(event_data)
         
         # Создаем событие
         created_event = service.events().insert(calendarId='primary', body=event).execute()
@@ -287,6 +347,102 @@ def create_event(credentials: Credentials, event_data: Dict[str, str]) -> Option
         return None
 
 
+# Google Calendar принимает не более 50 запросов в одном batch
+BATCH_MAX_REQUESTS = 50
+
+
+def create_events_batch(credentials: Credentials, events_data: List[Dict[str, str]]) -> int:
+    """
+    Создает несколько событий через batch-запросы (до 50 вставок за один HTTP round-trip).
+    
+    Args:
+        credentials: Объект Credentials для доступа к API
+        events_data: Список словарей в формате create_event(); start_time/end_time
+            должны быть результатом datetime.isoformat() (повторно не парсятся)
+    
+    Returns:
+        Количество успешно созданных событий
+    """
+    created = 0
+
+    def _on_response(request_id, response, exception):
+        nonlocal created
+        if exception is not None:
+            logger.warning("Error creating event in batch (%s): %s", request_id, exception)
+        elif response:
+            created += 1
+
+    try:
+        # Отдельный сервис: функция вызывается из рабочего потока, а httplib2 не потокобезопасен
+        service = get_calendar_service(credentials)
+        for i in range(0, len(events_data), BATCH_MAX_REQUESTS):
+            batch = service.new_batch_http_request(callback=_on_response)
+            for event_data in events_data[i:i + BATCH_MAX_REQUESTS]:
+                try:
+                    body = _build_event_body(event_data, normalize=False)
+                except (KeyError, ValueError) as e:
+                    logger.warning("Skipping malformed event %r: %s", event_data.get('summary'), e)
+                    continue
+                batch.add(service.events().insert(calendarId='primary', body=body))
+            batch.execute()
+    except HttpError as e:
+        logger.warning("HTTP error during batch event creation: %s", e)
+    except Exception:
+        logger.exception("Error during batch event creation")
+    return created
+
+
+def _move_body(new_start_time: datetime, new_end_time: datetime) -> Dict:
+    """
+    Тело patch для переноса события. PATCH сливает вложенные объекты, поэтому у события
+    на весь день осталось бы поле date рядом с новым dateTime (Google отвечает 400) —
+    явно обнуляем date.
+    """
+    return {
+        'start': {'dateTime': new_start_time.isoformat(), 'timeZone': 'UTC', 'date': None},
+        'end': {'dateTime': new_end_time.isoformat(), 'timeZone': 'UTC', 'date': None},
+    }
+
+
+def reschedule_events_batch(credentials: Credentials, moves: List[Tuple[str, datetime, datetime]]) -> int:
+    """
+    Переносит несколько событий через batch-запросы patch (до 50 за один HTTP round-trip).
+    
+    Args:
+        credentials: Объект Credentials для доступа к API
+        moves: Список (event_id, новое начало, новый конец); datetime с timezone
+    
+    Returns:
+        Количество успешно перенесенных событий
+    """
+    moved = 0
+
+    def _on_response(request_id, response, exception):
+        nonlocal moved
+        if exception is not None:
+            logger.warning("Error moving event in batch (%s): %s", request_id, exception)
+        elif response:
+            moved += 1
+
+    try:
+        # Отдельный сервис: функция может вызываться из рабочего потока
+        service = get_calendar_service(credentials)
+        for i in range(0, len(moves), BATCH_MAX_REQUESTS):
+            batch = service.new_batch_http_request(callback=_on_response)
+            for event_id, new_start_time, new_end_time in moves[i:i + BATCH_MAX_REQUESTS]:
+                body = _move_body(new_start_time, new_end_time)
+                batch.add(
+                    service.events().patch(calendarId='primary', eventId=event_id, body=body, fields='id'),
+                    request_id=event_id,
+                )
+            batch.execute()
+    except HttpError as e:
+        logger.warning("HTTP error during batch reschedule: %s", e)
+    except Exception:
+        logger.exception("Error during batch reschedule")
+    return moved
+
+
 def mark_event_done(credentials: Credentials, event_id: str, event_title: str) -> bool:
     """
     Отмечает событие как выполненное, добавляя эмодзи "✅ " в начало заголовка.
@@ -300,10 +456,10 @@ def mark_event_done(credentials: Credentials, event_id: str, event_title: str) -
         True если успешно, False в случае ошибки
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
+        service = get_calendar_service(credentials)
         
-        # Получаем текущее событие
-        event = service.events().get(calendarId='primary', eventId=event_id).execute()
+        # Получаем только текущий заголовок события
+        event = service.events().get(calendarId='primary', eventId=event_id, fields='summary').execute()
         
         # Получаем текущий summary из API (актуальное значение)
         current_summary = event.get('summary', event_title)
@@ -320,12 +476,11 @@ def mark_event_done(credentials: Credentials, event_id: str, event_title: str) -
             clean_summary = clean_summary[2:]
         new_summary = f"✅ {clean_summary}"
         
-        # Обновляем событие
-        event['summary'] = new_summary
-        updated_event = service.events().update(
+        # Обновляем только заголовок: patch вместо update с полным телом события
+        service.events().patch(
             calendarId='primary',
             eventId=event_id,
-            body=event
+            body={'summary': new_summary}
         ).execute()
         
         return True
@@ -363,7 +518,7 @@ def check_availability(credentials: Credentials, start_dt: datetime, end_dt: dat
     Returns True if the slot is free, False if busy.
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
+        service = get_calendar_service(credentials)
 
         # Ensure both datetimes are timezone-aware
         if start_dt.tzinfo is None:
@@ -419,8 +574,6 @@ def find_next_free_slot(credentials: Credentials, start_dt: datetime, duration_m
         Первый найденный свободный datetime или None, если ничего не найдено
     """
     try:
-        from datetime import timedelta
-
         if start_dt.tzinfo is None:
             start_dt = pytz.utc.localize(start_dt)
 
@@ -429,7 +582,7 @@ def find_next_free_slot(credentials: Credentials, start_dt: datetime, duration_m
         time_min = start_dt.astimezone(pytz.utc).isoformat()
         time_max = end_search_dt.astimezone(pytz.utc).isoformat()
 
-        service = build('calendar', 'v3', credentials=credentials)
+        service = get_calendar_service(credentials)
 
         # Fetch all events in the search window
         events_result = service.events().list(
@@ -473,14 +626,8 @@ def find_next_free_slot(credentials: Credentials, start_dt: datetime, duration_m
                     day_end = day_start + timedelta(days=1)
                 busy_periods.append((day_start, day_end))
                 continue
-            ev_start = datetime.fromisoformat(ev_start_str.replace('Z', '+00:00'))
-            ev_end = datetime.fromisoformat(ev_end_str.replace('Z', '+00:00'))
-            if ev_start.tzinfo is None:
-                ev_start = pytz.utc.localize(ev_start)
-            if ev_end.tzinfo is None:
-                ev_end = pytz.utc.localize(ev_end)
-            ev_start = ev_start.astimezone(tz)
-            ev_end = ev_end.astimezone(tz)
+            ev_start = parse_iso_aware(ev_start_str).astimezone(tz)
+            ev_end = parse_iso_aware(ev_end_str).astimezone(tz)
             busy_periods.append((ev_start, ev_end))
         
         # Сортируем занятые периоды по времени начала
@@ -539,26 +686,15 @@ def reschedule_event(credentials: Credentials, event_id: str, new_start_time: da
         True если успешно, False в случае ошибки
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        
-        # Получаем текущее событие
-        event = service.events().get(calendarId='primary', eventId=event_id).execute()
-        
-        # Обновляем время
-        event['start'] = {
-            'dateTime': new_start_time.isoformat(),
-            'timeZone': 'UTC',
-        }
-        event['end'] = {
-            'dateTime': new_end_time.isoformat(),
-            'timeZone': 'UTC',
-        }
+        service = get_calendar_service(credentials)
         
-        # Обновляем событие
-        updated_event = service.events().update(
+        # Меняем только время: patch без предварительного events().get —
+        # вызывающий код обычно уже прочитал событие сам
+        service.events().patch(
             calendarId='primary',
             eventId=event_id,
-            body=event
+            body=_move_body(new_start_time, new_end_time),
+            fields='id'
         ).execute()
         
         return True
@@ -583,7 +719,7 @@ def cancel_event(credentials: Credentials, event_id: str) -> bool:
         True если успешно, False в случае ошибки
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
+        service = get_calendar_service(credentials)
         service.events().delete(calendarId='primary', eventId=event_id).execute()
         return True
         
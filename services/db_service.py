@@ -3,6 +3,8 @@ Database Service для работы с БД
 """
 import os
 import sqlite3
+import threading
+import time
 import json
 from typing import Optional, Dict
 from datetime import datetime, timezone
@@ -11,22 +13,62 @@ from contextlib import contextmanager
 DB_PATH = os.getenv("DB_PATH", "tasks.db")
 
 
-def get_con():
-    return sqlite3.connect(DB_PATH, timeout=10.0)
+# Одно соединение на поток на всё время жизни процесса: без connect/close
+# (и повторного чтения схемы) на каждый запрос. sqlite3.Connection нельзя
+# делить между потоками, поэтому threading.local, а не общий объект с локом.
+_thread_local = threading.local()
+
+
+def _thread_connection() -> sqlite3.Connection:
+    con = getattr(_thread_local, "con", None)
+    if con is None:
+        con = sqlite3.connect(DB_PATH, timeout=10.0)
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA cache_size=-8000")
+        # Чтения из page cache ОС без копирования в буфер SQLite; journal_mode=WAL
+        # хранится в самом файле БД и включается один раз в init_db
+        con.execute("PRAGMA mmap_size=268435456")
+        _thread_local.con = con
+    return con
 
 
 @contextmanager
 def get_db_connection():
-    """Safe context manager for database connections - ensures close even on error"""
-    con = sqlite3.connect(DB_PATH, timeout=10.0)
+    """
+    Соединение текущего потока. Незакоммиченные изменения при выходе откатываются
+    (как раньше при close), чтобы не держать блокировку записи между вызовами.
+    """
+    con = _thread_connection()
     try:
         yield con
     finally:
-        con.close()
+        if con.in_transaction:
+            con.rollback()
+
+
+# Токены читаются почти в каждом хендлере и меняются только через save/delete ниже —
+# кэшируем результат (в т.ч. "токенов нет"): user_id -> (tokens или None, истечение по monotonic).
+# Возвращаемый dict общий для всех вызовов — не изменять.
+_TOKENS_CACHE: Dict[int, tuple] = {}
+_TOKENS_CACHE_TTL = 300
+_TOKENS_CACHE_MAX = 10000
 
 
 def get_google_tokens(user_id: int) -> Optional[Dict]:
     """Получает сохраненные Google OAuth токены для пользователя"""
+    now = time.monotonic()
+    cached = _TOKENS_CACHE.get(user_id)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    tokens = _load_google_tokens(user_id)
+    if len(_TOKENS_CACHE) >= _TOKENS_CACHE_MAX:
+        _TOKENS_CACHE.clear()
+    _TOKENS_CACHE[user_id] = (tokens, now + _TOKENS_CACHE_TTL)
+    return tokens
+
+
+def _load_google_tokens(user_id: int) -> Optional[Dict]:
     with get_db_connection() as con:
         cur = con.cursor()
         cur.execute(
@@ -55,6 +97,7 @@ def delete_google_tokens(user_id: int) -> None:
         cur = con.cursor()
         cur.execute("DELETE FROM google_oauth_tokens WHERE user_id=?", (user_id,))
         con.commit()
+    _TOKENS_CACHE.pop(user_id, None)
     print(f"[DB Service] Токены удалены для user_id={user_id}")
 
 
@@ -88,6 +131,7 @@ def save_google_tokens(user_id: int, tokens: Dict) -> None:
             ),
         )
         con.commit()
+    _TOKENS_CACHE.pop(user_id, None)
     print(f"[DB Service] Токены сохранены для user_id={user_id}, refresh_token={'есть' if tokens.get('refresh_token') else 'отсутствует'}, client_secret={'есть' if tokens.get('client_secret') else 'отсутствует'}, client_id={'есть' if tokens.get('client_id') else 'отсутствует'}")
 
 
@@ -11,15 +11,33 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from services.ai_service import generate_morning_briefing_intro
-from services.calendar_service import get_credentials_from_stored
-from services.db_service import get_google_tokens, get_user_timezone, get_morning_time, get_evening_time
-from googleapiclient.discovery import build
+from services.calendar_service import get_credentials_from_stored, get_calendar_service
+from services.db_service import get_db_connection, get_google_tokens, get_user_timezone, get_morning_time, get_evening_time
+from services.short_ids import mint_short_ids
+from services.time_utils import get_tz
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 
 scheduler = AsyncIOScheduler()
 
 
+def _format_event(event: Dict) -> Dict:
+    """
+    Приводит событие Google к формату бота. Список запрашивается с timeZone
+    пользователя, поэтому dateTime уже в его таймзоне и 'HH:MM' начала берётся
+    срезом строки — без fromisoformat/astimezone при каждой отрисовке.
+    """
+    start = event['start'].get('dateTime', event['start'].get('date'))
+    return {
+        'id': event.get('id', ''),
+        'summary': event.get('summary', 'No title'),
+        'start_time': start,
+        'end_time': event['end'].get('dateTime', event['end'].get('date')),
+        'description': event.get('description', ''),
+        'start_hm': start[11:16] if 'T' in start else '',
+    }
+
+
 def get_today_events(credentials, user_timezone: str) -> List[Dict]:
     """
     Получает события на сегодня из Google Calendar.
@@ -32,8 +50,8 @@ def get_today_events(credentials, user_timezone: str) -> List[Dict]:
         Список событий
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        tz = pytz.timezone(user_timezone)
+        service = get_calendar_service(credentials)
+        tz = get_tz(user_timezone)
         now_local = datetime.now(tz)
         
         # Начало и конец дня в локальном времени
@@ -50,27 +68,14 @@ def get_today_events(credentials, user_timezone: str) -> List[Dict]:
             timeMax=end_utc,
             maxResults=50,
             singleEvents=True,
-            orderBy='startTime'
+            orderBy='startTime',
+            timeZone=user_timezone
         ).execute()
         
         events = events_result.get('items', [])
         
         # Форматируем события
-        formatted_events = []
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            summary = event.get('summary', 'No title')
-            description = event.get('description', '')
-            event_id = event.get('id', '')
-            
-            formatted_events.append({
-                'id': event_id,
-                'summary': summary,
-                'start_time': start,
-                'description': description
-            })
-        
-        return formatted_events
+        return [_format_event(event) for event in events]
     except Exception as e:
         print(f"[Scheduler Service] Ошибка при получении событий: {e}")
         return []
@@ -89,8 +94,8 @@ def get_events_for_date(credentials, user_timezone: str, target_date) -> List[Di
         Список событий
     """
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        tz = pytz.timezone(user_timezone)
+        service = get_calendar_service(credentials)
+        tz = get_tz(user_timezone)
 
         if hasattr(target_date, 'date'):
             local_date = target_date.date()
@@ -109,25 +114,13 @@ def get_events_for_date(credentials, user_timezone: str, target_date) -> List[Di
             timeMax=end_utc,
             maxResults=50,
             singleEvents=True,
-            orderBy='startTime'
+            orderBy='startTime',
+            timeZone=user_timezone
         ).execute()
 
         events = events_result.get('items', [])
 
-        formatted_events = []
-        for event in events:
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            summary = event.get('summary', 'No title')
-            description = event.get('description', '')
-            event_id = event.get('id', '')
-            formatted_events.append({
-                'id': event_id,
-                'summary': summary,
-                'start_time': start,
-                'description': description
-            })
-
-        return formatted_events
+        return [_format_event(event) for event in events]
     except Exception as e:
         print(f"[Scheduler Service] Ошибка при получении событий на дату: {e}")
         return []
@@ -187,7 +180,6 @@ async def send_morning_briefing(bot, chat_id: int, user_timezone: str):
         intro = await generate_morning_briefing_intro()
         
         # Форматируем список задач (Time - Title)
-        tz = pytz.timezone(user_timezone)
         tasks_list = []
         for event in events:
             summary = event.get('summary', 'Task')
@@ -196,18 +188,7 @@ async def send_morning_briefing(bot, chat_id: int, user_timezone: str):
             if summary.startswith('✅ '):
                 summary = summary[2:]
             
-            start_time = event.get('start_time', '')
-            time_str = ""
-            if start_time:
-                try:
-                    if 'T' in start_time:
-                        dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                        if dt.tzinfo:
-                            dt = dt.astimezone(tz)
-                            time_str = dt.strftime('%H:%M')
-                except Exception:
-                    pass
-            
+            time_str = event['start_hm']
             if time_str:
                 tasks_list.append(f"{time_str} {summary}")
             else:
@@ -281,77 +262,53 @@ async def send_evening_recap(bot, chat_id: int, user_timezone: str):
         events = get_today_events(credentials, user_timezone)
         
         # Разделяем выполненные и невыполненные задачи; скрываем отменённые (❌)
-        completed_events = [e for e in events if e.get('summary', '').startswith('✅ ')]
-        incomplete_events = [
-            e for e in events
-            if not e.get('summary', '').startswith('✅ ')
-            and not e.get('summary', '').startswith('❌ ')
-        ]
+        completed_events = []
+        incomplete_events = []
+        for e in events:
+            mark = e.get('summary', '')[:2]
+            if mark == '✅ ':
+                completed_events.append(e)
+            elif mark != '❌ ':
+                incomplete_events.append(e)
         
-        # Формируем сообщение - только интро
-        message_text = "Hey, hope it was a productive day!\n\n"
+        # Формируем сообщение частями и склеиваем один раз в конце
+        parts = ["Hey, hope it was a productive day!\n\n"]
         
         # Добавляем информацию о выполненных задачах в текст
         if completed_events:
-            tz = pytz.timezone(user_timezone)
-            message_text += "✅ Completed:\n"
+            parts.append("✅ Completed:\n")
             for event in completed_events:
                 summary = event.get('summary', 'Task')
                 # Убираем "✅ " для отображения
                 if summary.startswith('✅ '):
                     summary = summary[2:]
                 
-                start_time = event.get('start_time', '')
-                time_str = ""
-                if start_time:
-                    try:
-                        if 'T' in start_time:
-                            dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                            if dt.tzinfo:
-                                dt = dt.astimezone(tz)
-                                time_str = dt.strftime('%H:%M')
-                    except Exception:
-                        pass
-                
-                if time_str:
-                    message_text += f"  • {time_str} {summary}\n"
-                else:
-                    message_text += f"  • {summary}\n"
-            message_text += "\n"
+                time_str = event['start_hm']
+                parts.append(f"  • {time_str} {summary}\n" if time_str else f"  • {summary}\n")
+            parts.append("\n")
         
         # Добавляем информацию о невыполненных задачах
-        if incomplete_events:
-            message_text += "📋 Tasks left behind:\n"
-        else:
-            message_text += "🎉 No uncompleted tasks! Great job!"
+        parts.append("📋 Tasks left behind:\n" if incomplete_events else "🎉 No uncompleted tasks! Great job!")
+        message_text = "".join(parts)
         
         # Создаем inline-клавиатуру для невыполненных задач (одна строка на задачу)
+        # В callback_data — короткие ссылки, как в списках задач бота: длинные id
+        # экземпляров повторяющихся событий не влезают в 64 байта
         keyboard = []
-        tz = pytz.timezone(user_timezone)
-        for event in incomplete_events:
-            event_id = event.get('id', '')
-            if event_id:
-                summary = event.get('summary', 'Task')
-                start_time = event.get('start_time', '')
-                time_str = ""
-                if start_time:
-                    try:
-                        if 'T' in start_time:
-                            dt = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                            if dt.tzinfo:
-                                dt = dt.astimezone(tz)
-                                time_str = dt.strftime('%H:%M')
-                    except Exception:
-                        pass
-                
-                label_text = f"{time_str} {summary}" if time_str else summary
-                label_text = label_text[:55]
-                keyboard.append([InlineKeyboardButton(label_text, callback_data=f'label_{event_id}')])
-                keyboard.append([
-                    InlineKeyboardButton("✅", callback_data=f"done_{event_id}"),
-                    InlineKeyboardButton("➡️", callback_data=f"resch_{event_id}"),
-                    InlineKeyboardButton("❌", callback_data=f"del_{event_id}"),
-                ])
+        task_events = [event for event in incomplete_events if event.get('id')]
+        refs = mint_short_ids([event['id'] for event in task_events], chat_id) if task_events else {}
+        for event in task_events:
+            ref = refs[event['id']]
+            summary = event.get('summary', 'Task')
+            time_str = event['start_hm']
+            label_text = f"{time_str} {summary}" if time_str else summary
+            label_text = label_text[:55]
+            keyboard.append([InlineKeyboardButton(label_text, callback_data=f'label_{ref}')])
+            keyboard.append([
+                InlineKeyboardButton("✅", callback_data=f"done_{ref}"),
+                InlineKeyboardButton("➡️", callback_data=f"resch_{ref}"),
+                InlineKeyboardButton("❌", callback_data=f"del_{ref}"),
+            ])
         
         reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
         
@@ -427,21 +384,21 @@ async def check_and_send_briefings(bot):
     Запускается каждую минуту через cron job, чтобы поддерживать любые времена
     (например, 09:30, 21:45), а не только :00 минут.
     """
-    from services.db_service import get_con
-    
     try:
-        con = get_con()
-        cur = con.cursor()
-        # Получаем всех пользователей, которые прошли онбординг
-        cur.execute("""
-            SELECT chat_id, tz, morning_time, evening_time 
-            FROM settings 
-            WHERE onboard_done = 1 AND tz IS NOT NULL
-        """)
-        users = cur.fetchall()
-        con.close()
+        with get_db_connection() as con:
+            cur = con.cursor()
+            # Получаем всех пользователей, которые прошли онбординг
+            cur.execute("""
+                SELECT chat_id, tz, morning_time, evening_time 
+                FROM settings 
+                WHERE onboard_done = 1 AND tz IS NOT NULL
+            """)
+            users = cur.fetchall()
         
         now_utc = datetime.now(pytz.utc)
+        # Локальное "HH:MM" считаем один раз на таймзону за тик, а не на пользователя:
+        # таймзон у пользователей намного меньше, чем самих пользователей
+        local_hm_by_tz = {}
         
         for chat_id, tz_str, morning_time, evening_time in users:
             if not tz_str:
@@ -449,9 +406,12 @@ async def check_and_send_briefings(bot):
             
             try:
                 # Получаем локальное время пользователя
-                user_tz = pytz.timezone(tz_str)
-                now_local = now_utc.astimezone(user_tz)
-                current_time_str = now_local.strftime("%H:%M")
+                current_time_str = local_hm_by_tz.get(tz_str)
+                if current_time_str is None:
+                    current_time_str = now_utc.astimezone(get_tz(tz_str)).strftime("%H:%M")
+                    local_hm_by_tz[tz_str] = current_time_str
+                if current_time_str != morning_time and current_time_str != evening_time:
+                    continue
                 
                 # Проверяем, нужно ли отправить утреннюю сводку
                 if morning_time and current_time_str == morning_time:
@@ -0,0 +1,116 @@
+"""
+Короткие ссылки на события Google Calendar для callback_data inline-кнопок
+"""
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Dict, List
+
+from services.db_service import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+# Короткие ссылки на события в callback_data. Telegram ограничивает callback_data
+# 64 байтами, а id событий Google (особенно экземпляров повторяющихся) бывают длинными.
+# В кнопку кладём "~" + 6 символов base62, соответствие хранится в таблице callback_map.
+# "~" не встречается в id событий Google, поэтому кнопки со старым форматом
+# (полный event_id) по-прежнему работают.
+_SHORT_ID_MARK = "~"
+_SHORT_ID_LEN = 6
+_BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+_SHORT_ID_CACHE: Dict[str, tuple] = {}  # short_id -> (event_id, chat_id)
+_SHORT_ID_CACHE_MAX = 10000
+CALLBACK_MAP_TTL_DAYS = 30
+
+
+def short_id_for(event_id: str, chat_id: int) -> str:
+    """Детерминированный short id (хэш chat_id + event_id, 6 символов base62)"""
+    digest = int.from_bytes(
+        hashlib.blake2b(f"{chat_id}:{event_id}".encode(), digest_size=8).digest(), 'big'
+    )
+    chars = []
+    for _ in range(_SHORT_ID_LEN):
+        digest, rem = divmod(digest, 62)
+        chars.append(_BASE62[rem])
+    return "".join(chars)
+
+
+def mint_short_ids(event_ids: List[str], chat_id: int) -> Dict[str, str]:
+    """
+    Возвращает {event_id: ссылка для callback_data} ("~" + short id).
+    Short id детерминирован, поэтому повторная отрисовка того же списка не создаёт
+    новых строк; при коллизии для события возвращается полный event_id.
+    Все новые short id записываются одним executemany и одним commit на список.
+    """
+    refs: Dict[str, str] = {}
+    # event_id -> short_id: два события одного списка с одинаковым short id
+    # не затирают друг друга — второе получит полный event_id как коллизия
+    pending: Dict[str, str] = {}
+    for event_id in event_ids:
+        short_id = short_id_for(event_id, chat_id)
+        if _SHORT_ID_CACHE.get(short_id) == (event_id, chat_id):
+            refs[event_id] = _SHORT_ID_MARK + short_id
+        else:
+            pending[event_id] = short_id
+    if not pending:
+        return refs
+
+    now_iso = datetime.now(timezone.utc).isoformat()
+    with get_db_connection() as con:
+        cur = con.cursor()
+        # Обновляем created_utc только для той же пары (event_id, chat_id);
+        # занятые другим событием short id остаются как есть и ловятся проверкой ниже
+        cur.executemany(
+            """
+            INSERT INTO callback_map (short_id, event_id, chat_id, created_utc)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(short_id) DO UPDATE SET created_utc=excluded.created_utc
+            WHERE callback_map.event_id=excluded.event_id AND callback_map.chat_id=excluded.chat_id
+            """,
+            [(short_id, event_id, chat_id, now_iso) for event_id, short_id in pending.items()],
+        )
+        short_ids = list(set(pending.values()))
+        placeholders = ",".join("?" * len(short_ids))
+        cur.execute(
+            f"SELECT short_id, event_id, chat_id FROM callback_map WHERE short_id IN ({placeholders})",
+            short_ids,
+        )
+        stored = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        con.commit()
+
+    for event_id, short_id in pending.items():
+        if stored.get(short_id) != (event_id, chat_id):
+            logger.warning("callback_map collision for short id %s, using full event_id", short_id)
+            refs[event_id] = event_id
+            continue
+        if len(_SHORT_ID_CACHE) >= _SHORT_ID_CACHE_MAX:
+            _SHORT_ID_CACHE.clear()
+        _SHORT_ID_CACHE[short_id] = (event_id, chat_id)
+        refs[event_id] = _SHORT_ID_MARK + short_id
+    return refs
+
+
+def mint_short_id(event_id: str, chat_id: int) -> str:
+    """Ссылка на одно событие для callback_data (см. mint_short_ids)"""
+    return mint_short_ids([event_id], chat_id)[event_id]
+
+
+def resolve_short_id(ref: str, chat_id: int) -> Optional[str]:
+    """event_id по ссылке из callback_data; None, если ссылка неизвестна или чужая"""
+    if not ref.startswith(_SHORT_ID_MARK):
+        return ref  # старый формат — полный event_id
+    short_id = ref[1:]
+    cached = _SHORT_ID_CACHE.get(short_id)
+    if cached is None:
+        with get_db_connection() as con:
+            cur = con.cursor()
+            cur.execute("SELECT event_id, chat_id FROM callback_map WHERE short_id=?", (short_id,))
+            row = cur.fetchone()
+        if not row:
+            return None
+        cached = (row[0], row[1])
+        if len(_SHORT_ID_CACHE) >= _SHORT_ID_CACHE_MAX:
+            _SHORT_ID_CACHE.clear()
+        _SHORT_ID_CACHE[short_id] = cached
+    return cached[0] if cached[1] == chat_id else None
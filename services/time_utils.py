@@ -0,0 +1,23 @@
+"""
+Общие хелперы для работы со временем: кэш pytz-таймзон и парсинг timestamp'ов Google API
+"""
+from datetime import datetime
+from functools import lru_cache
+import pytz
+from ciso8601 import parse_datetime as _ciso_parse_datetime  # C-парсер ISO 8601, понимает 'Z'
+
+_UTC = pytz.utc
+
+
+@lru_cache(maxsize=512)
+def get_tz(name: str):
+    """Кэширует pytz-таймзоны по имени (pytz.timezone каждый раз делает lookup)"""
+    return pytz.timezone(name)
+
+
+def parse_iso_aware(value: str) -> datetime:
+    """Парсит ISO-строку Google API ('...Z' или со смещением) в aware datetime (naive считаем UTC)"""
+    if not value:
+        raise ValueError("empty ISO datetime string")
+    dt = _ciso_parse_datetime(value)
+    return dt if dt.tzinfo is not None else _UTC.localize(dt)
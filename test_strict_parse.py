@@ -1,56 +1,117 @@
 import unittest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 import pytz
 
-from bot import parse_task_input
-
-class TestStrictDateParse(unittest.TestCase):
-    def test_auto_bump_year_for_past_dates(self):
-        now_utc = datetime.now(pytz.utc)
-        past_date = (now_utc - timedelta(days=1)).strftime('%d.%m')
-        due_utc, _, _ = parse_task_input(past_date, 'UTC')
-        self.assertGreater(due_utc, datetime.now(pytz.utc))
-
-    def test_time_only_moves_to_next_day(self):
-        now_utc = datetime.now(pytz.utc)
-        past = now_utc - timedelta(hours=1)
-        past_time = past.strftime('%H:%M')
-        due_utc, _, _ = parse_task_input(past_time, 'UTC')
-        expected = (past + timedelta(days=1)).replace(second=0, microsecond=0)
-        self.assertEqual(due_utc, expected)
-
-    def test_h_time_format(self):
-        now_utc = datetime.now(pytz.utc)
-        due_utc, _, _ = parse_task_input('14h', 'UTC')
-        expected = now_utc.replace(hour=14, minute=0, second=0, microsecond=0)
-        if expected <= now_utc:
-            expected += timedelta(days=1)
-        self.assertEqual(due_utc, expected)
-    def test_cyrillic_hour_format(self):
-        now_utc = datetime.now(pytz.utc)
-        due_utc, _, _ = parse_task_input('14ч', 'UTC')
-        expected = now_utc.replace(hour=14, minute=0, second=0, microsecond=0)
-        if expected <= now_utc:
-            expected += timedelta(days=1)
-        self.assertEqual(due_utc, expected)
-
-    def test_hour_minute_combo(self):
-        now_utc = datetime.now(pytz.utc)
-        for txt in ['14h30min', '14ч30мин']:
-            due_utc, _, _ = parse_task_input(txt, 'UTC')
-            expected = now_utc.replace(hour=14, minute=30, second=0, microsecond=0)
-            if expected <= now_utc:
-                expected += timedelta(days=1)
-            self.assertEqual(due_utc, expected)
-
-    def test_minute_only_format(self):
-        now_utc = datetime.now(pytz.utc)
-        due_en, _, _ = parse_task_input('14min', 'UTC')
-        expected = now_utc.replace(hour=0, minute=14, second=0, microsecond=0)
-        if expected <= now_utc:
-            expected += timedelta(days=1)
-        self.assertEqual(due_en, expected)
-        due_ru, _, _ = parse_task_input('14мин', 'UTC')
-        self.assertEqual(due_en, due_ru)
+from bot import _parse_numeric_date, _parse_hhmm, _fast_parse_reschedule, _leftover_move_times
+from services.short_ids import short_id_for
+
+
+class TestNumericDateParse(unittest.TestCase):
+    TODAY = date(2026, 3, 10)
+
+    def test_dd_mm_uses_current_year(self):
+        self.assertEqual(_parse_numeric_date('05.04', self.TODAY), date(2026, 4, 5))
+
+    def test_dd_mm_yy(self):
+        self.assertEqual(_parse_numeric_date('05.04.27', self.TODAY), date(2027, 4, 5))
+
+    def test_dd_mm_yyyy_with_slashes(self):
+        self.assertEqual(_parse_numeric_date('05/04/2027', self.TODAY), date(2027, 4, 5))
+
+    def test_iso_date(self):
+        self.assertEqual(_parse_numeric_date('2027-04-05', self.TODAY), date(2027, 4, 5))
+
+    def test_impossible_date_is_left_to_ai(self):
+        self.assertIsNone(_parse_numeric_date('31.02', self.TODAY))
+
+    def test_not_a_date(self):
+        for txt in ['tomorrow', '5.4.123', '123.04', '05.04.2027.1']:
+            self.assertIsNone(_parse_numeric_date(txt, self.TODAY))
+
+
+class TestHHMMParse(unittest.TestCase):
+    def test_valid_times(self):
+        self.assertEqual(_parse_hhmm('09:30'), '09:30')
+        self.assertEqual(_parse_hhmm('9:30'), '09:30')
+        self.assertEqual(_parse_hhmm('23:59'), '23:59')
+
+    def test_single_digit_minutes(self):
+        self.assertEqual(_parse_hhmm('9:5'), '09:05')
+
+    def test_padded_whitespace(self):
+        self.assertEqual(_parse_hhmm(' 9 : 05 '), '09:05')
+
+    def test_out_of_range(self):
+        for txt in ['24:00', '12:60', '123:00', '12:345']:
+            self.assertIsNone(_parse_hhmm(txt))
+
+    def test_malformed(self):
+        for txt in ['1230', ':30', '12:', 'ab:cd', '']:
+            self.assertIsNone(_parse_hhmm(txt))
+
+
+class TestFastParseReschedule(unittest.TestCase):
+    TZ = pytz.timezone('Europe/Berlin')
+
+    def setUp(self):
+        # Вторник, 10 марта 2026, 12:00 по Берлину
+        self.now = self.TZ.localize(datetime(2026, 3, 10, 12, 0))
+
+    def _local(self, *args):
+        return self.TZ.localize(datetime(*args))
+
+    def test_time_later_today(self):
+        self.assertEqual(_fast_parse_reschedule('15:30', self.TZ, self.now), self._local(2026, 3, 10, 15, 30))
+
+    def test_past_time_moves_to_tomorrow(self):
+        self.assertEqual(_fast_parse_reschedule('9:00', self.TZ, self.now), self._local(2026, 3, 11, 9, 0))
+
+    def test_day_word_in_any_order(self):
+        expected = self._local(2026, 3, 11, 9, 0)
+        self.assertEqual(_fast_parse_reschedule('tomorrow 9:00', self.TZ, self.now), expected)
+        self.assertEqual(_fast_parse_reschedule('9:00 завтра', self.TZ, self.now), expected)
+
+    def test_weekday(self):
+        self.assertEqual(_fast_parse_reschedule('пт 10:00', self.TZ, self.now), self._local(2026, 3, 13, 10, 0))
+
+    def test_same_weekday_past_time_moves_a_week(self):
+        self.assertEqual(_fast_parse_reschedule('tue 9:00', self.TZ, self.now), self._local(2026, 3, 17, 9, 0))
+
+    def test_unrecognized(self):
+        for txt in ['next week', 'someday 10:00', 'tomorrow at 10:00', '']:
+            self.assertIsNone(_fast_parse_reschedule(txt, self.TZ, self.now))
+
+
+class TestLeftoverMoveTimes(unittest.TestCase):
+    TZ = pytz.timezone('Europe/Berlin')
+
+    def setUp(self):
+        self.now = self.TZ.localize(datetime(2026, 3, 10, 21, 0))
+        self.morning_utc = self.TZ.localize(datetime(2026, 3, 11, 9, 0)).astimezone(pytz.utc)
+
+    def test_all_day_moves_to_morning(self):
+        start, end = _leftover_move_times('2026-03-10', '2026-03-11', self.TZ, self.now, self.morning_utc)
+        self.assertEqual(start, self.morning_utc)
+        self.assertEqual(end, self.morning_utc + timedelta(hours=1))
+
+    def test_timed_event_moves_one_day_keeping_duration(self):
+        start, end = _leftover_move_times(
+            '2026-03-10T15:00:00+01:00', '2026-03-10T16:30:00+01:00', self.TZ, self.now, self.morning_utc
+        )
+        self.assertEqual(start, self.TZ.localize(datetime(2026, 3, 11, 15, 0)).astimezone(pytz.utc))
+        self.assertEqual(end - start, timedelta(minutes=90))
+
+
+class TestShortId(unittest.TestCase):
+    def test_deterministic_base62(self):
+        short_id = short_id_for('event123', 42)
+        self.assertEqual(short_id, short_id_for('event123', 42))
+        self.assertEqual(len(short_id), 6)
+        self.assertTrue(short_id.isalnum() and short_id.isascii())
+
+    def test_depends_on_chat(self):
+        self.assertNotEqual(short_id_for('event123', 42), short_id_for('event123', 43))
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()